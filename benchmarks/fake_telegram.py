@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import mimetypes
+import os
+import random
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+from telethon import types
+from telethon.errors import FloodWaitError
+
+
+@dataclass
+class FakeMessage:
+    """
+    Сообщение с теми полями telethon Message, которые использует ChatsHandler
+    """
+    id: int
+    chat_id: int
+    message: str
+    date: datetime.datetime
+    grouped_id: Optional[int] = None
+    media: Any = None
+    photo: Any = None
+    document: Any = None
+    file: Any = None
+    entities: Optional[list] = None
+
+    @property
+    def text(self) -> str:
+        return self.message
+
+    @property
+    def peer_id(self):
+        return SimpleNamespace(channel_id=self.chat_id)
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'message': self.message, 'date': self.date, 'grouped_id': self.grouped_id}
+
+
+@dataclass
+class FakeEvent:
+    message: FakeMessage
+    chat: Any = None
+
+    def __post_init__(self):
+        if self.chat is None:
+            self.chat = SimpleNamespace(id=self.message.chat_id)
+
+
+def fake_message(message_id: int, chat_id: int, text: str, media_type: Optional[str] = None) -> FakeMessage:
+    """
+    Собрать сообщение, при необходимости с фото или документом
+    :param media_type: photo, document или None
+    """
+    message = FakeMessage(
+        id=message_id,
+        chat_id=chat_id,
+        message=text,
+        date=datetime.datetime.now(datetime.timezone.utc)
+    )
+
+    if media_type is not None:
+        stub_media(message, media_type)
+
+    return message
+
+
+def stub_media(
+        message: FakeMessage,
+        media_type: str,
+        media_id: Optional[int] = None,
+        mime_type: Optional[str] = None,
+        size: Optional[int] = None,
+        file_name: Optional[str] = None
+) -> FakeMessage:
+    """
+    Прикрепить к сообщению заглушку файла: те поля media, photo/document и file, которые читает ChatsHandler
+    :param media_type: photo, document или webpage
+    """
+    media_id = media_id if media_id is not None else random.getrandbits(62)
+
+    if media_type == 'photo':
+        mime_type = mime_type or 'image/jpeg'
+        size = size if size is not None else 200 * 1024
+        message.media = types.MessageMediaPhoto()
+        message.photo = SimpleNamespace(id=media_id)
+    elif media_type == 'document':
+        mime_type = mime_type or 'application/pdf'
+        size = size if size is not None else 2 * 1024 * 1024
+        attributes = [types.DocumentAttributeFilename(file_name=file_name)] if file_name else []
+        message.media = types.MessageMediaDocument()
+        message.document = SimpleNamespace(id=media_id, size=size, mime_type=mime_type, attributes=attributes)
+    elif media_type == 'webpage':
+        message.media = types.MessageMediaWebPage(webpage=types.WebPageEmpty(id=media_id))
+        return message
+    else:
+        raise ValueError(f"Unknown media type {media_type}")
+
+    ext = os.path.splitext(file_name)[1] if file_name and '.' in file_name else mimetypes.guess_extension(mime_type)
+    message.file = SimpleNamespace(ext=ext or '', mime_type=mime_type, size=size)
+    return message
+
+
+MEDIA_TYPES = {
+    'MessageMediaPhoto': 'photo',
+    'MessageMediaDocument': 'document',
+    'MessageMediaWebPage': 'webpage',
+}
+
+
+def _parse_date(value) -> datetime.datetime:
+    date = value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+    return date if date.tzinfo else date.replace(tzinfo=datetime.timezone.utc)
+
+
+def _chat_id(peer: dict) -> int:
+    return peer.get('channel_id') or peer.get('chat_id') or peer.get('user_id')
+
+
+def message_from_dict(data: dict) -> FakeMessage:
+    """
+    Собрать сообщение из записи event.message.to_dict() (даты - строками ISO).
+    Вместо media может быть заглушка {"_": "MessageMediaDocument", "id", "mime_type", "size", "file_name"},
+    полные media из to_dict тоже разбираются; неизвестные типы media пропускаются
+    """
+    message = FakeMessage(
+        id=data['id'],
+        chat_id=_chat_id(data['peer_id']),
+        message=data.get('message') or '',
+        date=_parse_date(data['date']),
+        grouped_id=data.get('grouped_id'),
+        entities=[
+            types.MessageEntityTextUrl(offset=el['offset'], length=el['length'], url=el['url'])
+            for el in data.get('entities') or [] if el.get('_') == 'MessageEntityTextUrl'
+        ] or None
+    )
+
+    media = data.get('media') or {}
+    media_type = MEDIA_TYPES.get(media.get('_'))
+
+    if media_type is None:
+        return message
+
+    inner = media.get('photo') or media.get('document') or {}
+    file_name = media.get('file_name') or next(
+        (el['file_name'] for el in inner.get('attributes', []) if el.get('_') == 'DocumentAttributeFilename'), None
+    )
+
+    return stub_media(
+        message,
+        media_type,
+        media_id=media.get('id', inner.get('id')),
+        mime_type=media.get('mime_type', inner.get('mime_type')),
+        size=media.get('size', inner.get('size')),
+        file_name=file_name
+    )
+
+
+@dataclass
+class FakeClient:
+    """
+    Заглушка TelegramClient: запоминает отправки, имитирует скачивание файлов и FloodWait
+    :param download_latency: задержка скачивания одного файла в секундах
+    :param download_size: размер скачанного файла в байтах
+    :param flood_every: каждая N-я отправка падает с FloodWait (0 - никогда)
+    :param flood_seconds: длительность FloodWait
+    """
+    download_latency: float = 0.0
+    download_size: int = 64 * 1024
+    flood_every: int = 0
+    flood_seconds: int = 0
+    sent: List[tuple] = field(default_factory=list)
+    send_attempts: int = 0
+    flood_waits: int = 0
+
+    def _maybe_flood(self):
+        self.send_attempts += 1
+
+        if self.flood_every and self.send_attempts % self.flood_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def download_media(self, media, file=None, **kwargs):
+        await asyncio.sleep(self.download_latency)
+
+        if file is bytes:
+            return os.urandom(self.download_size)
+
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, 'wb') as f:
+            f.write(os.urandom(self.download_size))
+
+        return file
+
+    async def forward_messages(self, entity, messages, *args, **kwargs):
+        self._maybe_flood()
+        self.sent.append(('forward', entity, messages))
+
+    async def send_message(self, entity, message=None, **kwargs):
+        self._maybe_flood()
+        self.sent.append(('message', entity, message))
+
+    async def send_file(self, entity, file=None, **kwargs):
+        self._maybe_flood()
+        self.sent.append(('file', entity, file))
@@ -0,0 +1,226 @@
+"""
+Воспроизведение записанного потока сообщений через ChatsHandler.normal_handler без живого аккаунта телеграм.
+
+Поток - JSONL с event.message.to_dict() и заглушками файлов, так пишет приложение с RECORD_MESSAGES_FILENAME.
+Ключевые слова и темы загружаются из файла /exportKeywords.
+
+Запуск из корня проекта:
+    python -m benchmarks.replay messages.jsonl --keywords keywords_export.json --speed 10
+    python -m benchmarks.replay messages.jsonl --keywords keywords_export.json --golden golden.json --write-golden
+    python -m benchmarks.replay messages.jsonl --keywords keywords_export.json --golden golden.json
+
+--speed 0 подает сообщения по одному без пауз (максимальная пропускная способность, результат детерминирован),
+иначе сообщения приходят с записанными интервалами, ускоренными в --speed раз, и обрабатываются параллельно, как в telethon.
+С --golden результат (пересланные сообщения, дубликаты, скачанные файлы) сравнивается с эталоном, при расхождении
+код выхода 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List
+
+from benchmarks.run import prepare_environment, report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('messages', help='файл JSONL с записанными сообщениями')
+    parser.add_argument('--keywords', help='файл /exportKeywords (json или csv) с ключевыми словами и темами')
+    parser.add_argument('--speed', type=float, default=0, help='ускорение относительно записи, 0 - без пауз')
+    parser.add_argument('--limit', type=int, default=0, help='воспроизвести только первые N сообщений')
+    parser.add_argument('--download-latency', type=float, default=0.0, help='задержка скачивания файла, с')
+    parser.add_argument('--golden', help='файл эталонного результата')
+    parser.add_argument('--write-golden', action='store_true', help='записать результат в --golden вместо сравнения')
+    return parser.parse_args()
+
+
+def read_messages(path: str, limit: int = 0) -> list:
+    from benchmarks.fake_telegram import message_from_dict
+
+    messages = []
+
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            messages.append(message_from_dict(json.loads(line)))
+
+            if limit and len(messages) >= limit:
+                break
+
+    return messages
+
+
+async def load_keywords(path: str):
+    """
+    Загрузить ключевые слова и темы так же, как /importKeywords, но без задач планировщика
+    """
+    from data.db_manager import DBManager
+    from keywords.transfer import parse_import_file, expand_keywords
+
+    with open(path, 'rb') as f:
+        data = parse_import_file(path, f.read())
+
+    forms = set(data.forms) | set(await expand_keywords(list(dict.fromkeys(data.keywords))))
+    missing = await DBManager().themes.import_themes(list(forms), data.themes)
+
+    print(f"keywords={len(forms)} themes={len(data.themes)} missing theme keywords={len(missing)}")
+
+
+async def replay(handler, messages: list, speed: float) -> List[float]:
+    """
+    Подать сообщения в normal_handler
+    :return: задержка каждого сообщения от момента поступления по расписанию до конца обработки
+    """
+    from benchmarks.fake_telegram import FakeEvent
+
+    latencies = []
+
+    if not speed:
+        for message in messages:
+            start = time.perf_counter()
+            await handler.normal_handler(FakeEvent(message))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    first_date = messages[0].date
+    started = time.perf_counter()
+
+    async def handle(message, due: float):
+        await handler.normal_handler(FakeEvent(message))
+        latencies.append(time.perf_counter() - due)
+
+    tasks = []
+    for message in messages:
+        due = started + max((message.date - first_date).total_seconds(), 0) / speed
+        await asyncio.sleep(max(due - time.perf_counter(), 0))
+        tasks.append(asyncio.create_task(handle(message, due)))
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def collect_result(client) -> dict:
+    """
+    Результат обработки, который сравнивается с эталоном: все списки отсортированы
+    """
+    from sqlalchemy import select
+
+    from config import async_session
+    from data import MessagesModel, FilesModel
+
+    forwarded = []
+    for kind, _, messages in client.sent:
+        if kind == 'forward':
+            for message in messages if isinstance(messages, list) else [messages]:
+                forwarded.append([str(message.chat_id), str(message.id)])
+
+    async with async_session() as session:
+        messages = (await session.execute(
+            select(MessagesModel.chat_id, MessagesModel.message_id, MessagesModel.duplicate_of)
+        )).all()
+        files = (await session.execute(
+            select(FilesModel.chat_id, FilesModel.message_id, FilesModel.file_type)
+        )).all()
+
+    return {
+        'messages': len(messages),
+        'forwarded': sorted(forwarded),
+        'duplicates': sorted([row.chat_id, row.message_id] for row in messages if row.duplicate_of is not None),
+        'files': sorted([row.chat_id, row.message_id, row.file_type] for row in files),
+    }
+
+
+def compare(result: dict, golden: dict) -> List[str]:
+    differences = []
+
+    for key in sorted(set(result) | set(golden)):
+        actual, expected = result.get(key), golden.get(key)
+
+        if actual == expected:
+            continue
+
+        if isinstance(actual, list) and isinstance(expected, list):
+            actual_set = {tuple(el) for el in actual}
+            expected_set = {tuple(el) for el in expected}
+            differences.append(
+                f"{key}: missing {sorted(expected_set - actual_set)[:10]}, extra {sorted(actual_set - expected_set)[:10]}"
+            )
+        else:
+            differences.append(f"{key}: {actual} != {expected}")
+
+    return differences
+
+
+async def run(args: argparse.Namespace, workdir: str) -> int:
+    from benchmarks.fake_telegram import FakeClient
+    from chats import ChatsHandler
+    from config import engine
+    from data import Base
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    if args.keywords:
+        await load_keywords(args.keywords)
+
+    messages = read_messages(args.messages, args.limit)
+    if not messages:
+        print("no messages to replay")
+        return 1
+
+    client = FakeClient(download_latency=args.download_latency)
+    handler = ChatsHandler(client)
+    await handler.db_manager.messages.create_search_index()
+
+    print(f"workdir: {workdir}")
+    print(f"messages={len(messages)} speed={args.speed or 'max'}\n")
+
+    start = time.perf_counter()
+    latencies = await replay(handler, messages, args.speed)
+    report('replay normal_handler', latencies, time.perf_counter() - start)
+
+    result = await collect_result(client)
+    print(f"\nstored={result['messages']} forwarded={len(result['forwarded'])} "
+          f"duplicates={len(result['duplicates'])} files={len(result['files'])}")
+
+    if not args.golden:
+        return 0
+
+    if args.write_golden:
+        with open(args.golden, 'w', encoding='utf8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+        print(f"golden output written to {args.golden}")
+        return 0
+
+    with open(args.golden, encoding='utf8') as f:
+        differences = compare(result, json.load(f))
+
+    if differences:
+        print("\ngolden output mismatch:")
+        for line in differences:
+            print(f"  {line}")
+        return 1
+
+    print("golden output matches")
+    return 0
+
+
+def main():
+    args = parse_args()
+    # пути из аргументов считаются от папки запуска, до перехода во временную папку
+    for name in ('messages', 'keywords', 'golden'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    workdir = prepare_environment('telethon_replay_')
+
+    sys.exit(asyncio.run(run(args, workdir)))
+
+
+if __name__ == '__main__':
+    main()
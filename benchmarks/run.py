@@ -0,0 +1,292 @@
+"""
+Бенчмарк обработки сообщений без живого аккаунта телеграм.
+
+Запуск из корня проекта:
+    python -m benchmarks.run --messages 2000 --keywords 5000 --themes 20 --channels 50
+
+Все данные (бд, медиа, логи) создаются во временной папке
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Awaitable, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LETTERS = 'абвгдежзиклмнопрстуфхцчшщыэюя'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help='количество входящих сообщений')
+    parser.add_argument('--keywords', type=int, default=1000, help='количество ключевых слов в бд')
+    parser.add_argument('--themes', type=int, default=10, help='количество отслеживаемых тем')
+    parser.add_argument('--channels', type=int, default=20, help='количество чатов-источников')
+    parser.add_argument('--words', type=int, default=30, help='слов в одном сообщении')
+    parser.add_argument('--match-ratio', type=float, default=0.1, help='доля сообщений с ключевым словом')
+    parser.add_argument('--media-ratio', type=float, default=0.2, help='доля сообщений с файлом')
+    parser.add_argument('--download-latency', type=float, default=0.0, help='задержка скачивания файла, с')
+    parser.add_argument('--flood-every', type=int, default=0, help='каждая N-я отправка получает FloodWait')
+    parser.add_argument('--interval', type=int, default=60, help='интервал тем в секундах')
+    parser.add_argument('--seed', type=int, default=1, help='seed генератора данных')
+    parser.add_argument('--memory-messages', type=int, default=5000,
+                        help='сообщений в бд при замере памяти выборки для рассылки')
+    return parser.parse_args()
+
+
+def random_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(LETTERS) for _ in range(rng.randint(4, 10)))
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def report(name: str, latencies: List[float], total_seconds: float):
+    rate = len(latencies) / total_seconds if total_seconds else 0.0
+    print(
+        f"{name:<32} n={len(latencies):<7} {rate:>10.1f} ops/s "
+        f"p50={percentile(latencies, 0.5) * 1000:>8.2f} ms  p99={percentile(latencies, 0.99) * 1000:>8.2f} ms"
+    )
+
+
+async def measure(name: str, calls: List[Callable[[], Awaitable]]) -> List[float]:
+    latencies = []
+    start = time.perf_counter()
+
+    for call in calls:
+        call_start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - call_start)
+
+    report(name, latencies, time.perf_counter() - start)
+    return latencies
+
+
+async def measure_memory(name: str, call: Callable[[], Awaitable[Any]]) -> int:
+    """
+    Память, которую занимает результат вызова (пока он жив), и пиковая память во время вызова
+    """
+    tracemalloc.start()
+    try:
+        result = await call()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    count = len(result) if hasattr(result, '__len__') else 0
+    per_item = retained / count if count else 0.0
+    print(
+        f"{name:<32} n={count:<7} retained={retained / 1024 / 1024:>8.2f} MB  "
+        f"peak={peak / 1024 / 1024:>8.2f} MB  {per_item:>8.0f} B/item"
+    )
+    return retained
+
+
+async def seed(args: argparse.Namespace, keywords: List[str]):
+    from config import async_session
+    from data import KeywordsModel, ThemeModel
+
+    async with async_session() as session:
+        keyword_models = [KeywordsModel(word=word) for word in keywords]
+        session.add_all(keyword_models)
+
+        per_theme = max(1, len(keyword_models) // max(args.themes, 1))
+        for i in range(args.themes):
+            session.add(ThemeModel(
+                theme_name=f"theme_{i}",
+                interval=args.interval,
+                is_following=True,
+                keywords=keyword_models[i * per_theme:(i + 1) * per_theme]
+            ))
+
+        await session.commit()
+
+
+async def set_delivery_mode(delivery_mode: str):
+    from sqlalchemy import update
+
+    from config import async_session
+    from data import ThemeModel
+
+    async with async_session() as session:
+        await session.execute(update(ThemeModel).values(delivery_mode=delivery_mode))
+        await session.commit()
+
+
+async def run(args: argparse.Namespace, workdir: str):
+    from benchmarks.fake_telegram import FakeClient, FakeEvent, fake_message
+    from chats import ChatsHandler
+    from config import SQLITE_DATABASE_PATH, THEME_DELIVERY_DIGEST, engine
+    from data import Base
+    from data.dataclasses import MessageDB
+    from scheduler_manager import ThemeSchedulerManager
+
+    rng = random.Random(args.seed)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    vocabulary = list({random_word(rng) for _ in range(max(args.keywords * 3, 5000))})
+    keywords = rng.sample(vocabulary, min(args.keywords, len(vocabulary)))
+    plain_words = list(set(vocabulary) - set(keywords))
+
+    await seed(args, keywords)
+
+    client = FakeClient(download_latency=args.download_latency, flood_every=args.flood_every)
+    handler = ChatsHandler(client)
+    await handler.db_manager.messages.create_search_index()
+
+    def message_text() -> str:
+        words = rng.sample(plain_words, args.words)
+        if keywords and rng.random() < args.match_ratio:
+            words[rng.randrange(len(words))] = rng.choice(keywords)
+        return ' '.join(words)
+
+    events = []
+    for i in range(args.messages):
+        media_type = rng.choice(['photo', 'document']) if rng.random() < args.media_ratio else None
+        events.append(FakeEvent(fake_message(
+            message_id=i + 1,
+            chat_id=1000 + rng.randrange(args.channels),
+            text=message_text(),
+            media_type=media_type
+        )))
+
+    print(f"workdir: {workdir}")
+    print(f"messages={args.messages} keywords={len(keywords)} themes={args.themes} channels={args.channels}\n")
+
+    await measure('ChatsHandler.normal_handler', [lambda ev=ev: handler.normal_handler(ev) for ev in events])
+    forwards = len([el for el in client.sent if el[0] == 'forward'])
+
+    texts = [ev.message.text.lower() for ev in events[:min(len(events), 500)]]
+    await measure('KeywordsHandler.check_contains', [lambda t=t: handler.kh.check_contains(t) for t in texts])
+
+    messages_dm = handler.db_manager.messages
+    extra = [
+        MessageDB(chat_id='1', message_id=str(i), message=message_text(), date=events[0].message.date)
+        for i in range(200)
+    ]
+    await measure('MessagesDataManager.add_message', [lambda m=m: messages_dm.add_message(m) for m in extra])
+    await measure(
+        'MessagesDataManager.search_messages',
+        [lambda w=w: messages_dm.search_messages(w, limit=10) for w in rng.sample(keywords or plain_words, 50)]
+    )
+    await measure('ThemesDataManager.all_themes', [handler.db_manager.themes.all_themes for _ in range(20)])
+
+    scheduler_manager = ThemeSchedulerManager()
+    scheduler_manager.client = client
+    sent_before = len(client.sent)
+    await measure(
+        'ThemeSchedulerManager._send_messages_job',
+        [lambda: scheduler_manager._send_messages_job(args.interval)]
+    )
+    sent_by_theme_job = len(client.sent) - sent_before
+
+    await set_delivery_mode(THEME_DELIVERY_DIGEST)
+    sent_before = len(client.sent)
+    await measure(
+        'ThemeSchedulerManager digest job',
+        [lambda: scheduler_manager._send_messages_job(args.interval)]
+    )
+    sent_by_digest_job = len(client.sent) - sent_before
+
+    await run_memory(args, messages_dm, message_text, events[0].message.date)
+
+    print()
+    print(f"forwarded by normal_handler:     {forwards}")
+    print(f"sent by theme job:               {sent_by_theme_job}")
+    print(f"sent by digest job:              {sent_by_digest_job}")
+    print(f"flood waits:                     {client.flood_waits}")
+    print(f"database size:                   {os.path.getsize(SQLITE_DATABASE_PATH) / 1024 / 1024:.2f} MB")
+
+
+async def run_memory(args: argparse.Namespace, messages_dm, message_text: Callable[[], str], date):
+    """
+    Сравнение выборки сообщений для рассылки: ORM объекты с joinedload (как было) и строки в DTO со слотами
+    """
+    from dataclasses import dataclass
+    from typing import Optional
+
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload
+
+    from config import async_session
+    from data import MessagesModel
+    from data.dataclasses import MessageDB
+
+    extra = [
+        MessageDB(chat_id='2', message_id=str(i), message=message_text(), date=date)
+        for i in range(args.memory_messages)
+    ]
+    await messages_dm.add_messages(extra, [])
+
+    print()
+
+    async def orm_messages():
+        async with async_session() as session:
+            result = await session.execute(select(MessagesModel).options(joinedload(MessagesModel.files)))
+            return result.unique().scalars().all()
+
+    await measure_memory('ORM MessagesModel + joinedload', orm_messages)
+    await measure_memory('Core rows -> DeliveryMessageDB', lambda: messages_dm.get_message_by_interval(date.min))
+
+    @dataclass
+    class PlainMessageDB:
+        chat_id: str
+        message_id: str
+        message: str
+        date: object
+        links: Optional[str] = None
+        grouped_id: Optional[int] = None
+        fingerprint: Optional[str] = None
+        duplicate_of: Optional[int] = None
+
+    async def build(cls):
+        return [cls(chat_id=el.chat_id, message_id=el.message_id, message=el.message, date=el.date) for el in extra]
+
+    await measure_memory('dataclass MessageDB (__dict__)', lambda: build(PlainMessageDB))
+    await measure_memory('dataclass MessageDB (__slots__)', lambda: build(MessageDB))
+
+
+def prepare_environment(prefix: str = 'telethon_bench_') -> str:
+    """
+    Создать временную папку и окружение для запуска модулей проекта без живого аккаунта.
+    Конфиг читается при импорте, поэтому вызывается до импорта модулей проекта
+    :return: временная папка (бд, медиа и логи)
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', 'benchmark')
+    os.environ['SQLITE_DATABASE_PATH'] = os.path.join(workdir, 'benchmark.db')
+    os.environ['SCHEDULER_JOBSTORE_URL'] = 'sqlite://'
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['SEND_DELAY_SECONDS'] = '0'
+    os.environ['MEDIA_STORAGE'] = 'local'
+    os.environ['MEDIA_ROOT'] = os.path.join(workdir, 'media')
+    os.environ['RECORD_MESSAGES_FILENAME'] = ''
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(workdir)
+
+    return workdir
+
+
+def main():
+    args = parse_args()
+    workdir = prepare_environment()
+
+    asyncio.run(run(args, workdir))
+
+
+if __name__ == '__main__':
+    main()
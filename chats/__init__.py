@@ -1 +1,3 @@
 from .chats_handlers import ChatsHandler
+from .backfill import BackfillManager
+from .dialogs import DialogCache
@@ -0,0 +1,258 @@
+import asyncio
+import datetime
+from dataclasses import replace
+from typing import Dict, Optional, Set
+
+from loguru import logger
+from telethon import TelegramClient, types
+from telethon.errors import FloodWaitError
+
+from config import LoggerTags, BACKFILL_DAYS, BACKFILL_BATCH_SIZE, BACKFILL_REQUEST_DELAY, BACKFILL_BATCH_DELAY, \
+    TIMEZONE, CATCH_UP_CONCURRENCY, CATCH_UP_MAX_MESSAGES, OUTBOUND_LANE_URGENT
+from data.dataclasses import BackfillCheckpointDB
+from metrics import record_flood_wait
+from .chats_handlers import ChatsHandler
+
+
+def _chat_entity_key(chat: str) -> str | int:
+    return int(chat) if chat.lstrip('-').isdigit() else chat
+
+
+class BackfillManager:
+    """
+    Загрузка истории прослушиваемых чатов через iter_messages.
+    Прогресс по каждому чату хранится в бд (min_id чекпоинт), поэтому после падения
+    загрузка продолжается с последней сохраненной пачки.
+    Также догружает сообщения, пропущенные за время отключения (catch_up) и пропуски id в каналах,
+    которые заметил обработчик новых сообщений (fill_gap). Пропущенные новые сообщения пересылаются
+    в полосе реального времени, история - в полосе bulk. После догрузки catch_up докачивает файлы,
+    которые не удалось скачать при получении сообщений
+    """
+
+    def __init__(self, client: TelegramClient, chats_handler: ChatsHandler):
+        self.client = client
+        self.ch = chats_handler
+        self.db_manager = chats_handler.db_manager
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.catch_up_task: Optional[asyncio.Task] = None
+        self.gap_tasks: Set[asyncio.Task] = set()
+        # общий лимит одновременной догрузки для catch_up и пропусков
+        self.semaphore = asyncio.Semaphore(CATCH_UP_CONCURRENCY)
+
+        chats_handler.gap_handler = self.fill_gap
+
+    def start(self, chat: str | int):
+        """
+        Запустить загрузку истории чата в фоне, если она еще не идет
+        :param chat: ссылка на чат или id, как в списке прослушиваемых
+        """
+        chat_key = str(chat)
+
+        if chat_key in self.tasks and not self.tasks[chat_key].done():
+            return
+
+        self.tasks[chat_key] = asyncio.create_task(self.backfill_chat(chat_key))
+
+    def stop(self, chat: str | int):
+        """
+        Остановить загрузку истории чата
+        :param chat: ссылка на чат или id, как в списке прослушиваемых
+        """
+        task = self.tasks.pop(str(chat), None)
+
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def resume(self):
+        """
+        Продолжить незавершенные загрузки истории (после перезапуска)
+        """
+        checkpoints = await self.db_manager.backfill.unfinished_checkpoints()
+
+        for checkpoint in checkpoints:
+            logger.info(f"{LoggerTags.HANDLER.value} Resume backfill for {checkpoint.chat_id} "
+                        f"from message id={checkpoint.last_message_id}")
+            self.start(checkpoint.chat_id)
+
+    def start_catch_up(self):
+        """
+        Запустить догрузку пропущенных сообщений в фоне, если она еще не идет
+        """
+        if self.catch_up_task is not None and not self.catch_up_task.done():
+            return
+
+        self.catch_up_task = asyncio.create_task(self.catch_up())
+
+    def fill_gap(self, chat_id: str, peer: types.PeerChannel, min_id: int, max_id: int):
+        """
+        Догрузить в фоне сообщения канала с id между min_id и max_id (не включая их)
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Gap in {chat_id} between message ids {min_id} and {max_id}")
+
+        task = asyncio.create_task(self._fill_gap(chat_id, peer, min_id, max_id))
+        self.gap_tasks.add(task)
+        task.add_done_callback(self.gap_tasks.discard)
+
+    async def _fill_gap(self, chat_id: str, peer: types.PeerChannel, min_id: int, max_id: int):
+        async with self.semaphore:
+            try:
+                while True:
+                    try:
+                        batch = [
+                            message async for message in self.client.iter_messages(
+                                peer,
+                                min_id=min_id,
+                                max_id=max_id,
+                                reverse=True,
+                                limit=min(max_id - min_id - 1, CATCH_UP_MAX_MESSAGES),
+                                wait_time=BACKFILL_REQUEST_DELAY
+                            )
+                        ]
+                        break
+                    except FloodWaitError as e:
+                        logger.warning(f"{LoggerTags.HANDLER.value} Gap {chat_id} flood wait {e.seconds} seconds")
+                        record_flood_wait(e.seconds, 'catch_up')
+                        await asyncio.sleep(e.seconds)
+
+                if batch:
+                    added = await self.ch.ingest_messages(chat_id, batch, OUTBOUND_LANE_URGENT)
+                    logger.info(f"{LoggerTags.HANDLER.value} Filled gap in {chat_id}: {added} messages")
+            except Exception as e:
+                logger.error(f"Ошибка при догрузке пропущенных сообщений чата {chat_id}: {e}")
+
+    async def catch_up(self):
+        """
+        Догрузить сообщения, пришедшие пока приложение было отключено.
+        Для каждого прослушиваемого чата загружаются сообщения с id больше последнего сохраненного,
+        чаты обрабатываются параллельно, не больше CATCH_UP_CONCURRENCY одновременно
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Catch up missed messages")
+
+        last_ids = await self.db_manager.messages.get_last_message_ids()
+        chats = await self.db_manager.listening_chats.all_listening_chats()
+
+        async def catch_up_chat(chat_key: str) -> int:
+            async with self.semaphore:
+                try:
+                    return await self._catch_up_chat(chat_key, last_ids)
+                except Exception as e:
+                    logger.error(f"Ошибка при догрузке сообщений чата {chat_key}: {e}")
+                    return 0
+
+        added = await asyncio.gather(*[catch_up_chat(chat.chat_id) for chat in chats])
+
+        logger.success(f"{LoggerTags.HANDLER.value} Caught up {sum(added)} missed messages")
+
+        # файлы, которые не скачались при получении сообщений, докачиваются тем же проходом
+        try:
+            await self.ch.retry_pending_downloads()
+        except Exception as e:
+            logger.error(f"Ошибка при повторном скачивании файлов: {e}")
+
+    async def _catch_up_chat(self, chat_key: str, last_ids: Dict[str, int]) -> int:
+        entity = await self.client.get_entity(_chat_entity_key(chat_key))
+        last_id = last_ids.get(str(entity.id))
+
+        # чаты без сохраненных сообщений догружает backfill
+        if last_id is None:
+            return 0
+
+        added = 0
+        fetched = 0
+
+        while fetched < CATCH_UP_MAX_MESSAGES:
+            try:
+                batch = [
+                    message async for message in self.client.iter_messages(
+                        entity,
+                        min_id=last_id,
+                        reverse=True,
+                        limit=min(BACKFILL_BATCH_SIZE, CATCH_UP_MAX_MESSAGES - fetched),
+                        wait_time=BACKFILL_REQUEST_DELAY
+                    )
+                ]
+            except FloodWaitError as e:
+                logger.warning(f"{LoggerTags.HANDLER.value} Catch up {chat_key} flood wait {e.seconds} seconds")
+                record_flood_wait(e.seconds, 'catch_up')
+                await asyncio.sleep(e.seconds)
+                continue
+
+            if not batch:
+                break
+
+            added += await self.ch.ingest_messages(str(entity.id), batch, OUTBOUND_LANE_URGENT)
+            fetched += len(batch)
+            last_id = max(message.id for message in batch)
+
+        if added:
+            logger.info(f"{LoggerTags.HANDLER.value} Caught up {added} messages from {chat_key}")
+
+        return added
+
+    async def _first_message_id(self, entity) -> int:
+        # id последнего сообщения до начала периода загрузки, от него идет min_id
+        offset_date = datetime.datetime.now(TIMEZONE) - datetime.timedelta(days=BACKFILL_DAYS)
+        messages = await self.client.get_messages(entity, limit=1, offset_date=offset_date)
+
+        return messages[0].id if messages else 0
+
+    async def backfill_chat(self, chat_key: str):
+        """
+        Загрузить историю чата пачками, начиная с сохраненного чекпоинта
+        :param chat_key: ссылка на чат или id, как в списке прослушиваемых
+        """
+        try:
+            entity = await self.client.get_entity(_chat_entity_key(chat_key))
+            checkpoint = await self.db_manager.backfill.get_checkpoint(chat_key)
+
+            if checkpoint is None:
+                checkpoint = BackfillCheckpointDB(
+                    chat_id=chat_key,
+                    last_message_id=await self._first_message_id(entity)
+                )
+                await self.db_manager.backfill.save_checkpoint(checkpoint)
+
+            if checkpoint.is_finished:
+                return
+
+            logger.info(f"{LoggerTags.HANDLER.value} Backfill {chat_key} from message id={checkpoint.last_message_id}")
+
+            while True:
+                try:
+                    batch = [
+                        message async for message in self.client.iter_messages(
+                            entity,
+                            min_id=checkpoint.last_message_id,
+                            reverse=True,
+                            limit=BACKFILL_BATCH_SIZE,
+                            wait_time=BACKFILL_REQUEST_DELAY
+                        )
+                    ]
+                except FloodWaitError as e:
+                    logger.warning(f"{LoggerTags.HANDLER.value} Backfill {chat_key} flood wait {e.seconds} seconds")
+                    record_flood_wait(e.seconds, 'backfill')
+                    await asyncio.sleep(e.seconds)
+                    continue
+
+                if not batch:
+                    break
+
+                added = await self.ch.ingest_messages(str(entity.id), batch)
+
+                checkpoint = replace(checkpoint, last_message_id=max(message.id for message in batch))
+                await self.db_manager.backfill.save_checkpoint(checkpoint)
+
+                logger.info(f"{LoggerTags.HANDLER.value} Backfill {chat_key}: added {added} messages, "
+                            f"checkpoint id={checkpoint.last_message_id}")
+
+                if len(batch) < BACKFILL_BATCH_SIZE:
+                    break
+
+                await asyncio.sleep(BACKFILL_BATCH_DELAY)
+
+            checkpoint = replace(checkpoint, is_finished=True)
+            await self.db_manager.backfill.save_checkpoint(checkpoint)
+            logger.success(f"{LoggerTags.HANDLER.value} Backfill {chat_key} finished")
+
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке истории чата {chat_key}: {e}")
@@ -1,7 +1,9 @@
 import datetime
 import os
 import re
+from dataclasses import replace
 from pprint import pprint
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pytz
 from loguru import logger
@@ -9,28 +11,66 @@ from sqlalchemy.exc import IntegrityError
 from telethon import events, TelegramClient, types
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
 
-from config import LISTENING_CHATS_FILENAME, ALL_CHATS_FILENAME, BOT_URL, LoggerTags, UPLOAD_FOLDER, MessageFiletypes, \
-    TIMEZONE
+from config import BOT_URL, LoggerTags, MessageFiletypes, \
+    TIMEZONE, sampled_logger, DUPLICATE_WINDOW_SECONDS, DUPLICATE_MAX_DISTANCE, DUPLICATE_MIN_WORDS, SEARCH_PAGE_SIZE, \
+    OUTBOUND_LANE_URGENT, OUTBOUND_LANE_BULK, MEDIA_MODES, RECORD_MESSAGES_FILENAME, DOWNLOAD_RETRY_BATCH_SIZE
 from data import FilesModel
-from data.dataclasses import AddChatDB, MessageDB, FileDB
+from data.dataclasses import AddChatDB, MessageDB, FileDB, SearchResultDB, MediaRuleDB
 from data.db_manager import DBManager
 from keywords import KeywordsHandler
+from metrics import MESSAGES_RECEIVED, HANDLER_STAGE_SECONDS, MEDIA_DECISIONS, CHAT_MESSAGES
+from outbound import get_outbound_scheduler
+from storage import media_key, get_storage
+from tracing import tracer
+from messages.duplicates import DuplicateDetector, fingerprint_to_str, fingerprint_from_str
+from .dialogs import DialogCache
+from .downloader import MediaDownloader
+from .recorder import MessageRecorder
+from .media_policy import MediaPolicy, MediaDecision, split_list
 
 
 class ChatsHandler:
-    def __init__(self, client: TelegramClient):
+    def __init__(self, client: TelegramClient, keywords_handler: Optional[KeywordsHandler] = None):
         self.client = client
-        self.kh = KeywordsHandler()
+        self.kh = keywords_handler or KeywordsHandler()
         self.db_manager = DBManager()
+        self.dialogs = DialogCache(client, self.db_manager)
+        self.outbound = get_outbound_scheduler()
+        self.media_policy = MediaPolicy(self.db_manager, self.kh)
+        self.downloader = MediaDownloader(client, get_storage())
+        self.recorder = MessageRecorder(RECORD_MESSAGES_FILENAME) if RECORD_MESSAGES_FILENAME else None
+        self.duplicates = DuplicateDetector(
+            window_seconds=DUPLICATE_WINDOW_SECONDS,
+            max_distance=DUPLICATE_MAX_DISTANCE,
+            min_words=DUPLICATE_MIN_WORDS
+        )
+        # последний id сообщения каждого канала, полученного в реальном времени,
+        # и обработчик пропусков (chat_id, канал, id до пропуска, id после пропуска)
+        self.live_ids: Dict[str, int] = {}
+        self.gap_handler: Optional[Callable[[str, types.PeerChannel, int, int], None]] = None
+
+    async def load_fingerprints(self):
+        """
+        Заполнить индекс дубликатов сообщениями из бд за последнее окно
+        (чтобы после перезапуска репосты не считались новыми)
+        """
+        start_time = datetime.datetime.now(TIMEZONE) - self.duplicates.window
+        fingerprints = await self.db_manager.messages.get_fingerprints_since(start_time)
+
+        for el in fingerprints:
+            # SQLite возвращает даты без часового пояса, а даты новых сообщений - с ним
+            date = el.date if el.date.tzinfo else TIMEZONE.localize(el.date)
+            self.duplicates.remember(fingerprint_from_str(el.fingerprint), el.id, date)
+
+        logger.info(f"{LoggerTags.HANDLER.value} Loaded {len(fingerprints)} message fingerprints")
 
     async def check_chat_existing(self, chat: str | int) -> bool:
         """
-        проверить наличие чата среди всех чатов пользователя
-        проверка только на чаты, где chat_id - число, а не ссылка
-        :param chat:
+        проверить наличие чата среди всех чатов пользователя (по локальному кэшу диалогов)
+        :param chat: id чата или ссылка
         :return:
         """
-        return True if chat in [str(el.entity.id) for el in await self.client.get_dialogs()] else False
+        return await self.dialogs.exists(chat)
 
     async def check_chat_existing_in_db(self, chat: str) -> bool:
         """
@@ -48,90 +88,336 @@ class ChatsHandler:
         res = await self.db_manager.listening_chats.all_listening_chats()
         return [int(el.chat_id) if el.chat_id.isdigit() else el.chat_id for el in res]
 
-    async def create_all_chats_file(self, path: str, data: str):
+    async def search_messages(self, query: str, page: int = 1) -> List[SearchResultDB]:
         """
-        Создает файл со всеми чатами и их ID
-        :param path: путь к файлу
-        :param data: данные в виде строки
+        Поиск по сохраненным сообщениям
+        :param query: слова для поиска
+        :param page: номер страницы, начиная с 1
+        :return: страница результатов
         """
-        with open(path, 'w', encoding='utf8') as f:
-            f.write(data)
+        logger.info(f"{LoggerTags.HANDLER.value} Searching messages {query=} {page=}")
+        return await self.db_manager.messages.search_messages(
+            query,
+            limit=SEARCH_PAGE_SIZE,
+            offset=(page - 1) * SEARCH_PAGE_SIZE
+        )
 
-    async def normal_handler(self, event: events.NewMessage.Event):
+    def build_message_data(self, message: types.Message, chat_id: str) -> MessageDB:
         """
-        Обработчик чатов, у которых срабатывает событие на новые сообщения
+        Собрать запись сообщения для бд
+        :param message: сообщение телеграм
+        :param chat_id: id чата, из которого пришло сообщение
         """
-        logger.info(f"{LoggerTags.HANDLER.value} Detected new message from {event.message.peer_id.channel_id}")
-
-        new_date = event.message.date.astimezone(TIMEZONE)
-
-        links_ent = event.message.entities
+        links_ent = message.entities
 
         links = []
 
         if links_ent:
             links = [link.url for link in links_ent if isinstance(link, types.MessageEntityTextUrl)]
 
-        message_data = MessageDB(
-            chat_id=str(event.chat.id),
-            message_id=str(event.message.id),
-            message=event.message.message,
-            grouped_id=event.message.grouped_id,
-            date=new_date,
+        return MessageDB(
+            chat_id=chat_id,
+            message_id=str(message.id),
+            message=message.message,
+            grouped_id=message.grouped_id,
+            date=message.date.astimezone(TIMEZONE),
             links=','.join(links) if links else None
         )
 
-        file_record = None
+    def find_duplicate(self, message_data: MessageDB) -> Tuple[MessageDB, Optional[int]]:
+        """
+        Посчитать отпечаток сообщения и найти оригинал, если это репост.
+        Дубликат помечается ссылкой на оригинал и хранится без текста
+        :param message_data: запись сообщения
+        :return: запись с отпечатком и отпечаток оригинального сообщения, которое надо запомнить после сохранения
+        """
+        fingerprint = self.duplicates.fingerprint(message_data.message)
 
-        if event.message.media:
+        if fingerprint is None:
+            return message_data, None
 
-            if isinstance(event.message.media, types.MessageMediaWebPage):
-                logger.info(f'{LoggerTags.HANDLER.value} Detected web page')
-                return
+        message_data = replace(message_data, fingerprint=fingerprint_to_str(fingerprint))
+        original_pk = self.duplicates.find_original(fingerprint, message_data.date)
 
-            logger.info(f'{LoggerTags.HANDLER.value} Detected media')
-            file_name = file_type = document_id = original_filename = None
+        if original_pk is None:
+            return message_data, fingerprint
 
-            if isinstance(event.message.media, MessageMediaPhoto):
-                file_name = f"{event.message.photo.id}-{event.chat.id}-{event.message.id}{event.message.file.ext}"
-                file_type = MessageFiletypes.PHOTO.value
-                document_id = event.message.photo.id
+        logger.info(
+            f"{LoggerTags.HANDLER.value} Message id={message_data.message_id} from {message_data.chat_id} "
+            f"is a duplicate of message pk={original_pk}")
+        return replace(message_data, message='', duplicate_of=original_pk), None
 
-            elif isinstance(event.message.media, MessageMediaDocument):
-                file_name = f"{event.message.document.id}-{event.chat.id}-{event.message.id}{event.message.file.ext}"
-                file_type = MessageFiletypes.DOCUMENT.value
-                document_id = event.message.document.id
+    async def media_file(self, message: types.Message, chat_id: str) -> Optional[FileDB]:
+        """
+        Запись файла сообщения, если это фото или документ и правило скачивания чата разрешает его скачать.
+        Сам файл не скачивается, запись отмечена как не скачанная
+        :param message: сообщение телеграм
+        :param chat_id: id чата, из которого пришло сообщение
+        :return: запись файла для бд или None, если в сообщении нет файла или он не скачивается
+        """
+        if not isinstance(message.media, (MessageMediaPhoto, MessageMediaDocument)):
+            return None
+
+        decision = await self.media_policy.decide(message, chat_id)
+        MEDIA_DECISIONS.inc(decision=decision.value)
+
+        if decision == MediaDecision.SKIP:
+            return None
+
+        sampled_logger.debug(f'{LoggerTags.HANDLER.value} Detected media')
+        original_filename = None
+
+        if isinstance(message.media, MessageMediaPhoto):
+            file_name = f"{message.photo.id}-{chat_id}-{message.id}{message.file.ext}"
+            file_type = MessageFiletypes.PHOTO.value
+            document_id = message.photo.id
+
+        else:
+            file_name = f"{message.document.id}-{chat_id}-{message.id}{message.file.ext}"
+            file_type = MessageFiletypes.DOCUMENT.value
+            document_id = message.document.id
+
+            for attribute in message.document.attributes:
+                if isinstance(attribute, types.DocumentAttributeFilename):
+                    original_filename = attribute.file_name.split('.')[0]
+
+        if decision == MediaDecision.THUMB:
+            if isinstance(message.media, MessageMediaDocument) and not message.document.thumbs:
+                return None
+
+            # миниатюра - всегда картинка, отправляется при рассылке как фото
+            file_name = f"{document_id}-{chat_id}-{message.id}-thumb.jpg"
+            file_type = MessageFiletypes.PHOTO.value
+            document_id = f"{document_id}-thumb"
+
+        return FileDB(
+            document_id=document_id,
+            file_name=file_name,
+            file_path=media_key(file_type, file_name),
+            file_type=file_type,
+            message_id=message.id,
+            chat_id=chat_id,
+            original_filename=original_filename,
+            is_downloaded=False
+        )
 
-            if hasattr(event.message.media, 'document'):
-                document = event.message.media.document
+    async def download_file(self, message: types.Message, file: FileDB) -> bool:
+        """
+        Скачать файл сообщения в хранилище по пути из записи файла.
+        Ошибка скачивания только записывается в лог: файл остается не скачанным, его докачивает
+        retry_pending_downloads (большие документы - с уже скачанных частей по журналу)
+        :param message: сообщение телеграм
+        :param file: запись файла из media_file
+        :return: скачан ли файл
+        """
+        try:
+            if str(file.document_id).endswith('-thumb'):
+                return await self.downloader.download_thumb(message, file.file_path)
 
-                for attribute in document.attributes:
-                    if isinstance(attribute, types.DocumentAttributeFilename):
-                        original_filename = attribute.file_name.split('.')[0]
+            await self.downloader.download(message, file.file_path)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при скачивании файла {file.file_path} "
+                         f"сообщения id={file.message_id} из {file.chat_id}: {e}")
+            return False
 
-            file_path = f"{UPLOAD_FOLDER}/{file_type}/{file_name}"
-            await self.client.download_media(event.message.media, file_path)
+    async def retry_pending_downloads(self):
+        """
+        Повторно скачать файлы, которые не удалось скачать при получении сообщения.
+        Сообщения запрашиваются заново (ссылка на файл в старом сообщении могла устареть),
+        файлы удаленных сообщений убираются из бд
+        """
+        pending = await self.db_manager.files.pending_files(DOWNLOAD_RETRY_BATCH_SIZE)
+
+        if not pending:
+            return
+
+        logger.info(f"{LoggerTags.HANDLER.value} Retry {len(pending)} pending downloads")
+
+        by_chat: Dict[str, List[FileDB]] = {}
+        for file in pending:
+            by_chat.setdefault(file.chat_id, []).append(file)
+
+        downloaded = 0
+
+        for chat_id, files in by_chat.items():
+            # chat_id сообщений - id сущности без префикса, тип чата берется из кэша диалогов
+            dialog = await self.db_manager.dialogs.get_dialog(chat_id)
+            peer = types.PeerChat(int(chat_id)) if dialog is not None and not dialog.is_channel \
+                else types.PeerChannel(int(chat_id))
 
-            file_record = FileDB(
-                document_id=document_id,
-                file_name=file_name,
-                file_path=file_path,
-                file_type=file_type,
-                message_id=event.message.id,
-                chat_id=event.chat.id,
-                original_filename=original_filename
-            )
+            try:
+                messages = await self.client.get_messages(peer, ids=[int(el.message_id) for el in files])
+            except Exception as e:
+                logger.error(f"Ошибка при получении сообщений чата {chat_id} для скачивания файлов: {e}")
+                continue
+
+            for file, message in zip(files, messages):
+                if message is None or message.media is None:
+                    logger.info(f"{LoggerTags.HANDLER.value} Message id={file.message_id} from {chat_id} "
+                                f"has no file anymore, remove {file.file_path}")
+                    await self.db_manager.files.remove_file(document_id=str(file.document_id))
+                    continue
+
+                if await self.download_file(message, file):
+                    await self.db_manager.files.set_downloaded(file.document_id)
+                    downloaded += 1
+
+        logger.info(f"{LoggerTags.HANDLER.value} Downloaded {downloaded}/{len(pending)} pending files")
+
+    def check_gap(self, chat_id: str, message: types.Message):
+        """
+        Найти сообщения, которые не пришли в реальном времени (например, во время переподключения telethon).
+        В каналах id сообщений идут подряд, поэтому скачок id больше чем на 1 - это пропуск,
+        он передается в gap_handler. В обычных группах id общие для всех чатов аккаунта, они не проверяются
+        :param chat_id: id чата
+        :param message: полученное сообщение
+        """
+        if not isinstance(message.peer_id, types.PeerChannel):
+            return
+
+        last_id = self.live_ids.get(chat_id)
+
+        if last_id is not None and message.id <= last_id:
+            return
+
+        self.live_ids[chat_id] = message.id
+
+        if last_id is not None and message.id > last_id + 1 and self.gap_handler is not None:
+            self.gap_handler(chat_id, message.peer_id, last_id, message.id)
+
+    async def normal_handler(self, event: events.NewMessage.Event):
+        """
+        Обработчик чатов, у которых срабатывает событие на новые сообщения
+        """
+        sampled_logger.debug(f"{LoggerTags.HANDLER.value} Detected new message from {event.message.peer_id.channel_id}")
+        MESSAGES_RECEIVED.inc(chat_id=str(event.chat.id))
+        CHAT_MESSAGES.inc(str(event.chat.id))
+
+        if self.recorder is not None:
+            self.recorder.record(event.message)
+
+        self.check_gap(str(event.chat.id), event.message)
+
+        with tracer.span('normal_handler', chat_id=str(event.chat.id), message_id=str(event.message.id)):
+            await self._handle_message(event)
+
+    async def _handle_message(self, event: events.NewMessage.Event):
+        message_data = self.build_message_data(event.message, str(event.chat.id))
+
+        with tracer.span('handler.duplicates'):
+            message_data, fingerprint = self.find_duplicate(message_data)
+
+        if message_data.duplicate_of is not None:
+            with HANDLER_STAGE_SECONDS.time(stage='store'), tracer.span('handler.store', duplicate=True):
+                await self.db_manager.messages.add_message(message_data)
+            return
+
+        if isinstance(event.message.media, types.MessageMediaWebPage):
+            sampled_logger.debug(f'{LoggerTags.HANDLER.value} Detected web page')
+            return
+
+        file_record = await self.media_file(event.message, str(event.chat.id))
 
         # todo при отправке нескольких фото, прикрепленных к сообщению, сохраняются не все
-        await self.db_manager.messages.add_message(message_data)
+        # сообщение и запись файла сохраняются до скачивания: если скачивание не удастся,
+        # файл останется не скачанным и его докачает retry_pending_downloads
+        with HANDLER_STAGE_SECONDS.time(stage='store'), tracer.span('handler.store'):
+            message_pk = await self.db_manager.messages.add_message(message_data)
+
+            # сообщение уже сохранено и обработано (например, догрузкой пропуска), повторно не пересылается
+            if message_pk is None:
+                return
+
+            if file_record:
+                await self.db_manager.files.add_file(file_record)
 
         if file_record:
-            await self.db_manager.files.add_file(file_record)
+            with HANDLER_STAGE_SECONDS.time(stage='download'), tracer.span('handler.download'):
+                if await self.download_file(event.message, file_record):
+                    await self.db_manager.files.set_downloaded(file_record.document_id)
 
-        if await self.kh.check_contains(event.message.text.lower().replace("ё", "е")):
+        if fingerprint is not None:
+            self.duplicates.remember(fingerprint, message_pk, message_data.date)
+
+        with HANDLER_STAGE_SECONDS.time(stage='match'), tracer.span('handler.match') as span:
+            is_matching = await self.kh.check_contains(event.message.text.lower().replace("ё", "е"))
+            span.set_attribute('matched', is_matching)
+
+        if is_matching:
             logger.info(
                 f"{LoggerTags.HANDLER.value} Forward message id={message_data.message_id} from {message_data.chat_id} to moderation chat")
-            await self.client.forward_messages(BOT_URL, event.message)
+            with HANDLER_STAGE_SECONDS.time(stage='forward'), tracer.span('handler.forward'):
+                await self.outbound.send(OUTBOUND_LANE_URGENT, lambda: self.client.forward_messages(BOT_URL, event.message))
+
+    async def ingest_messages(self, chat_id: str, messages: List[types.Message],
+                              lane: str = OUTBOUND_LANE_BULK) -> int:
+        """
+        Обработать пачку сообщений одного чата тем же путем, что и normal_handler,
+        но с сохранением в бд одной транзакцией и одной пересылкой совпадений
+        :param chat_id: id чата
+        :param messages: сообщения телеграм
+        :param lane: полоса пересылки совпадений: история - bulk, пропущенные новые сообщения - как в реальном времени
+        :return: количество новых сообщений
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Ingest {len(messages)} messages from {chat_id}")
+
+        messages_data = []
+        files = []
+        fingerprints = []
+        originals = []
+
+        for message in messages:
+            if not isinstance(message, types.Message):
+                continue
+
+            MESSAGES_RECEIVED.inc(chat_id=chat_id)
+            CHAT_MESSAGES.inc(chat_id)
+            message_data = self.build_message_data(message, chat_id)
+            message_data, fingerprint = self.find_duplicate(message_data)
+
+            if message_data.duplicate_of is None:
+                if isinstance(message.media, types.MessageMediaWebPage):
+                    continue
+
+                file_record = await self.media_file(message, chat_id)
+                if file_record:
+                    is_downloaded = await self.download_file(message, file_record)
+                    files.append(replace(file_record, is_downloaded=is_downloaded))
+
+            messages_data.append(message_data)
+            fingerprints.append(fingerprint)
+            originals.append(message)
+
+        if not messages_data:
+            return 0
+
+        message_pks = await self.db_manager.messages.add_messages(messages_data, files)
+
+        keywords = await self.kh.get_keywords()
+        matched = []
+
+        for message_data, message, fingerprint, message_pk in zip(messages_data, originals, fingerprints, message_pks):
+            if message_pk is None or message_data.duplicate_of is not None:
+                continue
+
+            if fingerprint is not None:
+                self.duplicates.remember(fingerprint, message_pk, message_data.date)
+
+            hits = self.kh.matched_keywords(message.text.lower().replace("ё", "е"), keywords)
+            self.kh.record_hits(hits)
+
+            if hits:
+                matched.append(message)
+
+        if matched:
+            logger.info(f"{LoggerTags.HANDLER.value} Forward {len(matched)} messages from {chat_id} to moderation chat")
+            for i in range(0, len(matched), 100):
+                await self.outbound.send(
+                    lane, lambda i=i: self.client.forward_messages(BOT_URL, matched[i:i + 100])
+                )
+
+        return len([pk for pk in message_pks if pk is not None])
 
     async def add_chat(self, chat: str | int):
         """
@@ -142,6 +428,9 @@ class ChatsHandler:
         if await self.check_chat_existing_in_db(str(chat)):
             raise KeyError("Чат уже был добавлен")
 
+        if str(chat).isdigit() and not await self.check_chat_existing(chat):
+            raise KeyError("Чат не найден среди ваших чатов")
+
         try:
             await self.db_manager.listening_chats.add_listening_chat(str(chat))
         except IntegrityError:
@@ -164,3 +453,45 @@ class ChatsHandler:
 
         self.client.add_event_handler(self.normal_handler, events.NewMessage(chats=await self.listening_chats_list()))
         logger.info(f'{LoggerTags.HANDLER.value} Removed chat - {chat}')
+
+    async def set_media_rule(self, chat_id: str, mode: str, types_list: str = '', max_size_mb: str = '',
+                             mime_types: str = '') -> Optional[MediaRuleDB]:
+        """
+        Задать правило скачивания файлов для чата
+        :param chat_id: id чата
+        :param mode: режим из MEDIA_MODES или default - вернуть общее правило
+        :param types_list: типы файлов через запятую
+        :param max_size_mb: максимальный размер файла в мегабайтах, 0 - без ограничения
+        :param mime_types: MIME типы или их префиксы через запятую
+        :return: новое правило или None, если чат вернулся к общему правилу
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Set media rule for {chat_id=} {mode=}")
+
+        if mode == 'default':
+            if not await self.media_policy.remove_rule(chat_id):
+                raise ValueError("У чата нет своего правила")
+            return None
+
+        if mode not in MEDIA_MODES:
+            raise ValueError(f"Режим должен быть одним из: {', '.join(MEDIA_MODES)} или default")
+
+        file_types = split_list(types_list)
+        unknown = [el for el in file_types if el not in [el.value for el in MessageFiletypes]]
+        if unknown:
+            raise ValueError(f"Неизвестные типы файлов: {', '.join(unknown)}")
+
+        try:
+            max_size = int(float(max_size_mb) * 1024 * 1024) if max_size_mb else 0
+        except ValueError:
+            raise ValueError("Размер файла должен быть числом мегабайт")
+
+        rule = MediaRuleDB(
+            chat_id=chat_id,
+            mode=mode,
+            types=file_types,
+            mime_types=split_list(mime_types),
+            max_size=max(max_size, 0)
+        )
+        await self.media_policy.set_rule(rule)
+
+        return rule
@@ -0,0 +1,145 @@
+import asyncio
+from typing import List, Optional
+
+from loguru import logger
+from telethon import TelegramClient, events, types, utils
+from telethon.errors import ChannelPrivateError
+
+from config import LoggerTags, DIALOGS_BATCH_SIZE
+from data.dataclasses import DialogDB
+from data.db_manager import DBManager
+
+
+def dialog_from_entity(entity) -> DialogDB:
+    """
+    Собрать запись кэша диалогов из сущности телеграм (канал, чат или пользователь)
+    """
+    if isinstance(entity, types.User):
+        title = ' '.join(filter(None, (entity.first_name, entity.last_name)))
+    else:
+        title = getattr(entity, 'title', '')
+
+    return DialogDB(
+        chat_id=str(entity.id),
+        title=title or '',
+        is_channel=isinstance(entity, types.Channel),
+        username=getattr(entity, 'username', None)
+    )
+
+
+class DialogCache:
+    """
+    Локальная копия списка диалогов пользователя в бд.
+    Полностью обновляется через iter_dialogs в фоне (refresh), между обновлениями
+    поддерживается событиями о входе в чаты, выходе из них и смене названий.
+    Листинг и проверка чатов читают только бд, без обхода всех диалогов в телеграм
+    """
+
+    def __init__(self, client: TelegramClient, db_manager: DBManager):
+        self.client = client
+        self.db_manager = db_manager
+        self.refresh_lock = asyncio.Lock()
+
+    def add_event_handlers(self):
+        self.client.add_event_handler(self.chat_action_handler, events.ChatAction())
+        self.client.add_event_handler(self.channel_update_handler, events.Raw(types.UpdateChannel))
+
+    async def refresh(self):
+        """
+        Перечитать все диалоги из телеграм, запись в бд пачками по DIALOGS_BATCH_SIZE
+        """
+        if self.refresh_lock.locked():
+            return
+
+        async with self.refresh_lock:
+            logger.info(f"{LoggerTags.HANDLER.value} Refresh dialogs cache")
+
+            batch: List[DialogDB] = []
+            count = 0
+
+            async for dialog in self.client.iter_dialogs():
+                batch.append(dialog_from_entity(dialog.entity))
+
+                if len(batch) >= DIALOGS_BATCH_SIZE:
+                    await self.db_manager.dialogs.upsert_dialogs(batch)
+                    count += len(batch)
+                    batch = []
+
+            await self.db_manager.dialogs.upsert_dialogs(batch)
+            count += len(batch)
+
+            logger.info(f"{LoggerTags.HANDLER.value} Dialogs cache refreshed, {count} dialogs")
+
+    async def remember(self, entity):
+        await self.db_manager.dialogs.upsert_dialogs([dialog_from_entity(entity)])
+
+    async def exists(self, chat: str | int) -> bool:
+        """
+        Проверить, есть ли чат среди диалогов пользователя.
+        Если чата нет в кэше, он ищется в телеграм одним запросом и дописывается в кэш
+        :param chat: id чата или ссылка
+        """
+        if await self.db_manager.dialogs.get_dialog(str(chat)) is not None:
+            return True
+
+        try:
+            entity = await self.client.get_entity(int(chat) if str(chat).lstrip('-').isdigit() else chat)
+        except ValueError:
+            return False
+
+        await self.remember(entity)
+        return True
+
+    async def list(
+            self,
+            channels_only: bool = True,
+            title_search: Optional[str] = None,
+            limit: int = DIALOGS_BATCH_SIZE,
+            offset: int = 0
+    ) -> List[DialogDB]:
+        return await self.db_manager.dialogs.list_dialogs(channels_only, title_search, limit, offset)
+
+    async def iter_all(self, channels_only: bool = True, title_search: Optional[str] = None):
+        """
+        Все подходящие диалоги из кэша, постранично
+        """
+        offset = 0
+
+        while True:
+            page = await self.list(channels_only, title_search, offset=offset)
+
+            for dialog in page:
+                yield dialog
+
+            if len(page) < DIALOGS_BATCH_SIZE:
+                return
+
+            offset += len(page)
+
+    async def chat_action_handler(self, event: events.ChatAction.Event):
+        """
+        Смена названия чата, вход в чат или выход из него
+        """
+        try:
+            if event.new_title or event.user_joined or event.user_added:
+                await self.remember(await event.get_chat())
+            elif (event.user_left or event.user_kicked) and event.user_id == (await self.client.get_me(True)).user_id:
+                chat_id, _ = utils.resolve_id(event.chat_id)
+                await self.db_manager.dialogs.remove_dialog(str(chat_id))
+        except Exception as e:
+            logger.error(f"{LoggerTags.HANDLER.value} Failed to update dialogs cache: {e}")
+
+    async def channel_update_handler(self, update: types.UpdateChannel):
+        """
+        Подписка на канал или отписка от него
+        """
+        try:
+            entity = await self.client.get_entity(types.PeerChannel(update.channel_id))
+        except (ValueError, ChannelPrivateError):
+            await self.db_manager.dialogs.remove_dialog(str(update.channel_id))
+            return
+
+        if isinstance(entity, types.Channel) and entity.left:
+            await self.db_manager.dialogs.remove_dialog(str(entity.id))
+        else:
+            await self.remember(entity)
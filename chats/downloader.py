@@ -0,0 +1,252 @@
+import asyncio
+import os
+import time
+from typing import Set
+
+from loguru import logger
+from telethon import TelegramClient, types
+from telethon.errors import FloodWaitError
+
+from config import LoggerTags, DOWNLOAD_CHUNKED_MIN_SIZE, DOWNLOAD_WORKERS, DOWNLOAD_PART_RETRIES
+from metrics import MEDIA_DOWNLOAD_SECONDS, MEDIA_DOWNLOADS_ACTIVE, MEDIA_DOWNLOAD_PARTS_PENDING, record_flood_wait
+from storage import StorageBackend
+
+# размер одной части: кратен 4 КБ, и 1 МБ делится на него без остатка (ограничения upload.getFile)
+PART_SIZE = 512 * 1024
+
+
+class DownloadIntegrityError(Exception):
+    pass
+
+
+class DownloadJournal:
+    """
+    Журнал частично скачанного файла (<файл>.part.journal): в первой строке id документа и размер,
+    дальше номера частей, которые уже записаны в <файл>.part и сброшены на диск
+    """
+
+    def __init__(self, path: str, document_id: int, size: int):
+        self.path = path
+        self.document_id = document_id
+        self.size = size
+        self.done: Set[int] = set()
+
+    def load(self) -> bool:
+        """
+        Прочитать журнал, если он относится к тому же документу
+        :return: можно ли продолжить скачивание с записанных частей
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, encoding='utf8') as f:
+            lines = f.read().split()
+
+        if lines[:2] != [str(self.document_id), str(self.size)]:
+            return False
+
+        # последняя строка могла записаться не полностью при обрыве
+        self.done = {int(el) for el in lines[2:] if el.isdigit()}
+        return True
+
+    def create(self):
+        self.done = set()
+        with open(self.path, 'w', encoding='utf8') as f:
+            f.write(f"{self.document_id} {self.size}\n")
+
+    def append(self, part: int):
+        with open(self.path, 'a', encoding='utf8') as f:
+            f.write(f"{part}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.add(part)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def _single_chunk(data: bytes):
+    yield data
+
+
+class MediaDownloader:
+    """
+    Скачивание файлов сообщений в хранилище.
+    Для удаленного хранилища (S3) файл передается в него потоком из iter_download без записи на диск.
+    Большие документы (от DOWNLOAD_CHUNKED_MIN_SIZE) качаются частями по PART_SIZE через iter_download
+    в DOWNLOAD_WORKERS параллельных запросов во временный файл .part. Каждая записанная часть отмечается в журнале,
+    поэтому после обрыва связи или перезапуска скачивание продолжается с недостающих частей.
+    На FloodWait часть ждет указанное время и запрашивается снова, без расхода попыток.
+    Длина каждой части и итоговый размер сверяются с размером документа, только после этого файл
+    переименовывается в итоговый путь
+    """
+
+    def __init__(self, client: TelegramClient, storage: StorageBackend):
+        self.client = client
+        self.storage = storage
+
+    async def download(self, message: types.Message, key: str):
+        """
+        Скачать файл сообщения
+        :param message: сообщение телеграм с фото или документом
+        :param key: путь файла в хранилище
+        """
+        MEDIA_DOWNLOADS_ACTIVE.inc()
+        try:
+            await self._download(message, key)
+        finally:
+            MEDIA_DOWNLOADS_ACTIVE.dec()
+
+    async def _download(self, message: types.Message, key: str):
+        path = self.storage.local_path(key)
+
+        if path is None:
+            with MEDIA_DOWNLOAD_SECONDS.time(method='stream'):
+                await self.storage.save(key, self.client.iter_download(
+                    message.media, request_size=PART_SIZE, file_size=message.file.size if message.file else None
+                ))
+            return
+
+        file_path = str(path)
+        document = message.document if isinstance(message.media, types.MessageMediaDocument) else None
+
+        if document is None or not document.size or document.size < DOWNLOAD_CHUNKED_MIN_SIZE:
+            with MEDIA_DOWNLOAD_SECONDS.time(method='simple'):
+                await self.client.download_media(message.media, file_path)
+            return
+
+        with MEDIA_DOWNLOAD_SECONDS.time(method='chunked'):
+            await self.download_document(document, file_path)
+
+    async def download_thumb(self, message: types.Message, key: str) -> bool:
+        """
+        Скачать самую большую миниатюру файла сообщения
+        :return: False, если у файла нет миниатюры
+        """
+        MEDIA_DOWNLOADS_ACTIVE.inc()
+        try:
+            return await self._download_thumb(message, key)
+        finally:
+            MEDIA_DOWNLOADS_ACTIVE.dec()
+
+    async def _download_thumb(self, message: types.Message, key: str) -> bool:
+        path = self.storage.local_path(key)
+
+        if path is not None:
+            return await self.client.download_media(message.media, str(path), thumb=-1) is not None
+
+        data = await self.client.download_media(message.media, bytes, thumb=-1)
+        if not data:
+            return False
+
+        await self.storage.save(key, _single_chunk(data))
+        return True
+
+    async def download_document(self, document: types.Document, file_path: str):
+        part_path = f"{file_path}.part"
+        journal = DownloadJournal(f"{part_path}.journal", document.id, document.size)
+        parts_count = (document.size + PART_SIZE - 1) // PART_SIZE
+
+        if await asyncio.to_thread(journal.load) and os.path.exists(part_path):
+            logger.info(f"{LoggerTags.HANDLER.value} Resume download of {file_path}, "
+                        f"{len(journal.done)}/{parts_count} parts done")
+        else:
+            await asyncio.to_thread(self._create_part_file, part_path, document.size, journal)
+
+        pending: asyncio.Queue[int] = asyncio.Queue()
+        for part in range(parts_count):
+            if part not in journal.done:
+                pending.put_nowait(part)
+
+        MEDIA_DOWNLOAD_PARTS_PENDING.inc(pending.qsize())
+        start = time.perf_counter()
+        workers = [
+            asyncio.create_task(self._worker(document, pending, part_path, journal))
+            for _ in range(min(DOWNLOAD_WORKERS, pending.qsize()))
+        ]
+
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+        finally:
+            # части, которые не успели взять в работу (после ошибки или отмены)
+            MEDIA_DOWNLOAD_PARTS_PENDING.dec(pending.qsize())
+
+        await asyncio.to_thread(self._finish, part_path, file_path, journal, parts_count)
+
+        logger.info(f"{LoggerTags.HANDLER.value} Downloaded {file_path} ({document.size} bytes, {parts_count} parts) "
+                    f"in {time.perf_counter() - start:.2f}s")
+
+    @staticmethod
+    def _create_part_file(part_path: str, size: int, journal: DownloadJournal):
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+        journal.create()
+
+    async def _worker(self, document: types.Document, pending: asyncio.Queue, part_path: str,
+                      journal: DownloadJournal):
+        while not pending.empty():
+            part = pending.get_nowait()
+            MEDIA_DOWNLOAD_PARTS_PENDING.dec()
+            data = await self._fetch_part(document, part)
+            await asyncio.to_thread(self._write_part, part_path, part, data, journal)
+
+    async def _fetch_part(self, document: types.Document, part: int) -> bytes:
+        offset = part * PART_SIZE
+        expected = min(PART_SIZE, document.size - offset)
+
+        attempt = 0
+
+        while True:
+            try:
+                data = b''
+                async for chunk in self.client.iter_download(
+                        document, offset=offset, request_size=PART_SIZE, limit=1, file_size=document.size
+                ):
+                    data += chunk
+
+                if len(data) != expected:
+                    raise DownloadIntegrityError(
+                        f"Part {part} of document {document.id}: got {len(data)} bytes, expected {expected}")
+
+                return data
+            except FloodWaitError as e:
+                # ожидание не считается неудачной попыткой, остальные части ждут так же в своих воркерах
+                logger.warning(f"{LoggerTags.HANDLER.value} Part {part} of document {document.id} "
+                               f"flood wait {e.seconds} seconds")
+                record_flood_wait(e.seconds, 'download')
+                await asyncio.sleep(e.seconds)
+            except (ConnectionError, asyncio.TimeoutError, DownloadIntegrityError) as e:
+                attempt += 1
+                if attempt == DOWNLOAD_PART_RETRIES:
+                    raise
+
+                logger.warning(f"{LoggerTags.HANDLER.value} Retry part {part} of document {document.id}: {e}")
+                await asyncio.sleep(attempt)
+
+    @staticmethod
+    def _write_part(part_path: str, part: int, data: bytes, journal: DownloadJournal):
+        # часть отмечается в журнале только после того, как данные сброшены на диск
+        with open(part_path, 'r+b') as f:
+            f.seek(part * PART_SIZE)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        journal.append(part)
+
+    @staticmethod
+    def _finish(part_path: str, file_path: str, journal: DownloadJournal, parts_count: int):
+        missing = parts_count - len(journal.done & set(range(parts_count)))
+        size = os.path.getsize(part_path)
+
+        if missing or size != journal.size:
+            raise DownloadIntegrityError(
+                f"{file_path}: {missing} parts missing, size {size} bytes, expected {journal.size}")
+
+        os.replace(part_path, file_path)
+        journal.remove()
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from enum import Enum
+from typing import Dict, Optional
+
+from loguru import logger
+from telethon import types
+
+from config import LoggerTags, MessageFiletypes, sampled_logger, MEDIA_MODE_ALL, MEDIA_MODE_THUMB, MEDIA_MODE_NONE, \
+    MEDIA_DOWNLOAD_MODE, MEDIA_TYPES, MEDIA_MIME_TYPES, MEDIA_MAX_SIZE_MB, MEDIA_ALBUMS_CACHE_SIZE
+from data.dataclasses import MediaRuleDB
+from data.db_manager import DBManager
+from keywords import KeywordsHandler
+
+
+class MediaDecision(Enum):
+    SKIP = 'skip'
+    THUMB = 'thumb'
+    FULL = 'full'
+
+
+def split_list(value: str) -> tuple:
+    return tuple(el.strip().lower() for el in value.split(',') if el.strip())
+
+
+def default_rule(chat_id: str) -> MediaRuleDB:
+    return MediaRuleDB(
+        chat_id=chat_id,
+        mode=MEDIA_DOWNLOAD_MODE,
+        types=split_list(MEDIA_TYPES),
+        mime_types=split_list(MEDIA_MIME_TYPES),
+        max_size=int(MEDIA_MAX_SIZE_MB * 1024 * 1024)
+    )
+
+
+def media_type(message: types.Message) -> Optional[str]:
+    if isinstance(message.media, types.MessageMediaPhoto):
+        return MessageFiletypes.PHOTO.value
+    if isinstance(message.media, types.MessageMediaDocument):
+        return MessageFiletypes.DOCUMENT.value
+    return None
+
+
+def rule_accepts(rule: MediaRuleDB, message: types.Message) -> bool:
+    """
+    Подходит ли файл сообщения под типы и MIME типы правила (размер проверяется отдельно)
+    """
+    if rule.types and media_type(message) not in rule.types:
+        return False
+
+    mime_type = (message.file.mime_type or '').lower() if message.file else ''
+
+    return not rule.mime_types or any(mime_type.startswith(el) for el in rule.mime_types)
+
+
+def exceeds_size(rule: MediaRuleDB, message: types.Message) -> bool:
+    size = message.file.size if message.file else None
+    return bool(rule.max_size) and size is not None and size > rule.max_size
+
+
+class MediaPolicy:
+    """
+    Решает, скачивать ли файл сообщения, до обращения к телеграм.
+    По умолчанию (режим match) файл скачивается, только если текст сообщения подходит под ключевые слова
+    отслеживаемых тем: файлы нужны только для рассылки тем, пересылка в чат модерации идет без скачивания.
+    Части альбома без подписи получают решение по подписи альбома (она приходит первой)
+    """
+
+    def __init__(self, db_manager: DBManager, keywords_handler: KeywordsHandler):
+        self.db_manager = db_manager
+        self.kh = keywords_handler
+        # правила чатов из бд, сбрасываются после изменения командой
+        self._rules: Optional[Dict[str, MediaRuleDB]] = None
+        self.albums: OrderedDict[int, bool] = OrderedDict()
+
+    def invalidate(self):
+        self._rules = None
+
+    async def rules(self) -> Dict[str, MediaRuleDB]:
+        if self._rules is None:
+            logger.debug(f"{LoggerTags.HANDLER.value} Loading media rules")
+            self._rules = {el.chat_id: el for el in await self.db_manager.media_rules.all_rules()}
+
+        return self._rules
+
+    async def rule(self, chat_id: str) -> MediaRuleDB:
+        return (await self.rules()).get(chat_id) or default_rule(chat_id)
+
+    async def set_rule(self, rule: MediaRuleDB):
+        await self.db_manager.media_rules.set_rule(rule)
+        self.invalidate()
+
+    async def remove_rule(self, chat_id: str) -> bool:
+        removed = await self.db_manager.media_rules.remove_rule(chat_id)
+        self.invalidate()
+        return removed
+
+    def _remember_album(self, grouped_id: int, matched: bool):
+        self.albums[grouped_id] = matched
+        self.albums.move_to_end(grouped_id)
+
+        while len(self.albums) > MEDIA_ALBUMS_CACHE_SIZE:
+            self.albums.popitem(last=False)
+
+    def matches(self, message: types.Message, theme_keywords: set) -> bool:
+        """
+        Подходит ли сообщение (или альбом, к которому оно относится) под отслеживаемые темы
+        """
+        text = (message.text or '').lower().replace("ё", "е")
+        matched = bool(text) and self.kh.contains_keywords(text, theme_keywords)
+
+        if not message.grouped_id:
+            return matched
+
+        if matched or message.grouped_id not in self.albums:
+            self._remember_album(message.grouped_id, matched or self.albums.get(message.grouped_id, False))
+
+        return self.albums[message.grouped_id]
+
+    async def decide(self, message: types.Message, chat_id: str) -> MediaDecision:
+        """
+        Решить, что скачать из сообщения: файл целиком, только миниатюру или ничего
+        :param message: сообщение телеграм
+        :param chat_id: id чата
+        """
+        if media_type(message) is None:
+            return MediaDecision.SKIP
+
+        rule = await self.rule(chat_id)
+
+        if rule.mode == MEDIA_MODE_NONE or not rule_accepts(rule, message):
+            decision = MediaDecision.SKIP
+        elif rule.mode == MEDIA_MODE_ALL:
+            decision = MediaDecision.THUMB if exceeds_size(rule, message) else MediaDecision.FULL
+        elif not self.matches(message, await self.kh.get_theme_keywords()):
+            decision = MediaDecision.SKIP
+        elif rule.mode == MEDIA_MODE_THUMB or exceeds_size(rule, message):
+            decision = MediaDecision.THUMB
+        else:
+            decision = MediaDecision.FULL
+
+        sampled_logger.debug(
+            f"{LoggerTags.HANDLER.value} Media of message {message.id} from {chat_id}: {decision.value} ({rule.mode})")
+        return decision
@@ -0,0 +1,59 @@
+from typing import Optional
+
+from loguru import logger
+from telethon import types
+
+from config import LoggerTags, sampled_logger
+from tracing import JsonLinesWriter
+
+MEDIA_STUB_TYPES = (types.MessageMediaPhoto, types.MessageMediaDocument, types.MessageMediaWebPage)
+
+
+def media_stub(message: types.Message) -> Optional[dict]:
+    """
+    Заглушка файла вместо полного media из to_dict: тип, id, MIME тип, размер и имя файла, без содержимого
+    """
+    if not isinstance(message.media, MEDIA_STUB_TYPES):
+        return None
+
+    stub = {'_': type(message.media).__name__}
+
+    if message.file is not None:
+        stub.update(
+            mime_type=message.file.mime_type,
+            size=message.file.size,
+            file_name=message.file.name
+        )
+
+    if message.photo is not None:
+        stub['id'] = message.photo.id
+    elif message.document is not None:
+        stub['id'] = message.document.id
+
+    return stub
+
+
+class MessageRecorder:
+    """
+    Запись входящих сообщений в JSONL (event.message.to_dict() с заглушками файлов)
+    для воспроизведения нагрузки: python -m benchmarks.replay.
+    Файл пишет фоновый поток, обработчик сообщений только ставит запись в очередь
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = JsonLinesWriter(path)
+        logger.info(f"{LoggerTags.HANDLER.value} Recording incoming messages to {path}")
+
+    def record(self, message: types.Message):
+        data = message.to_dict()
+        data['media'] = media_stub(message)
+
+        if not self.writer.write(data):
+            sampled_logger.warning(f"{LoggerTags.HANDLER.value} Record queue is full, message {message.id} skipped")
+
+    def close(self):
+        """
+        Дописать сообщения из очереди и закрыть файл
+        """
+        self.writer.close()
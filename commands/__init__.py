@@ -1 +1,2 @@
 from .commands_handlers import CommandsHandler
+from .dispatcher import CommandDispatcher, CommandOptions
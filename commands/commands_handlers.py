@@ -2,13 +2,16 @@ from typing import Callable
 
 from loguru import logger
 from sqlalchemy.exc import IntegrityError
-from telethon import TelegramClient, events, types
+from telethon import TelegramClient, events
 
+from chats.backfill import BackfillManager
 from chats.chats_handlers import ChatsHandler
+from commands.exports import export_file
+from commands.stats import PipelineStats
 from config import commands, ALL_CHATS_FILENAME, LISTENING_CHATS_FILENAME, KEYWORDS_FILENAME, LoggerTags, \
-    THEMES_FILENAME
+    THEMES_FILENAME, KEYWORDS_EXPORT_FILENAME, IMPORT_MAX_FILE_SIZE, UNUSED_KEYWORDS_FILENAME, UNUSED_KEYWORDS_DAYS
 
-from keywords import KeywordsHandler, ThemesHandler
+from keywords import ThemesHandler, KeywordsTransfer
 
 from functools import wraps
 
@@ -33,12 +36,16 @@ def check_args_count(expected_count: int):
 class CommandsHandler:
     def __init__(self,
                  client: TelegramClient,
-                 chats_handler: ChatsHandler):
+                 chats_handler: ChatsHandler,
+                 backfill: BackfillManager):
 
         self.client = client
         self.ch = chats_handler
-        self.kh = KeywordsHandler()
-        self.themes = ThemesHandler()
+        self.backfill = backfill
+        self.kh = chats_handler.kh
+        self.themes = ThemesHandler(self.kh)
+        self.transfer = KeywordsTransfer(self.kh, self.themes)
+        self.stats = PipelineStats(chats_handler.db_manager)
 
     async def start_command(self, event: events.NewMessage.Event):
         st = ''
@@ -49,12 +56,25 @@ class CommandsHandler:
         await event.reply(f'**Список комманд:**\n{st}')
 
     async def chats_command(self, event: events.NewMessage.Event):
-        with open(ALL_CHATS_FILENAME, 'w', encoding='utf8') as f:
-            chats = '\n'.join([f'{chat.title} - {chat.entity.id}' async for chat in self.client.iter_dialogs() if
-                               isinstance(chat.entity, types.Channel)])
-            f.write(chats)
+        msg = event.message.to_dict()['message']
+
+        title_search = msg.split()[1].replace('+', ' ') if len(msg.split()) > 1 else None
 
-        await self.client.send_file(event.chat_id, ALL_CHATS_FILENAME)
+        dialogs = self.ch.dialogs.iter_all(channels_only=True, title_search=title_search)
+        first = await anext(dialogs, None)
+
+        if first is None:
+            await event.reply("Чаты **не найдены**")
+            return
+
+        # диалоги пишутся в файл постранично, весь список в памяти не собирается
+        async def chats():
+            yield f'{first.title} - {first.chat_id}'
+            async for chat in dialogs:
+                yield f'{chat.title} - {chat.chat_id}'
+
+        async with export_file(ALL_CHATS_FILENAME, chats()) as path:
+            await self.client.send_file(event.chat_id, path)
 
     @check_args_count(2)
     async def add_chat_command(self, event: events.NewMessage.Event):
@@ -69,20 +89,38 @@ class CommandsHandler:
             await event.reply(f'Ошибка: {e}')
             return
 
-        await event.reply(f"Чат {msg.split()[1]} **добавлен**")
+        self.backfill.start(msg.split()[1])
+
+        await event.reply(f"Чат {msg.split()[1]} **добавлен**, загружается история сообщений")
 
     async def listening_chats_command(self, event: events.NewMessage.Event):
         logger.info(f"{LoggerTags.COMMAND.value} Listening chats command")
 
         listening_chats = await self.ch.listening_chats_list()
 
-        st = '\n'.join([f'{chat.title} - {chat.entity.id}' async for chat in self.client.iter_dialogs() if
-                        chat.entity.id in listening_chats])
+        # названия берутся из кэша диалогов, в телеграм запрашиваются только отсутствующие в нем чаты
+        cached = {el.chat_id: el for el in await self.ch.db_manager.dialogs.get_dialogs_by_ids(
+            [str(chat) for chat in listening_chats]
+        )}
 
-        with open(LISTENING_CHATS_FILENAME, 'w', encoding='utf8') as f:
-            f.write(st)
+        lines = []
+        for chat in listening_chats:
+            dialog = cached.get(str(chat))
 
-        await self.client.send_file(event.chat_id, LISTENING_CHATS_FILENAME)
+            if dialog is None:
+                try:
+                    entity = await self.client.get_entity(chat)
+                except ValueError as e:
+                    logger.error(f"{LoggerTags.COMMAND.value} Unknown listening chat {chat}: {e}")
+                    continue
+
+                await self.ch.dialogs.remember(entity)
+                lines.append(f'{getattr(entity, "title", entity.id)} - {entity.id}')
+            else:
+                lines.append(f'{dialog.title} - {dialog.chat_id}')
+
+        async with export_file(LISTENING_CHATS_FILENAME, lines) as path:
+            await self.client.send_file(event.chat_id, path)
 
     @check_args_count(2)
     async def remove_chat_command(self, event: events.NewMessage.Event):
@@ -97,6 +135,8 @@ class CommandsHandler:
             await event.reply(f"Ошибка: {e}")
             return
 
+        self.backfill.stop(msg.split()[1])
+
         await event.reply(f"Чат {msg.split()[1]} **удален** из списка прослуиваемых")
 
     @check_args_count(2)
@@ -174,25 +214,21 @@ class CommandsHandler:
         words = await self.kh.get_keywords()
 
         # заполняем файл с ключевыми словами
-        with open(KEYWORDS_FILENAME, 'w', encoding='utf8') as f:
-            f.write('-'.join(list(words)))
-
-        await self.client.send_file(event.chat_id, KEYWORDS_FILENAME)
+        async with export_file(KEYWORDS_FILENAME, words, separator='-') as path:
+            await self.client.send_file(event.chat_id, path)
 
     async def all_themes_command(self, event: events.NewMessage.Event):
         logger.info(LoggerTags.COMMAND.value + " AllThemes command")
         themes = await self.themes.all_themes()
 
-        st = ''
-
-        for theme in themes:
-            status = '✅' if theme.is_following else '❌'
-            st += f"{theme.theme_name} - {status} - |{'-'.join([el.word for el in theme.keywords])}|\n\n"
+        lines = (
+            f"{theme.theme_name} - {'✅' if theme.is_following else '❌'} - {theme.delivery_mode} - {theme.priority} - "
+            f"|{'-'.join([el.word for el in theme.keywords])}|\n\n"
+            for theme in themes
+        )
 
-        with open(THEMES_FILENAME, 'w', encoding='utf8') as f:
-            f.write(st)
-
-        await self.client.send_file(event.chat_id, THEMES_FILENAME)
+        async with export_file(THEMES_FILENAME, lines, separator='') as path:
+            await self.client.send_file(event.chat_id, path)
 
     # todo refactor methods. Write method with validate args and validate keywords
     @check_args_count(2)
@@ -218,15 +254,7 @@ class CommandsHandler:
 
         logger.info(LoggerTags.COMMAND.value + f"Add with {theme_name=} and {keywords=}")
 
-        keywords_db = []
-        errors_words = []
-
-        for word in keywords:
-            w = await self.kh.get_keyword(word)
-            if w is None:
-                errors_words.append(word)
-                continue
-            keywords_db.append(w)
+        keywords_db, errors_words = await self.kh.get_keywords_by_words(keywords)
         try:
             await self.themes.add_theme(theme_name, interval, keywords_db)
         except IntegrityError as e:
@@ -255,15 +283,7 @@ class CommandsHandler:
             await event.reply('Проверьте правильность ввода информации, возможно вы ошиблись с форматом')
             return
 
-        keywords_db = []
-        errors_words = []
-
-        for word in keywords:
-            w = await self.kh.get_keyword(word)
-            if w is None:
-                errors_words.append(word)
-                continue
-            keywords_db.append(w)
+        keywords_db, errors_words = await self.kh.get_keywords_by_words(keywords)
 
         try:
             await self.themes.add_keyword_to_theme(theme_name, keywords_db)
@@ -301,15 +321,7 @@ class CommandsHandler:
             await event.reply('Проверьте правильность ввода информации, возможно вы ошиблись с форматом')
             return
 
-        keywords_db = []
-        errors_words = []
-
-        for word in keywords:
-            w = await self.kh.get_keyword(word)
-            if w is None:
-                errors_words.append(word)
-                continue
-            keywords_db.append(w)
+        keywords_db, errors_words = await self.kh.get_keywords_by_words(keywords)
 
         try:
             await self.themes.remove_keywords_from_theme(theme_name, keywords_db)
@@ -334,7 +346,7 @@ class CommandsHandler:
 
         command_data = command_data[1]
 
-        themes_names = list(set(command_data.split('-').replace('+', ' ')))
+        themes_names = list(set([data.replace('+', ' ') for data in command_data.split('-')]))
 
         logger.info(LoggerTags.COMMAND.value + f" Remove {themes_names}")
 
@@ -394,7 +406,7 @@ class CommandsHandler:
 
         command_data = command_data[1]
 
-        themes_names = list(set(command_data.split('-').replace('+', ' ')))
+        themes_names = list(set([data.replace('+', ' ') for data in command_data.split('-')]))
 
         logger.info(LoggerTags.COMMAND.value + f" Unfollowing {themes_names}")
 
@@ -419,7 +431,6 @@ class CommandsHandler:
 
     @check_args_count(2)
     async def change_interval_theme(self, event: events.NewMessage.Event):
-        print('called')
         msg = event.message.to_dict()['message']
 
         msg_words = msg.split()
@@ -448,4 +459,189 @@ class CommandsHandler:
 
         await event.reply(f"**Успешно обновлено**\n\nНазвание: {theme.theme_name}\nИнтервал: {theme.interval}")
 
+    @check_args_count(2)
+    async def theme_delivery_command(self, event: events.NewMessage.Event):
+        msg = event.message.to_dict()['message']
+
+        payload = msg.split()[1].split('-')
+
+        if len(payload) != 2:
+            await event.reply("Проверьте правильность ввода информации, возможно вы ошиблись с форматом")
+            return
+
+        theme_name = payload[0].replace('+', ' ')
+        delivery_mode = payload[1].lower()
+
+        try:
+            await self.themes.change_delivery_mode(theme_name, delivery_mode)
+        except ValueError as e:
+            await event.reply(f"**Ошибка!**\n\n{e}")
+            return
+
+        await event.reply(f"**Успешно обновлено**\n\nНазвание: {theme_name}\nРежим доставки: {delivery_mode}")
+
+    @check_args_count(2)
+    async def theme_priority_command(self, event: events.NewMessage.Event):
+        msg = event.message.to_dict()['message']
+
+        payload = msg.split()[1].split('-')
+
+        if len(payload) != 2:
+            await event.reply("Проверьте правильность ввода информации, возможно вы ошиблись с форматом")
+            return
+
+        theme_name = payload[0].replace('+', ' ')
+        priority = payload[1].lower()
+
+        try:
+            await self.themes.change_priority(theme_name, priority)
+        except ValueError as e:
+            await event.reply(f"**Ошибка!**\n\n{e}")
+            return
+
+        await event.reply(f"**Успешно обновлено**\n\nНазвание: {theme_name}\nПриоритет: {priority}")
+
+    @staticmethod
+    def _media_rule_text(rule) -> str:
+        return (
+            f"Режим: {rule.mode}\n"
+            f"Типы: {', '.join(rule.types) or 'любые'}\n"
+            f"Размер: {f'до {rule.max_size / 1024 / 1024:g} МБ' if rule.max_size else 'без ограничения'}\n"
+            f"MIME: {', '.join(rule.mime_types) or 'любые'}"
+        )
+
+    @check_args_count(2)
+    async def media_policy_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Media policy command")
+        msg = event.message.to_dict()['message']
+
+        payload = msg.split()[1].split('-')
+
+        if len(payload) > 5 or not payload[0].isdigit():
+            await event.reply("Проверьте правильность ввода информации, возможно вы ошиблись с форматом")
+            return
+
+        chat_id = payload[0]
+
+        if len(payload) == 1:
+            rule = await self.ch.media_policy.rule(chat_id)
+            await event.reply(f"**Правило скачивания файлов чата {chat_id}**\n\n{self._media_rule_text(rule)}")
+            return
+
+        try:
+            rule = await self.ch.set_media_rule(chat_id, payload[1].lower(), *payload[2:])
+        except ValueError as e:
+            await event.reply(f"**Ошибка!**\n\n{e}")
+            return
+
+        if rule is None:
+            await event.reply(f"**Успешно обновлено**\n\nЧат {chat_id} использует общее правило")
+            return
+
+        await event.reply(f"**Успешно обновлено**\n\nЧат: {chat_id}\n{self._media_rule_text(rule)}")
+
+    async def stats_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Stats command")
+
+        await event.reply(await self.stats.render())
+
+    async def unused_keywords_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Unused keywords command")
+        msg = event.message.to_dict()['message']
+
+        days = msg.split()[1] if len(msg.split()) > 1 else str(UNUSED_KEYWORDS_DAYS)
+
+        if not days.isdigit() or int(days) < 1:
+            await event.reply("Количество дней должно быть **целым числом больше нуля**")
+            return
+
+        keywords, themes = await self.kh.unused(int(days))
+
+        await event.reply(
+            f"**Без совпадений за {days} дней**\n\n"
+            f"Словоформ: {len(keywords)} из {len(await self.kh.get_keywords())}\n"
+            f"Темы: {', '.join(themes) if themes else 'нет'}"
+        )
+
+        if keywords:
+            async with export_file(UNUSED_KEYWORDS_FILENAME, keywords, separator='-') as path:
+                await self.client.send_file(event.chat_id, path)
+
+    @check_args_count(2)
+    async def search_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Search command")
+        msg = event.message.to_dict()['message']
+
+        payload = msg.split()[1].split('-')
+        page = 1
+
+        if len(payload) > 1 and payload[-1].isdigit():
+            page = int(payload.pop())
+
+        if page < 1:
+            await event.reply("Номер страницы должен быть **больше нуля**")
+            return
+
+        query = ' '.join(payload).replace('+', ' ')
+
+        results = await self.ch.search_messages(query, page)
+
+        if not results:
+            await event.reply(f"По запросу '{query}' **ничего не найдено**")
+            return
+
+        st = '\n\n'.join([
+            f"`{el.chat_id}` / `{el.message_id}` - {el.date:%d.%m.%Y %H:%M}\n{el.snippet}"
+            for el in results
+        ])
+
+        await event.reply(f"**Результаты поиска** '{query}' (страница {page}):\n\n{st}")
+
+    async def import_keywords_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Import keywords command")
+
+        file = event.message.file
+
+        if event.message.document is None or file is None:
+            await event.reply("Прикрепите к команде файл **.json** или **.csv**")
+            return
+
+        if file.size > IMPORT_MAX_FILE_SIZE:
+            await event.reply(f"Файл слишком большой, максимум **{IMPORT_MAX_FILE_SIZE // 1024} КБ**")
+            return
+
+        content = await event.message.download_media(bytes)
+
+        try:
+            data = await self.transfer.import_file(file.name or '', content)
+        except ValueError as e:
+            await event.reply(f"**Ошибка!** {e}")
+            return
+        except IntegrityError as e:
+            logger.error(e)
+            await event.reply("**Ошибка!** Не получилось записать данные, ничего не было изменено")
+            return
+
+        await event.reply(
+            f"**Импорт завершен**\n\nСловоформ: {data['keywords_count']}\nТем: {data['themes_count']}"
+        )
+
+        if data['missing_keywords']:
+            await event.reply(
+                f"В темы не добавлены слова\n\n{'-'.join(data['missing_keywords'])}\n\nТак как их **нет в базе данных**"
+            )
+
+    async def export_keywords_command(self, event: events.NewMessage.Event):
+        logger.info(f"{LoggerTags.COMMAND.value} Export keywords command")
+        msg = event.message.to_dict()['message']
+
+        fmt = msg.split()[1].lower() if len(msg.split()) > 1 else 'json'
+
+        try:
+            items = await self.transfer.export_items(fmt)
+        except ValueError as e:
+            await event.reply(f"**Ошибка!** {e}")
+            return
 
+        async with export_file(f"{KEYWORDS_EXPORT_FILENAME}.{fmt}", items) as path:
+            await self.client.send_file(event.chat_id, path)
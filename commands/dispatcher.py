@@ -0,0 +1,204 @@
+import asyncio
+import contextlib
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from loguru import logger
+from telethon import events
+
+from config import LoggerTags, COMMAND_WORKERS, COMMAND_QUEUE_SIZE, COMMAND_TIMEOUT, COMMAND_BACKGROUND_TIMEOUT
+from metrics import COMMAND_SECONDS, COMMAND_QUEUE_DEPTH
+
+
+@dataclass
+class CommandOptions:
+    # сколько экземпляров команды может выполняться одновременно
+    concurrency: int = 2
+    # None - COMMAND_TIMEOUT для обычных команд и COMMAND_BACKGROUND_TIMEOUT для фоновых
+    timeout: Optional[float] = None
+    # долгая команда: выполняется в фоне, пользователь сразу получает сообщение о запуске
+    background: bool = False
+    # данные в бд, которые меняет команда (chats, keywords, themes, media).
+    # Команды, меняющие одни и те же данные, выполняются строго по одной
+    resources: Tuple[str, ...] = ()
+
+
+DEFAULT_OPTIONS = CommandOptions()
+
+COMMANDS_OPTIONS: Dict[str, CommandOptions] = {
+    '/chats': CommandOptions(concurrency=1, background=True),
+    '/listeningChats': CommandOptions(concurrency=1, background=True),
+    '/keywords': CommandOptions(concurrency=1, background=True),
+    '/allThemes': CommandOptions(concurrency=1, background=True),
+    '/exportKeywords': CommandOptions(concurrency=1, background=True),
+    '/search': CommandOptions(concurrency=4),
+    '/stats': CommandOptions(concurrency=1),
+    '/unusedKeywords': CommandOptions(concurrency=1),
+    '/addChat': CommandOptions(concurrency=1, resources=('chats',)),
+    '/removeChat': CommandOptions(concurrency=1, resources=('chats',)),
+    '/addKeyword': CommandOptions(concurrency=1, background=True, resources=('keywords',)),
+    '/removeKeyword': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/removeKeywords': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/editKeyword': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/addTheme': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/addKeyWordsToTheme': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/removeKeywordsFromTheme': CommandOptions(concurrency=1, resources=('keywords', 'themes')),
+    '/removeThemes': CommandOptions(concurrency=1, resources=('themes',)),
+    '/followThemes': CommandOptions(concurrency=1, resources=('themes',)),
+    '/unfollowThemes': CommandOptions(concurrency=1, resources=('themes',)),
+    '/changeIntervalTheme': CommandOptions(concurrency=1, resources=('themes',)),
+    '/themeDelivery': CommandOptions(concurrency=1, resources=('themes',)),
+    '/themePriority': CommandOptions(concurrency=1, resources=('themes',)),
+    '/mediaPolicy': CommandOptions(concurrency=1, resources=('media',)),
+    '/importKeywords': CommandOptions(concurrency=1, background=True, resources=('keywords',)),
+}
+
+
+class CommandDispatcher:
+    """
+    Очередь команд из чата команд.
+    Команды разбираются COMMAND_WORKERS обработчиками, у каждой команды свой лимит одновременных запусков
+    и таймаут, долгие команды выполняются в фоне, чтобы не задерживать очередь.
+    Команды, меняющие одни и те же данные, выполняются строго по одной: блокировки берутся
+    по ресурсам команды уже вне обработчика очереди, поэтому ожидание блокировки не занимает обработчик.
+    Команды в очереди и вынесенные из нее вместе ограничены COMMAND_QUEUE_SIZE
+    """
+
+    def __init__(self, handlers: Dict[str, Callable], options: Dict[str, CommandOptions] = None):
+        self.handlers = handlers
+        self.options = options if options is not None else COMMANDS_OPTIONS
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=COMMAND_QUEUE_SIZE)
+        self.semaphores = {
+            command: asyncio.Semaphore(self._options(command).concurrency) for command in handlers
+        }
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.workers: Set[asyncio.Task] = set()
+        self.background: Set[asyncio.Task] = set()
+
+    def _options(self, command: str) -> CommandOptions:
+        return self.options.get(command, DEFAULT_OPTIONS)
+
+    def start(self):
+        for _ in range(COMMAND_WORKERS - len(self.workers)):
+            self.workers.add(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self.workers | self.background:
+            task.cancel()
+
+        await asyncio.gather(*self.workers, *self.background, return_exceptions=True)
+        self.workers.clear()
+        self.background.clear()
+
+    async def submit(self, event: events.NewMessage.Event):
+        """
+        Поставить команду в очередь
+        :param event: сообщение с командой
+        """
+        msg = event.message.to_dict()['message']
+        command = msg.split(' ')[0]
+
+        logger.debug(f"{LoggerTags.COMMAND.value} {command=}")
+
+        if command not in self.handlers:
+            await event.reply("**Нет** такой команды")
+            return
+
+        try:
+            # фоновые команды и команды, ждущие блокировку, тоже считаются ожидающими работы
+            if self.queue.qsize() + len(self.background) >= COMMAND_QUEUE_SIZE:
+                raise asyncio.QueueFull
+
+            self.queue.put_nowait((command, event))
+        except asyncio.QueueFull:
+            logger.warning(f"{LoggerTags.COMMAND.value} Command queue is full, {command=} rejected")
+            await event.reply("Сейчас выполняется слишком много команд, **повторите позже**")
+            return
+
+        COMMAND_QUEUE_DEPTH.set(self.queue.qsize())
+
+    async def _worker(self):
+        while True:
+            command, event = await self.queue.get()
+            COMMAND_QUEUE_DEPTH.set(self.queue.qsize())
+
+            try:
+                options = self._options(command)
+
+                if options.background:
+                    self._detach(self._run_background(command, event))
+                elif options.resources:
+                    self._detach(self._run(command, event))
+                else:
+                    await self._run(command, event)
+            except Exception as e:
+                logger.error(f"{LoggerTags.COMMAND.value} Failed to run {command=}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _detach(self, coro):
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def _lock(self, resources: Tuple[str, ...], stack: contextlib.AsyncExitStack):
+        # блокировки берутся в одном порядке, чтобы команды с общими ресурсами не ждали друг друга по кругу
+        for resource in sorted(resources):
+            await stack.enter_async_context(self.locks.setdefault(resource, asyncio.Lock()))
+
+    async def _run_background(self, command: str, event: events.NewMessage.Event):
+        try:
+            progress = await event.reply(f"Команда {command} **выполняется**, результат придет отдельным сообщением")
+        except Exception as e:
+            logger.error(f"{LoggerTags.COMMAND.value} Failed to reply to {command=}: {e}")
+            progress = None
+
+        start = time.perf_counter()
+
+        status = await self._run(command, event)
+
+        text = {
+            'ok': f"Команда {command} **выполнена** за {time.perf_counter() - start:.1f} с",
+            'timeout': f"Команда {command} **прервана**: превышено время выполнения",
+            'error': f"Команда {command} **завершилась с ошибкой**",
+        }[status]
+
+        if progress is None:
+            return
+
+        try:
+            await progress.edit(text)
+        except Exception as e:
+            logger.error(f"{LoggerTags.COMMAND.value} Failed to update progress of {command=}: {e}")
+
+    async def _run(self, command: str, event: events.NewMessage.Event) -> str:
+        """
+        Выполнить команду с учетом лимита, блокировок данных и таймаута
+        :return: ok, timeout или error
+        """
+        options = self._options(command)
+        timeout = options.timeout or (COMMAND_BACKGROUND_TIMEOUT if options.background else COMMAND_TIMEOUT)
+        start = time.perf_counter()
+        status = 'ok'
+
+        logger.info(f"Command {command=}")
+
+        try:
+            async with self.semaphores[command], contextlib.AsyncExitStack() as stack:
+                await self._lock(options.resources, stack)
+                await asyncio.wait_for(self.handlers[command](event), timeout)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.error(f"{LoggerTags.COMMAND.value} {command=} timed out after {timeout}s")
+            if not options.background:
+                await event.reply(f"Команда {command} **прервана**: превышено время выполнения")
+        except Exception as e:
+            status = 'error'
+            logger.exception(f"{LoggerTags.COMMAND.value} {command=} failed: {e}")
+            if not options.background:
+                await event.reply("**Ошибка!** Не получилось выполнить команду")
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - start, command=command, status=status)
+
+        return status
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Iterable, TextIO
+
+
+# сколько элементов асинхронной выгрузки копится перед записью в файл
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _write_items(path: str, items: Iterable[str], separator: str):
+    with open(path, 'w', encoding='utf8') as f:
+        for i, item in enumerate(items):
+            if i:
+                f.write(separator)
+            f.write(item)
+
+
+def _write_chunk(f: TextIO, items: Iterable[str], separator: str, first: bool):
+    if not first:
+        f.write(separator)
+    f.write(separator.join(items))
+
+
+async def _write_async_items(path: str, items: AsyncIterable[str], separator: str):
+    # элементы читаются в event loop (например, страницами из бд), а пишутся в файл пачками в потоке
+    f = await asyncio.to_thread(open, path, 'w', encoding='utf8')
+
+    try:
+        chunk = []
+        first = True
+
+        async for item in items:
+            chunk.append(item)
+
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                await asyncio.to_thread(_write_chunk, f, chunk, separator, first)
+                chunk, first = [], False
+
+        if chunk:
+            await asyncio.to_thread(_write_chunk, f, chunk, separator, first)
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+@asynccontextmanager
+async def export_file(filename: str,
+                      items: Iterable[str] | AsyncIterable[str],
+                      separator: str = '\n') -> AsyncIterator[str]:
+    """
+    Записать элементы в отдельный для каждого запроса временный файл.
+    Запись идет построчно в потоке, чтобы большие выгрузки не блокировали event loop,
+    файл удаляется после выхода из контекста
+    :param filename: имя файла, которое увидит пользователь
+    :param items: элементы выгрузки, асинхронный итератор записывается по мере чтения без сбора в список
+    :param separator: разделитель между элементами
+    :return: путь к файлу
+    """
+    directory = await asyncio.to_thread(tempfile.mkdtemp, prefix='export_')
+    path = os.path.join(directory, filename)
+
+    try:
+        if isinstance(items, AsyncIterable):
+            await _write_async_items(path, items, separator)
+        else:
+            await asyncio.to_thread(_write_items, path, items, separator)
+        yield path
+    finally:
+        await asyncio.to_thread(shutil.rmtree, directory, True)
@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import time
+from typing import List, Optional, Tuple
+
+from config import TIMEZONE, STATS_TOP_SIZE, STATS_DB_CACHE_SECONDS
+from data.dataclasses import DatabaseStatsDB
+from data.db_manager import DBManager
+from metrics import CHAT_MESSAGES, KEYWORD_HITS, THEME_DELIVERIES, THEME_DELIVERY_SECONDS, MEDIA_DOWNLOADS_ACTIVE, \
+    MEDIA_DOWNLOAD_PARTS_PENDING, last_flood_wait
+from outbound import get_outbound_scheduler
+
+
+class PipelineStats:
+    """
+    Отчет /stats о текущей нагрузке. Сообщения, совпадения и доставка берутся из скользящих счетчиков в памяти,
+    очереди - из планировщика отправок и метрик скачивания, поэтому отчет не читает таблицы.
+    Размер бд и количество строк запрашиваются не чаще раза в STATS_DB_CACHE_SECONDS
+    """
+
+    def __init__(self, db_manager: DBManager, top_size: int = STATS_TOP_SIZE):
+        self.db_manager = db_manager
+        self.outbound = get_outbound_scheduler()
+        self.top_size = top_size
+        self._db_stats: Optional[DatabaseStatsDB] = None
+        self._db_stats_at = 0.0
+        self._db_stats_lock = asyncio.Lock()
+
+    async def database_stats(self) -> Tuple[DatabaseStatsDB, datetime.datetime]:
+        """
+        :return: размер бд и количество строк из кэша и время, когда они были получены
+        """
+        async with self._db_stats_lock:
+            if self._db_stats is None or time.monotonic() - self._db_stats_at > STATS_DB_CACHE_SECONDS:
+                self._db_stats = await self.db_manager.stats.database_stats()
+                self._db_stats_at = time.monotonic()
+
+        updated = datetime.datetime.now(TIMEZONE) - datetime.timedelta(seconds=time.monotonic() - self._db_stats_at)
+        return self._db_stats, updated
+
+    async def _chats_section(self) -> List[str]:
+        totals = CHAT_MESSAGES.totals()
+        top = CHAT_MESSAGES.top(self.top_size)
+        dialogs = {el.chat_id: el for el in await self.db_manager.dialogs.get_dialogs_by_ids([el[0] for el in top])}
+
+        lines = [f"**Сообщения по чатам** (всего {sum(totals.values()):g}, "
+                 f"{CHAT_MESSAGES.per_minute(sum(totals.values())):.1f}/мин, чатов {len(totals)})"]
+        lines += [
+            f"`{chat_id}` {dialogs[chat_id].title if chat_id in dialogs else ''} - "
+            f"{count:g} ({CHAT_MESSAGES.per_minute(count):.1f}/мин)"
+            for chat_id, count in top
+        ]
+        return lines
+
+    def _keywords_section(self) -> List[str]:
+        totals = KEYWORD_HITS.totals()
+
+        lines = [f"**Совпадения ключевых слов** (всего {sum(totals.values()):g}, слов {len(totals)})"]
+        lines += [
+            f"{word} - {count:g} ({KEYWORD_HITS.per_minute(count):.1f}/мин)"
+            for word, count in KEYWORD_HITS.top(self.top_size)
+        ]
+        return lines
+
+    def _themes_section(self) -> List[str]:
+        lines = ["**Доставка по темам**"]
+
+        for theme_name, count in THEME_DELIVERIES.top(self.top_size):
+            seconds = THEME_DELIVERY_SECONDS.total(theme_name)
+            lines.append(f"{theme_name} - {count:g} сообщений за {seconds:.1f} с ({seconds / count:.2f} с на сообщение)")
+
+        return lines
+
+    def _queues_section(self) -> List[str]:
+        now = time.monotonic()
+        lanes = []
+
+        for lane in self.outbound.lanes:
+            text = f"{lane}: {len(self.outbound.queues[lane])}"
+            pause = self.outbound.paused_until[lane] - now
+
+            if pause > 0:
+                text += f" (пауза {pause:.0f} с)"
+
+            lanes.append(text)
+
+        return [
+            "**Очереди**",
+            f"Отправка: {', '.join(lanes)}",
+            f"Скачивание: файлов в работе {MEDIA_DOWNLOADS_ACTIVE.value():g}, "
+            f"частей в очереди {MEDIA_DOWNLOAD_PARTS_PENDING.value():g}",
+        ]
+
+    @staticmethod
+    def _flood_wait_section() -> List[str]:
+        event = last_flood_wait()
+
+        if event is None:
+            return ["**Последний FloodWait**: не было"]
+
+        at = datetime.datetime.fromtimestamp(event.at, TIMEZONE)
+        return [f"**Последний FloodWait**: {at:%d.%m.%Y %H:%M:%S}, {event.seconds} с ({event.source})"]
+
+    async def _database_section(self) -> List[str]:
+        stats, updated = await self.database_stats()
+
+        return [
+            f"**База данных** (на {updated:%H:%M:%S})",
+            f"Размер: {stats.size / 1024 / 1024:.1f} МБ",
+            ', '.join(f"{name}: {count}" for name, count in stats.rows.items()),
+        ]
+
+    async def render(self) -> str:
+        minutes = CHAT_MESSAGES.window_seconds / 60
+
+        sections = [
+            [f"**Статистика за последние {minutes:g} мин**"],
+            await self._chats_section(),
+            self._keywords_section(),
+            self._themes_section(),
+            self._queues_section(),
+            self._flood_wait_section(),
+            await self._database_section(),
+        ]
+
+        return '\n\n'.join('\n'.join(section) for section in sections)
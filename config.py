@@ -1,9 +1,14 @@
 import logging
 import os
+import random
 import string
+import sys
 from enum import Enum
+from pathlib import Path
 
 import pytz
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 from loguru import logger
@@ -23,20 +28,11 @@ PASSWORD = os.getenv('PASSWORD')
 # чат в который будут писаться команды для редактирования каких-либо данных
 COMMAND_CHAT = os.getenv('COMMAND_CHAT')
 
-# настройка логирования
-# logging.basicConfig(level=logging.INFO)
-# logger = logging.getLogger(__name__)
-logger.add(
-    "logs/logs.log",
-    rotation="5 MB",
-    compression="zip",
-    retention=4
-)
 
 # Команды и их описание
 commands = {
     '`/start`': '**Базовая информация о командах**\n',
-    '`/chats`': '**Показать все ваши чаты**\n',
+    '`/chats <TITLE>`': '**Показать все ваши каналы**\nМожно указать часть названия TITLE (необязательно), пробелы заменяются символом "+"\n',
     '`/addChat <ID>`': '**Добавить чат для прослушивания.**\nСообщение отправлять в формате "/addChat <chat_id>", например "/addChat 12345" или вместо числового значения можно указать ссылку\n',
     '`/listeningChats`': '**Просмотреть список чатов, которые уже прослушиваются**\n',
     '`/removeChat <ID>`': '**Удалить чат из списка прослушиваемых**\n',
@@ -52,7 +48,15 @@ commands = {
     '`/removeThemes <THEME_NAME>-<THEME_NAME>`': '**Удалить тему/темы**\nНеобходимо ввести в формате "<THEME_NAME>-<THEME_NAME>", где\n**THEME_NAME** - название темы, которую хотите удалить\n**Важно** темы должны быть в базе данных\n',
     '`/followThemes <THEME_NAME>-<THEME_NAME>`': '**Начать отслеживать тему/темы**\nНеобходимо ввести в формате "<THEME_NAME>-<THEME_NAME>", где\n**THEME_NAME** - название темы, которую хотите отслеживать\n**Важно** темы должны быть в базе данных\n',
     '`/unfollowThemes <THEME_NAME>-<THEME_NAME>`': '**Прекратить отслеживать тему/темы**\nНеобходимо ввести в формате "<THEME_NAME>-<THEME_NAME>", где\n**THEME_NAME** - название темы, которую больше не хотите отслеживать\n**Важно** темы должны быть в базе данных\n',
-    '`/changeIntervalTheme THEME_NAME-NEW_INTERVAL`': '**Установить для темы новый интервал**\nНеобходимо ввести в формате "THEME_NAME NEW_INTERVAL", где\n**THEME_NAME** - название темы, интревал которой надо изменить\n**NEW_INTERVAL** - (целое число) новый интервал в секундах\n'
+    '`/changeIntervalTheme THEME_NAME-NEW_INTERVAL`': '**Установить для темы новый интервал**\nНеобходимо ввести в формате "THEME_NAME NEW_INTERVAL", где\n**THEME_NAME** - название темы, интревал которой надо изменить\n**NEW_INTERVAL** - (целое число) новый интервал в секундах\n',
+    '`/search QUERY-PAGE`': '**Поиск по сохраненным сообщениям**\nНеобходимо ввести в формате "QUERY-PAGE", где\n**QUERY** - слова для поиска, пробелы заменяются символом "+"\n**PAGE** - (необязательно) номер страницы результатов\n',
+    '`/themeDelivery THEME_NAME-MODE`': '**Режим доставки темы**\nНеобходимо ввести в формате "THEME_NAME-MODE", где\n**MODE** - messages (каждое сообщение отдельно) или digest (одна сводка за интервал, альбомы - одной медиагруппой)\n',
+    '`/themePriority THEME_NAME-LANE`': '**Приоритет отправки темы**\nНеобходимо ввести в формате "THEME_NAME-LANE", где\n**LANE** - urgent, normal или bulk. Пересылки в реальном времени всегда идут в urgent, при ограничениях телеграм менее срочные полосы ждут дольше\n',
+    '`/mediaPolicy CHAT_ID-MODE-TYPES-MAX_MB-MIME`': '**Правило скачивания файлов чата**\nНеобходимо ввести в формате "CHAT_ID-MODE-TYPES-MAX_MB-MIME", где\n**MODE** - all (все файлы), match (только у сообщений, подходящих под отслеживаемые темы), thumb (только миниатюры у подходящих сообщений), none (не скачивать) или default (вернуть общее правило)\n**TYPES** - (необязательно) photo, document или photo,document\n**MAX_MB** - (необязательно) максимальный размер файла в мегабайтах, 0 - без ограничения\n**MIME** - (необязательно) MIME типы через запятую, например image/,application/pdf\nБез MODE команда показывает текущее правило чата\n',
+    '`/stats`': '**Текущая нагрузка**\nЗа последний час (STATS_WINDOW_SECONDS) сообщения по чатам, совпадения ключевых слов, доставка по темам, очереди отправки и скачивания, последний FloodWait, размер бд\n',
+    '`/unusedKeywords <DAYS>`': '**Ключевые слова и темы без совпадений**\nDAYS - (необязательно) за сколько дней, по умолчанию 30. Словоформы приходят файлом в формате для /removeKeywords.\n**Важно**: учитываются только слова и темы, совпадения которых считаются не меньше DAYS дней\n',
+    '`/importKeywords`': '**Импорт ключевых слов и тем из файла**\nПрикрепите к сообщению с командой файл .json или .csv в формате, который выдает /exportKeywords.\nВ JSON: keywords - слова, для которых строятся все словоформы, forms - словоформы как есть, themes - темы (name, interval, is_following, keywords, delivery_mode, priority).\nВ CSV строки "type,value,interval,is_following,keywords,delivery_mode,priority", где type - keyword, form или theme, слова темы разделены символом ";"\n',
+    '`/exportKeywords <FORMAT>`': '**Выгрузить ключевые слова и темы в файл**\nFORMAT - json (по умолчанию) или csv\n'
 }
 
 client = TelegramClient('parser', API_ID, API_HASH)
@@ -62,17 +66,161 @@ LISTENING_CHATS_FILENAME = "listen_chats.txt"
 ALL_CHATS_FILENAME = "all_chats.txt"
 KEYWORDS_FILENAME = "keywords.txt"
 THEMES_FILENAME = "themes.txt"
+KEYWORDS_EXPORT_FILENAME = "keywords_export"
+UNUSED_KEYWORDS_FILENAME = "unused_keywords.txt"
 
 IGNORE_SYMBOLS = string.punctuation
 
 TIMEZONE = pytz.timezone('Europe/Moscow')
 
-UPLOAD_FOLDER = os.getcwd() + "\\media"
+# корень хранилища файлов; в бд путь файла хранится относительно корня, в виде <тип>/<ab>/<cd>/<имя файла>,
+# где подкаталоги - первые символы хэша имени (MEDIA_SHARD_DEPTH уровней), чтобы в одном каталоге не копились сотни тысяч файлов
+MEDIA_ROOT = Path(os.getenv('MEDIA_ROOT', Path.cwd() / 'media')).resolve()
+MEDIA_SHARD_DEPTH = int(os.getenv('MEDIA_SHARD_DEPTH', 2))
+# хранилище файлов: local (MEDIA_ROOT) или s3 (S3-совместимое, нужен пакет boto3), ключи объектов совпадают
+# с путями относительно MEDIA_ROOT, поэтому при переходе на s3 достаточно скопировать каталог в бакет
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'local').lower()
+S3_BUCKET = os.getenv('S3_BUCKET')
+S3_PREFIX = os.getenv('S3_PREFIX', '')
+# адрес для MinIO и других S3-совместимых хранилищ, для AWS не указывается
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+S3_REGION = os.getenv('S3_REGION')
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY')
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY')
+# размер части multipart загрузки в байтах, не меньше 5 МБ
+S3_PART_SIZE = int(os.getenv('S3_PART_SIZE', 8 * 1024 * 1024))
+# каталог, в который файлы сохранялись раньше (os.getcwd() + "\\media"), из него файлы переносятся при запуске
+LEGACY_UPLOAD_FOLDER = os.getcwd() + "\\media"
+
+# поиск почти одинаковых сообщений (репостов) между чатами
+DUPLICATE_WINDOW_SECONDS = int(os.getenv('DUPLICATE_WINDOW_SECONDS', 6 * 60 * 60))
+DUPLICATE_MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', 3))
+DUPLICATE_MIN_WORDS = int(os.getenv('DUPLICATE_MIN_WORDS', 5))
+
+# количество результатов на одной странице команды /search
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 10))
+
+# загрузка истории чата после добавления его в прослушиваемые
+BACKFILL_DAYS = int(os.getenv('BACKFILL_DAYS', 7))
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', 100))
+# паузы в секундах между запросами к телеграм и между пачками сообщений
+BACKFILL_REQUEST_DELAY = float(os.getenv('BACKFILL_REQUEST_DELAY', 1))
+BACKFILL_BATCH_DELAY = float(os.getenv('BACKFILL_BATCH_DELAY', 3))
+
+# догрузка сообщений, пропущенных пока приложение было отключено: при запуске, после переподключения,
+# при пропуске id в канале и раз в CATCH_UP_INTERVAL секунд
+CATCH_UP_CONCURRENCY = int(os.getenv('CATCH_UP_CONCURRENCY', 4))
+CATCH_UP_MAX_MESSAGES = int(os.getenv('CATCH_UP_MAX_MESSAGES', 1000))
+CATCH_UP_INTERVAL = int(os.getenv('CATCH_UP_INTERVAL', 15 * 60))
+# паузы между попытками переподключения к телеграм: от минимальной, каждый раз вдвое дольше, до максимальной
+RECONNECT_MIN_DELAY = float(os.getenv('RECONNECT_MIN_DELAY', 5))
+RECONNECT_MAX_DELAY = float(os.getenv('RECONNECT_MAX_DELAY', 5 * 60))
+
+# локальный кэш диалогов: полное обновление раз в DIALOGS_REFRESH_INTERVAL секунд,
+# между обновлениями кэш поддерживается событиями телеграм
+DIALOGS_REFRESH_INTERVAL = int(os.getenv('DIALOGS_REFRESH_INTERVAL', 6 * 60 * 60))
+DIALOGS_BATCH_SIZE = int(os.getenv('DIALOGS_BATCH_SIZE', 200))
+
+# импорт ключевых слов и тем из файла: максимальный размер файла в байтах,
+# количество процессов для построения словоформ и размер пачки слов в одном запросе к бд
+IMPORT_MAX_FILE_SIZE = int(os.getenv('IMPORT_MAX_FILE_SIZE', 5 * 1024 * 1024))
+IMPORT_MORPH_WORKERS = int(os.getenv('IMPORT_MORPH_WORKERS', min(4, os.cpu_count() or 1)))
+IMPORT_QUERY_CHUNK_SIZE = int(os.getenv('IMPORT_QUERY_CHUNK_SIZE', 500))
+
+# выполнение команд: количество обработчиков очереди, размер очереди,
+# таймауты обычных и фоновых команд в секундах
+COMMAND_WORKERS = int(os.getenv('COMMAND_WORKERS', 4))
+COMMAND_QUEUE_SIZE = int(os.getenv('COMMAND_QUEUE_SIZE', 100))
+COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', 60))
+COMMAND_BACKGROUND_TIMEOUT = float(os.getenv('COMMAND_BACKGROUND_TIMEOUT', 30 * 60))
+
+# HTTP сервер с метриками в формате Prometheus, 0 - выключен (по умолчанию)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# команда /stats: окно скользящих счетчиков и размер корзины в секундах, сколько строк показывать в каждом списке
+# и сколько секунд кэшируются размер бд и количество строк в таблицах
+STATS_WINDOW_SECONDS = int(os.getenv('STATS_WINDOW_SECONDS', 60 * 60))
+STATS_BUCKET_SECONDS = int(os.getenv('STATS_BUCKET_SECONDS', 60))
+STATS_TOP_SIZE = int(os.getenv('STATS_TOP_SIZE', 10))
+STATS_DB_CACHE_SECONDS = int(os.getenv('STATS_DB_CACHE_SECONDS', 10 * 60))
+
+# совпадения ключевых слов и тем копятся в памяти и записываются в таблицу match_stats раз в MATCH_STATS_FLUSH_SECONDS,
+# /unusedKeywords по умолчанию ищет слова и темы без совпадений за UNUSED_KEYWORDS_DAYS дней
+MATCH_STATS_KEYWORD = 'keyword'
+MATCH_STATS_THEME = 'theme'
+MATCH_STATS_FLUSH_SECONDS = int(os.getenv('MATCH_STATS_FLUSH_SECONDS', 60))
+UNUSED_KEYWORDS_DAYS = int(os.getenv('UNUSED_KEYWORDS_DAYS', 30))
+
+# трассировка этапов обработки: none, console, file или otel (OpenTelemetry)
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+TRACING_FILENAME = os.getenv('TRACING_FILENAME', 'logs/traces.jsonl')
+
+# пауза между отправками сообщений по темам
+SEND_DELAY_SECONDS = float(os.getenv('SEND_DELAY_SECONDS', 0.3))
+
+# полосы приоритета исходящих отправок, от самой срочной: пересылки в реальном времени,
+# обычные темы и массовые рассылки (дайджесты, история). Полоса темы задается командой /themePriority
+OUTBOUND_LANE_URGENT = 'urgent'
+OUTBOUND_LANE_NORMAL = 'normal'
+OUTBOUND_LANE_BULK = 'bulk'
+OUTBOUND_LANES = (OUTBOUND_LANE_URGENT, OUTBOUND_LANE_NORMAL, OUTBOUND_LANE_BULK)
+# повторы отправки после FloodWait и во сколько раз дольше ждет каждая следующая менее срочная полоса
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+OUTBOUND_BACKOFF_FACTOR = float(os.getenv('OUTBOUND_BACKOFF_FACTOR', 2))
+
+# скачивание файлов из сообщений: all - все файлы, match - только у сообщений, подходящих под отслеживаемые темы,
+# thumb - у подходящих сообщений только миниатюра, none - не скачивать. Правила отдельных чатов задаются /mediaPolicy
+MEDIA_MODE_ALL = 'all'
+MEDIA_MODE_MATCH = 'match'
+MEDIA_MODE_THUMB = 'thumb'
+MEDIA_MODE_NONE = 'none'
+MEDIA_MODES = (MEDIA_MODE_ALL, MEDIA_MODE_MATCH, MEDIA_MODE_THUMB, MEDIA_MODE_NONE)
+MEDIA_DOWNLOAD_MODE = os.getenv('MEDIA_DOWNLOAD_MODE', MEDIA_MODE_MATCH)
+# правило по умолчанию: типы файлов и MIME типы (или префиксы вида image/) через запятую, пусто - любые,
+# максимальный размер файла в мегабайтах, 0 - без ограничения
+MEDIA_TYPES = os.getenv('MEDIA_TYPES', '')
+MEDIA_MIME_TYPES = os.getenv('MEDIA_MIME_TYPES', '')
+MEDIA_MAX_SIZE_MB = float(os.getenv('MEDIA_MAX_SIZE_MB', 50))
+# сколько последних альбомов помнить, чтобы скачивать части альбома, подпись которого подошла под тему
+MEDIA_ALBUMS_CACHE_SIZE = int(os.getenv('MEDIA_ALBUMS_CACHE_SIZE', 1000))
+
+# документы от DOWNLOAD_CHUNKED_MIN_SIZE байт качаются частями в DOWNLOAD_WORKERS параллельных запросов
+# с продолжением после обрыва, каждая часть повторяется до DOWNLOAD_PART_RETRIES раз
+DOWNLOAD_CHUNKED_MIN_SIZE = int(os.getenv('DOWNLOAD_CHUNKED_MIN_SIZE', 10 * 1024 * 1024))
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 4))
+DOWNLOAD_PART_RETRIES = int(os.getenv('DOWNLOAD_PART_RETRIES', 3))
+# сколько не скачанных файлов докачивается за один проход (вместе с догрузкой пропущенных сообщений)
+DOWNLOAD_RETRY_BATCH_SIZE = int(os.getenv('DOWNLOAD_RETRY_BATCH_SIZE', 50))
+
+# файл JSONL, в который записываются все входящие сообщения для python -m benchmarks.replay, пусто - не записывать
+RECORD_MESSAGES_FILENAME = os.getenv('RECORD_MESSAGES_FILENAME', '')
+
+# режимы доставки тем: каждое сообщение отдельно или дайджест за интервал
+THEME_DELIVERY_MESSAGES = 'messages'
+THEME_DELIVERY_DIGEST = 'digest'
+THEME_DELIVERY_MODES = (THEME_DELIVERY_MESSAGES, THEME_DELIVERY_DIGEST)
+# длина одного сообщения дайджеста (лимит телеграм - 4096 символов) и фрагмента текста в нем
+DIGEST_MAX_LENGTH = int(os.getenv('DIGEST_MAX_LENGTH', 4000))
+DIGEST_SNIPPET_LENGTH = int(os.getenv('DIGEST_SNIPPET_LENGTH', 200))
 
 SQLITE_FILENAME = "database.db"
-SQLITE_DATABASE_PATH = f"./{SQLITE_FILENAME}"
+SQLITE_DATABASE_PATH = os.getenv('SQLITE_DATABASE_PATH', f"./{SQLITE_FILENAME}")
 SQLITE_DATABASE_URL = f"sqlite+aiosqlite:///{SQLITE_DATABASE_PATH}"
 
+# задачи тем хранятся в бд, чтобы переживать перезапуск. По умолчанию - отдельный файл рядом с основной бд:
+# планировщик пишет в него синхронным драйвером и не блокирует запись сообщений в основной файл
+SCHEDULER_JOBSTORE_FILENAME = "jobs.db"
+SCHEDULER_JOBSTORE_URL = os.getenv(
+    'SCHEDULER_JOBSTORE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(SQLITE_DATABASE_PATH), SCHEDULER_JOBSTORE_FILENAME)}"
+)
+THEMES_JOBSTORE = 'themes'
+# одна задача на все темы с одинаковым интервалом вместо задачи на каждую тему
+COALESCE_THEME_JOBS = os.getenv('COALESCE_THEME_JOBS', 'true').lower() == 'true'
+# сколько секунд после пропущенного запуска задачу еще можно выполнить
+THEME_JOB_MISFIRE_GRACE_TIME = int(os.getenv('THEME_JOB_MISFIRE_GRACE_TIME', 60))
+
 PG_HOST = os.getenv("PG_HOST")
 PG_PORT = os.getenv("PG_PORT")
 PG_DATABASE = os.getenv("PG_DATABASE")
@@ -88,6 +236,47 @@ class LoggerTags(Enum):
     SCHEDULER = '[Scheduler]'
 
 
+# настройка логирования
+# запись в консоль и файл (включая ротацию и архивацию) идет в фоновом потоке, чтобы не блокировать event loop
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
+# уровни для отдельных тегов, сообщения с тегом ниже уровня отбрасываются
+LOG_TAG_LEVELS = {
+    LoggerTags.HANDLER.value: os.getenv('LOG_LEVEL_HANDLER', 'INFO'),
+    LoggerTags.DATABASE.value: os.getenv('LOG_LEVEL_DATABASE', 'INFO'),
+}
+# доля записываемых строк для логов по каждому сообщению (sampled_logger)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+
+_log_tag_levels = {tag: logger.level(level).no for tag, level in LOG_TAG_LEVELS.items()}
+
+
+def _log_filter(record) -> bool:
+    if record["extra"].get("sampled") and random.random() >= LOG_SAMPLE_RATE:
+        return False
+
+    for tag, level in _log_tag_levels.items():
+        if record["message"].startswith(tag):
+            return record["level"].no >= level
+
+    return True
+
+
+logger.remove()
+logger.add(sys.stderr, level=LOG_LEVEL, filter=_log_filter, enqueue=True)
+logger.add(
+    "logs/logs.log",
+    level=LOG_LEVEL,
+    filter=_log_filter,
+    enqueue=True,
+    rotation="5 MB",
+    compression="zip",
+    retention=4
+)
+
+# логгер для строк, которые пишутся на каждое сообщение
+sampled_logger = logger.bind(sampled=True)
+
+
 class MessageFiletypes(Enum):
     PHOTO = 'photo'
     DOCUMENT = 'document'
@@ -96,4 +285,15 @@ class MessageFiletypes(Enum):
 engine = create_async_engine(SQLITE_DATABASE_URL)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
-scheduler = AsyncIOScheduler()
+scheduler = AsyncIOScheduler(
+    jobstores={
+        'default': MemoryJobStore(),
+        THEMES_JOBSTORE: SQLAlchemyJobStore(url=SCHEDULER_JOBSTORE_URL),
+    },
+    job_defaults={
+        # пропущенные запуски схлопываются в один, и задача никогда не выполняется параллельно сама с собой
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': THEME_JOB_MISFIRE_GRACE_TIME,
+    }
+)
@@ -7,5 +7,9 @@ from .models import (
     KeywordsModel,
     MessagesModel,
     ThemeModel,
-    FilesModel
+    FilesModel,
+    BackfillCheckpointModel,
+    DialogModel,
+    MediaRuleModel,
+    MatchStatsModel
 )
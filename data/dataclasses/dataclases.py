@@ -1,25 +1,30 @@
 import datetime
 from abc import ABCMeta
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 
 class BaseChat(metaclass=ABCMeta):
+    # без пустых слотов у базового класса DTO со слотами все равно получали бы __dict__
+    __slots__ = ()
+
     def to_dict(self) -> Dict[str, str]:
         pass
 
 
-@dataclass
+# DTO неизменяемые и со __slots__: их создаются тысячи на каждую выборку сообщений.
+# ChatNameMixin без слотов - два базовых класса со слотами нельзя объединить в AddChatDB
+@dataclass(frozen=True, slots=True)
 class ChatIdMixin:
     chat_id: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class ChatNameMixin:
     chat_name: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AddChatDB(ChatIdMixin, ChatNameMixin, BaseChat):
     def to_dict(self) -> Dict[str, str]:
         return {
@@ -28,7 +33,7 @@ class AddChatDB(ChatIdMixin, ChatNameMixin, BaseChat):
         }
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AllChatsDB(ChatIdMixin, ChatNameMixin, BaseChat):
     id: int
 
@@ -39,7 +44,7 @@ class AllChatsDB(ChatIdMixin, ChatNameMixin, BaseChat):
         }
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ListeningChatsDB(ChatIdMixin, BaseChat):
     id: int
 
@@ -53,7 +58,7 @@ async def compare_chats_by_chat_id(chat1: ChatIdMixin, chat2: ChatIdMixin) -> bo
     return str(chat1.chat_id) == str(chat2.chat_id)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class KeywordsDB:
     id: int
     word: str
@@ -63,23 +68,35 @@ async def compare_keywords_by_word(kw1: KeywordsDB, kw2: KeywordsDB) -> bool:
     return str(kw1.word) == str(kw2.word)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ThemeDB:
     id: int
     theme_name: str
     is_following: bool
     interval: int
     keywords: List[KeywordsDB]
+    delivery_mode: str = 'messages'
+    priority: str = 'normal'
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AddThemeDB:
     theme_name: str
     interval: int
     keywords: List[KeywordsDB]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
+class ImportThemeDB:
+    theme_name: str
+    interval: int
+    keywords: List[str]
+    is_following: Optional[bool] = None
+    delivery_mode: Optional[str] = None
+    priority: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
 class FileDB(ChatIdMixin):
     document_id: str
     file_name: str
@@ -87,12 +104,96 @@ class FileDB(ChatIdMixin):
     file_type: str
     message_id: str
     original_filename: Optional[str] = None
+    is_downloaded: bool = True
+
+
+@dataclass(frozen=True, slots=True)
+class FileLocationDB:
+    id: int
+    file_type: str
+    file_name: str
+    file_path: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MessageDB(ChatIdMixin):
     message_id: str
     message: str
     date: datetime.datetime
     links: Optional[str] = None
     grouped_id: Optional[int] = None
+    fingerprint: Optional[str] = None
+    duplicate_of: Optional[int] = None
+
+
+@dataclass(frozen=True, slots=True)
+class MessageFingerprintDB:
+    id: int
+    fingerprint: str
+    date: datetime.datetime
+
+
+@dataclass(frozen=True, slots=True)
+class SearchResultDB(ChatIdMixin):
+    id: int
+    message_id: str
+    date: datetime.datetime
+    snippet: str
+
+
+@dataclass(frozen=True, slots=True)
+class BackfillCheckpointDB(ChatIdMixin):
+    last_message_id: int
+    is_finished: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class DialogDB(ChatIdMixin):
+    title: str
+    is_channel: bool
+    username: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class DeliveryMessageDB(ChatIdMixin):
+    """
+    Сообщение для рассылки по темам, собирается из строк запроса без ORM объектов
+    """
+    id: int
+    message_id: str
+    message: Optional[str]
+    date: datetime.datetime
+    grouped_id: Optional[int] = None
+    links: Optional[str] = None
+    files: Tuple[FileDB, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class MediaRuleDB(ChatIdMixin):
+    """
+    Правило скачивания файлов чата: режим, допустимые типы, MIME типы и размер
+    """
+    mode: str
+    types: Tuple[str, ...] = ()
+    mime_types: Tuple[str, ...] = ()
+    max_size: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class DatabaseStatsDB:
+    """
+    Размер бд в байтах и количество строк по таблицам
+    """
+    size: int
+    rows: Dict[str, int]
+
+
+@dataclass(frozen=True, slots=True)
+class MatchHitsDB:
+    """
+    Совпадения ключевого слова (kind=keyword) или темы (kind=theme), накопленные в памяти с последней записи
+    """
+    kind: str
+    name: str
+    hits: int
+    last_hit: datetime.datetime
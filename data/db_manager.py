@@ -1,18 +1,25 @@
 import datetime
+from functools import cached_property
 from pprint import pprint
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, text, func, cast, Integer, or_
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 
-from config import async_session, LoggerTags
+from config import async_session, LoggerTags, engine, TIMEZONE, sampled_logger, IMPORT_QUERY_CHUNK_SIZE, \
+    MATCH_STATS_KEYWORD, MATCH_STATS_THEME
 from data import (
     ListeningChatModel,
     KeywordsModel,
     ThemeModel,
     MessagesModel,
     FilesModel,
+    BackfillCheckpointModel,
+    DialogModel,
+    MediaRuleModel,
+    MatchStatsModel,
 )
 from data.interfaces import (
     ListeningChatInterface,
@@ -20,13 +27,23 @@ from data.interfaces import (
     MessagesInterface,
     ThemeInterface,
     FilesInterface,
+    BackfillInterface,
+    DialogsInterface,
+    MediaRulesInterface,
+    StatsInterface,
 )
-from data.dataclasses import ListeningChatsDB, KeywordsDB, MessageDB, FileDB, ThemeDB, AddThemeDB
+from data.dataclasses import ListeningChatsDB, KeywordsDB, MessageDB, FileDB, ThemeDB, AddThemeDB, MessageFingerprintDB, \
+    SearchResultDB, BackfillCheckpointDB, DialogDB, ImportThemeDB, DeliveryMessageDB, MediaRuleDB, \
+    FileLocationDB, DatabaseStatsDB, MatchHitsDB
+from data.instrumentation import instrumented
+from data.locks import serialized
 from data.models import theme_keyword_association
 
 from loguru import logger
 
 
+@serialized
+@instrumented
 class ListeningChatsDataManager(ListeningChatInterface):
     def __init__(self):
         super().__init__()
@@ -88,28 +105,68 @@ class ListeningChatsDataManager(ListeningChatInterface):
         await self.session.commit()
 
 
+@serialized
+@instrumented
 class ThemesDataManager(ThemeInterface):
     def __init__(self):
         super().__init__()
         self.session = async_session()
 
     async def all_themes(self) -> List[ThemeDB]:
+        """
+        Все темы с ключевыми словами: два запроса по колонкам, без ORM объектов и запроса на каждую тему
+        """
         logger.debug(f"{LoggerTags.DATABASE.value} All themes")
-        themes_all = await self.session.execute(select(ThemeModel))
-        themes_all = themes_all.scalars().all()
 
-        themes = [
+        themes_rows = (await self.session.execute(
+            select(
+                ThemeModel.id,
+                ThemeModel.theme_name,
+                ThemeModel.is_following,
+                ThemeModel.interval,
+                ThemeModel.delivery_mode,
+                ThemeModel.priority
+            )
+            .order_by(ThemeModel.id)
+        )).all()
+
+        keywords_rows = (await self.session.execute(
+            select(theme_keyword_association.c.theme_id, KeywordsModel.id, KeywordsModel.word)
+            .join(KeywordsModel, KeywordsModel.id == theme_keyword_association.c.keyword_id)
+        )).all()
+
+        keywords: Dict[int, List[KeywordsDB]] = {}
+        for row in keywords_rows:
+            keywords.setdefault(row.theme_id, []).append(KeywordsDB(id=row.id, word=row.word))
+
+        return [
             ThemeDB(
-                id=theme.id,
-                theme_name=theme.theme_name,
-                is_following=theme.is_following,
-                interval=theme.interval,
-                keywords=await self.get_keyword_list_for_theme(theme.theme_name)
+                id=row.id,
+                theme_name=row.theme_name,
+                is_following=row.is_following,
+                interval=row.interval,
+                keywords=keywords.get(row.id, []),
+                delivery_mode=row.delivery_mode,
+                priority=row.priority
             )
-            for theme in themes_all
+            for row in themes_rows
         ]
 
-        return themes
+    async def followed_keywords(self) -> List[str]:
+        """
+        Ключевые слова всех отслеживаемых тем одним запросом
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Followed themes keywords")
+
+        res = await self.session.execute(
+            select(KeywordsModel.word)
+            .join(theme_keyword_association, theme_keyword_association.c.keyword_id == KeywordsModel.id)
+            .join(ThemeModel, ThemeModel.id == theme_keyword_association.c.theme_id)
+            .where(ThemeModel.is_following.is_(True))
+            .distinct()
+        )
+
+        return list(res.scalars().all())
 
     async def get_theme(self, theme_name: str) -> Optional[ThemeModel]:
         logger.debug(f"{LoggerTags.DATABASE.value} Get theme {theme_name}")
@@ -121,6 +178,35 @@ class ThemesDataManager(ThemeInterface):
 
         return theme
 
+    async def get_themes_by_names(self, theme_names: List[str]) -> Dict[str, ThemeModel]:
+        """
+        Найти темы по списку названий одним запросом
+        :return: словарь название темы -> тема, отсутствующих в бд тем в нем нет
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Get themes {theme_names}")
+
+        if not theme_names:
+            return {}
+
+        res = await self.session.execute(
+            select(ThemeModel)
+            .options(joinedload(ThemeModel.keywords))
+            .where(ThemeModel.theme_name.in_(theme_names))
+            .execution_options(populate_existing=True)
+        )
+
+        return {theme.theme_name: theme for theme in res.unique().scalars().all()}
+
+    async def _keyword_models(self, keywords: List[KeywordsDB]) -> List[KeywordsModel]:
+        if not keywords:
+            return []
+
+        res = await self.session.execute(
+            select(KeywordsModel).where(KeywordsModel.word.in_([el.word for el in keywords]))
+        )
+
+        return list(res.scalars().all())
+
     async def get_keyword_list_for_theme(self, theme_name: str) -> List[KeywordsDB]:
         logger.debug(f"{LoggerTags.DATABASE.value} Get keywords for theme {theme_name}")
 
@@ -137,23 +223,17 @@ class ThemesDataManager(ThemeInterface):
         return []
 
     async def add_keyword_to_theme(self, theme_name: str, keywords: List[KeywordsDB]):
-        logger.debug(LoggerTags.DATABASE.value[0] + f" Adding {keywords} keywords to {theme_name}")
-
-        old_keywords = await self.get_keyword_list_for_theme(theme_name)
-        old_keywords_words = [el.word for el in old_keywords]
+        logger.debug(f"{LoggerTags.DATABASE.value} Adding {keywords} keywords to {theme_name}")
 
         theme_db = await self.get_theme(theme_name)
 
         if theme_db is None:
             raise KeyError(f"Нет такой темы '{theme_name}'")
 
-        for keyword in keywords:
-            if keyword.word not in old_keywords_words:
-                kw = await self.session.execute(
-                    select(KeywordsModel).where(KeywordsModel.word == keyword.word)
-                )
-                kw = kw.scalars().first()
+        old_keywords_ids = {el.id for el in theme_db.keywords}
 
+        for kw in await self._keyword_models(keywords):
+            if kw.id not in old_keywords_ids:
                 theme_db.keywords.append(kw)
 
         try:
@@ -170,13 +250,8 @@ class ThemesDataManager(ThemeInterface):
         if theme_db is None:
             raise KeyError(f"Нет такой темы '{theme_name}'")
 
-        for keyword in keywords:
-            keyword_db = await self.session.execute(
-                select(KeywordsModel).where(KeywordsModel.word == keyword.word)
-            )
-            keyword_db = keyword_db.scalars().first()
-
-            if keyword_db and keyword_db in theme_db.keywords:
+        for keyword_db in await self._keyword_models(keywords):
+            if keyword_db in theme_db.keywords:
                 theme_db.keywords.remove(keyword_db)
 
         try:
@@ -188,18 +263,7 @@ class ThemesDataManager(ThemeInterface):
     async def add_theme(self, theme: AddThemeDB):
         logger.debug(f"{LoggerTags.DATABASE.value} Add theme {theme.theme_name}")
 
-        keywords = []
-
-        for keyword_name in theme.keywords:
-            exists = await self.session.execute(
-                select(KeywordsModel).where(KeywordsModel.word == keyword_name.word)
-            )
-            keyword = exists.scalars().first()
-            if keyword is None:
-                keyword = KeywordsModel(word=keyword_name)
-                self.session.add(keyword)
-                await self.session.commit()
-            keywords.append(keyword)
+        keywords = await self._keyword_models(theme.keywords)
 
         new_theme = ThemeModel(
             theme_name=theme.theme_name,
@@ -213,10 +277,29 @@ class ThemesDataManager(ThemeInterface):
             await self.session.rollback()
             raise e
 
-    async def remove_themes(self, themes: List[ThemeModel]):
-        logger.debug(f"{LoggerTags.DATABASE.value} Remove themes")
-        for theme in themes:
-            await self.remove_theme(theme.theme_name)
+    async def remove_themes(self, theme_names: List[str]):
+        """
+        Удалить темы и их связи с ключевыми словами в одной транзакции
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Remove themes {theme_names}")
+
+        if not theme_names:
+            return
+
+        theme_ids = select(ThemeModel.id).where(ThemeModel.theme_name.in_(theme_names)).scalar_subquery()
+
+        await self.session.execute(
+            delete(theme_keyword_association).where(theme_keyword_association.c.theme_id.in_(theme_ids))
+        )
+        await self.session.execute(
+            delete(ThemeModel).where(ThemeModel.theme_name.in_(theme_names))
+        )
+
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise e
 
     async def remove_theme(self, theme_name: str):
         logger.debug(f"{LoggerTags.DATABASE.value} Removing theme with {theme_name=}")
@@ -278,15 +361,123 @@ class ThemesDataManager(ThemeInterface):
             await self.session.rollback()
             raise e
 
+    async def set_following(self, theme_names: List[str], is_following: bool):
+        """
+        Обновить статус отслеживания у нескольких тем одним запросом
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Set {is_following=} for themes {theme_names=}")
+
+        if not theme_names:
+            return
+
+        await self.session.execute(
+            update(ThemeModel)
+            .where(ThemeModel.theme_name.in_(theme_names))
+            .values(is_following=is_following)
+        )
+
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise e
+
     async def follow_themes(self, theme_names: List[str]):
         logger.debug(f"{LoggerTags.DATABASE.value} Following themes with {theme_names=}")
 
-        _ = [await self.follow_theme(name) for name in theme_names]
+        await self.set_following(theme_names, True)
 
     async def unfollow_themes(self, theme_names: List[str]):
-        logger.debug(f"{LoggerTags.DATABASE.value} Following themes with {theme_names=}")
+        logger.debug(f"{LoggerTags.DATABASE.value} Unfollowing themes with {theme_names=}")
+
+        await self.set_following(theme_names, False)
+
+    async def _keywords_by_words(self, words: List[str]) -> Dict[str, KeywordsModel]:
+        res = {}
+
+        for i in range(0, len(words), IMPORT_QUERY_CHUNK_SIZE):
+            chunk = await self.session.execute(
+                select(KeywordsModel).where(KeywordsModel.word.in_(words[i:i + IMPORT_QUERY_CHUNK_SIZE]))
+            )
+            res.update({kw.word: kw for kw in chunk.scalars().all()})
+
+        return res
+
+    async def import_themes(self, keyword_names: List[str], themes: List[ImportThemeDB]) -> List[str]:
+        """
+        Добавить ключевые слова и создать или обновить темы в одной транзакции
+        :param keyword_names: ключевые слова (уже со всеми словоформами)
+        :param themes: темы, существующие темы получают новый интервал и недостающие слова
+        :return: слова тем, которых нет ни в бд, ни среди добавляемых
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Import {len(keyword_names)} keywords and {len(themes)} themes")
+
+        keyword_names = list(dict.fromkeys(keyword_names))
+        theme_words = list(dict.fromkeys(word for theme in themes for word in theme.keywords))
+
+        try:
+            existing = await self._keywords_by_words(keyword_names)
+            self.session.add_all([KeywordsModel(word=word) for word in keyword_names if word not in existing])
+            await self.session.flush()
+
+            keywords = await self._keywords_by_words(theme_words)
+            themes_db = await self.get_themes_by_names([theme.theme_name for theme in themes])
+
+            for theme in themes:
+                theme_db = themes_db.get(theme.theme_name)
+
+                if theme_db is None:
+                    theme_db = ThemeModel(theme_name=theme.theme_name, interval=theme.interval, keywords=[])
+                    self.session.add(theme_db)
+                    themes_db[theme.theme_name] = theme_db
+
+                theme_db.interval = theme.interval
+                if theme.is_following is not None:
+                    theme_db.is_following = theme.is_following
+                if theme.delivery_mode is not None:
+                    theme_db.delivery_mode = theme.delivery_mode
+                if theme.priority is not None:
+                    theme_db.priority = theme.priority
+
+                old_keywords_ids = {el.id for el in theme_db.keywords}
+
+                for word in theme.keywords:
+                    kw = keywords.get(word)
+                    if kw is not None and kw.id not in old_keywords_ids:
+                        theme_db.keywords.append(kw)
+                        old_keywords_ids.add(kw.id)
+
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise e
+
+        return [word for word in theme_words if word not in keywords]
+
+    async def change_delivery_mode(self, theme_name: str, delivery_mode: str) -> bool:
+        logger.debug(f"{LoggerTags.DATABASE.value} Change delivery mode with {theme_name=} {delivery_mode=}")
+
+        return await self._update_theme(theme_name, delivery_mode=delivery_mode)
+
+    async def change_priority(self, theme_name: str, priority: str) -> bool:
+        logger.debug(f"{LoggerTags.DATABASE.value} Change priority with {theme_name=} {priority=}")
+
+        return await self._update_theme(theme_name, priority=priority)
+
+    async def _update_theme(self, theme_name: str, **values) -> bool:
+        res = await self.session.execute(
+            update(ThemeModel)
+            .where(ThemeModel.theme_name == theme_name)
+            .values(**values)
+        )
+
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise e
 
-        _ = [await self.unfollow_theme(name) for name in theme_names]
+        return res.rowcount > 0
 
     async def change_interval(self, theme_name: str, interval: int):
         logger.debug(f"{LoggerTags.DATABASE.value} Change interval with {theme_name=}" f"{interval=}")
@@ -311,6 +502,8 @@ class ThemesDataManager(ThemeInterface):
         return None
 
 
+@serialized
+@instrumented
 class KeywordsDataManager(KeywordInterface):
     def __init__(self):
         super().__init__()
@@ -360,9 +553,36 @@ class KeywordsDataManager(KeywordInterface):
             )
         return None
 
+    async def get_keywords_by_words(self, keyword_names: List[str]) -> List[KeywordsDB]:
+        """
+        Найти ключевые слова по списку одним запросом, отсутствующих в бд слов в ответе нет
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Getting keywords {keyword_names=}")
+
+        if not keyword_names:
+            return []
+
+        res = await self.session.execute(
+            select(KeywordsModel).where(KeywordsModel.word.in_(keyword_names))
+        )
+
+        return [KeywordsDB(id=kn.id, word=kn.word) for kn in res.scalars().all()]
+
     async def add_keywords(self, keyword_names: list[str]):
+        """
+        Добавить отсутствующие в бд слова в одной транзакции
+        """
         logger.debug(f"{LoggerTags.DATABASE.value} Adding keywords {keyword_names=}")
-        _ = [await self.add_keyword(keyword_name) for keyword_name in keyword_names]
+
+        existing = {el.word for el in await self.get_keywords_by_words(keyword_names)}
+
+        self.session.add_all([KeywordsModel(word=word) for word in set(keyword_names) - existing])
+
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise e
 
     async def remove_keyword(self, keyword_name: str):
         logger.debug(f"{LoggerTags.DATABASE.value} Removing keyword {keyword_name=}")
@@ -373,7 +593,14 @@ class KeywordsDataManager(KeywordInterface):
 
     async def remove_keywords(self, keyword_names: list[str]):
         logger.debug(f"{LoggerTags.DATABASE.value} Removing keywords {keyword_names=}")
-        _ = [await self.remove_keyword(keyword_name) for keyword_name in keyword_names]
+
+        if not keyword_names:
+            return
+
+        await self.session.execute(
+            delete(KeywordsModel).where(KeywordsModel.word.in_(keyword_names))
+        )
+        await self.session.commit()
 
     async def edit_keyword(self, from_kw: str, to_kw) -> Optional[KeywordsModel]:
         logger.debug(f"{LoggerTags.DATABASE.value} Editing keyword {from_kw} to {to_kw}")
@@ -405,10 +632,109 @@ class KeywordsDataManager(KeywordInterface):
         return None
 
 
+def _insert_ignore(dialect: str, model, *index_elements: str):
+    """
+    INSERT, который пропускает строки с уже существующим значением уникального ключа.
+    Проверка и вставка идут одним запросом, поэтому одновременные вставки одной строки не конфликтуют
+    """
+    return (postgresql if dialect == 'postgresql' else sqlite).insert(model).on_conflict_do_nothing(
+        index_elements=list(index_elements)
+    )
+
+
+@instrumented
 class MessagesDataManager(MessagesInterface):
     def __init__(self):
         super().__init__()
         self.asession = async_session
+        self.dialect = engine.dialect.name
+
+    async def create_search_index(self):
+        """
+        Создать полнотекстовый индекс по тексту сообщений.
+        Для SQLite - FTS5 таблица, которую заполняет add_message,
+        для Postgres - вычисляемая колонка tsvector с GIN индексом
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Create search index for {self.dialect}")
+
+        async with self.asession() as session:
+            if self.dialect == 'sqlite':
+                exists = await session.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+                )
+                if exists.first() is not None:
+                    return
+
+                await session.execute(text(
+                    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                    "message, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                ))
+                # индексируем сообщения, сохраненные до появления индекса
+                await session.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+            elif self.dialect == 'postgresql':
+                await session.execute(text(
+                    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(message, ''))) STORED"
+                ))
+                await session.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)"
+                ))
+
+            await session.commit()
+
+        logger.success("Search index created successfully")
+
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        # каждое слово в кавычках, чтобы пользовательский ввод не ломал синтаксис FTS5
+        return ' '.join(f'"{word.replace(chr(34), "")}"*' for word in query.split())
+
+    async def search_messages(self, query: str, limit: int, offset: int = 0) -> List[SearchResultDB]:
+        """
+        Полнотекстовый поиск по сообщениям, сначала самые новые
+        :param query: слова для поиска
+        :param limit: размер страницы
+        :param offset: сколько результатов пропустить
+        :return: найденные сообщения с фрагментом текста
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Search messages {query=} {limit=} {offset=}")
+
+        if not query.split():
+            return []
+
+        if self.dialect == 'sqlite':
+            statement = text(
+                "SELECT m.id, m.chat_id, m.message_id, m.date, "
+                "snippet(messages_fts, 0, '**', '**', '...', 16) AS snippet "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH :query "
+                "ORDER BY messages_fts.rowid DESC LIMIT :limit OFFSET :offset"
+            )
+            params = {'query': self._fts_query(query), 'limit': limit, 'offset': offset}
+        else:
+            statement = text(
+                "SELECT id, chat_id, message_id, date, "
+                "ts_headline('russian', message, plainto_tsquery('russian', :query), "
+                "'StartSel=**, StopSel=**, MaxWords=16, MinWords=8') AS snippet "
+                "FROM messages WHERE search_vector @@ plainto_tsquery('russian', :query) "
+                "ORDER BY id DESC LIMIT :limit OFFSET :offset"
+            )
+            params = {'query': query, 'limit': limit, 'offset': offset}
+
+        async with self.asession() as session:
+            result = await session.execute(statement, params)
+
+            return [
+                SearchResultDB(
+                    id=row.id,
+                    chat_id=row.chat_id,
+                    message_id=row.message_id,
+                    date=row.date,
+                    snippet=row.snippet
+                )
+                for row in result
+            ]
 
     async def all_messages(self) -> List[MessagesModel]:
         logger.debug(f"{LoggerTags.DATABASE.value} All messages")
@@ -417,7 +743,7 @@ class MessagesDataManager(MessagesInterface):
             return res.scalars().all()
 
     async def get_message(self, message_id: str, chat_id: str) -> Optional[MessagesModel]:
-        logger.debug(f"{LoggerTags.DATABASE.value} Get message {message_id} from chat {chat_id}")
+        sampled_logger.debug(f"{LoggerTags.DATABASE.value} Get message {message_id} from chat {chat_id}")
         async with self.asession() as session:
             res = await session.execute(
                 select(MessagesModel)
@@ -429,44 +755,227 @@ class MessagesDataManager(MessagesInterface):
             )
             return res.scalars().first()
 
-    async def get_message_by_interval(self, start_time: datetime.datetime) -> Optional[List[MessagesModel]]:
+    async def get_message_by_interval(self, start_time: datetime.datetime) -> List[DeliveryMessageDB]:
+        """
+        Сообщения для рассылки по темам, полученные начиная с start_time.
+        Читаются только нужные колонки (без ORM объектов), файлы всех сообщений - вторым запросом
+        """
         logger.debug(f"{LoggerTags.DATABASE.value} Get message by interval {start_time=}")
 
+        async with self.asession() as session:
+            rows = (await session.execute(
+                select(
+                    MessagesModel.id,
+                    MessagesModel.chat_id,
+                    MessagesModel.message_id,
+                    MessagesModel.message,
+                    MessagesModel.date,
+                    MessagesModel.grouped_id,
+                    MessagesModel.links
+                )
+                .where(
+                    MessagesModel.received_at >= start_time,
+                    MessagesModel.duplicate_of.is_(None)
+                )
+                .order_by(MessagesModel.id)
+            )).all()
+
+            if not rows:
+                return []
+
+            files_rows = (await session.execute(
+                select(
+                    FilesModel.chat_id,
+                    FilesModel.message_id,
+                    FilesModel.document_id,
+                    FilesModel.file_name,
+                    FilesModel.file_path,
+                    FilesModel.file_type,
+                    FilesModel.original_filename
+                )
+                .where(
+                    FilesModel.message_id.in_({row.message_id for row in rows}),
+                    FilesModel.is_downloaded.is_(True)
+                )
+                .order_by(FilesModel.id)
+            )).all()
+
+        files: Dict[tuple, List[FileDB]] = {}
+        for row in files_rows:
+            files.setdefault((row.chat_id, row.message_id), []).append(FileDB(
+                chat_id=row.chat_id,
+                message_id=row.message_id,
+                document_id=row.document_id,
+                file_name=row.file_name,
+                file_path=row.file_path,
+                file_type=row.file_type,
+                original_filename=row.original_filename
+            ))
+
+        return [
+            DeliveryMessageDB(
+                id=row.id,
+                chat_id=row.chat_id,
+                message_id=row.message_id,
+                message=row.message,
+                date=row.date,
+                grouped_id=row.grouped_id,
+                links=row.links,
+                files=tuple(files.get((row.chat_id, row.message_id), ()))
+            )
+            for row in rows
+        ]
+
+    async def get_fingerprints_since(self, start_time: datetime.datetime) -> List[MessageFingerprintDB]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Get fingerprints since {start_time=}")
+
         async with self.asession() as session:
             result = await session.execute(
-                select(MessagesModel)
-                .options(joinedload(MessagesModel.files))
-                .where(MessagesModel.date >= start_time)
+                select(MessagesModel.id, MessagesModel.fingerprint, MessagesModel.date)
+                .where(
+                    MessagesModel.date >= start_time,
+                    MessagesModel.fingerprint.is_not(None),
+                    MessagesModel.duplicate_of.is_(None)
+                )
+                .order_by(MessagesModel.date)
             )
 
-            return result.unique().scalars().all()
+            return [
+                MessageFingerprintDB(id=row.id, fingerprint=row.fingerprint, date=row.date)
+                for row in result
+            ]
+
+    async def get_last_message_ids(self) -> Dict[str, int]:
+        """
+        Последний сохраненный id сообщения для каждого чата
+        :return: словарь chat_id -> message_id
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Get last message ids")
 
-    async def add_message(self, message: MessageDB):
-        logger.debug(f"{LoggerTags.DATABASE.value} Add message")
         async with self.asession() as session:
-            exists = await self.get_message(message.message_id, message.chat_id)
+            result = await session.execute(
+                select(MessagesModel.chat_id, func.max(cast(MessagesModel.message_id, Integer)))
+                .group_by(MessagesModel.chat_id)
+            )
 
-            if exists is None:
-                msg = MessagesModel(
-                    chat_id=message.chat_id,
-                    message_id=message.message_id,
-                    message=message.message,
-                    grouped_id=message.grouped_id,
-                    date=message.date,
-                    links=message.links
-                )
-                session.add(msg)
+            return {chat_id: last_id for chat_id, last_id in result}
+
+    @staticmethod
+    def _message_row(message: MessageDB, received_at: datetime.datetime) -> dict:
+        return {
+            'chat_id': message.chat_id,
+            'message_id': message.message_id,
+            'message': message.message,
+            'grouped_id': message.grouped_id,
+            'date': message.date,
+            'links': message.links,
+            'fingerprint': message.fingerprint,
+            'duplicate_of': message.duplicate_of,
+            'received_at': received_at,
+        }
+
+    async def add_message(self, message: MessageDB) -> Optional[int]:
+        """
+        Добавить сообщение, если его еще нет
+        :param message: сообщение
+        :return: первичный ключ сообщения в бд, None если сообщение уже было сохранено
+        """
+        sampled_logger.debug(f"{LoggerTags.DATABASE.value} Add message")
+        async with self.asession() as session:
+            try:
+                message_pk = (await session.execute(
+                    _insert_ignore(self.dialect, MessagesModel, 'chat_id', 'message_id')
+                    .values(**self._message_row(message, datetime.datetime.now(TIMEZONE)))
+                    .returning(MessagesModel.id)
+                )).scalar()
+
+                if message_pk is not None and self.dialect == 'sqlite' and message.message:
+                    await session.execute(
+                        text("INSERT INTO messages_fts(rowid, message) VALUES (:id, :message)"),
+                        {'id': message_pk, 'message': message.message}
+                    )
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+
+            return message_pk
+
+    async def add_messages(self, messages: List[MessageDB], files: List[FileDB]) -> List[Optional[int]]:
+        """
+        Добавить пачку сообщений одного чата и их файлы одной транзакцией
+        :param messages: сообщения
+        :param files: файлы этих сообщений
+        :return: первичные ключи в порядке messages, None для уже сохраненных ранее
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Add {len(messages)} messages")
+
+        if not messages:
+            return []
 
+        received_at = datetime.datetime.now(TIMEZONE)
+
+        async with self.asession() as session:
             try:
+                result = await session.execute(
+                    _insert_ignore(self.dialect, MessagesModel, 'chat_id', 'message_id')
+                    .returning(MessagesModel.id, MessagesModel.chat_id, MessagesModel.message_id),
+                    [self._message_row(el, received_at) for el in messages]
+                )
+                added = {(row.chat_id, row.message_id): row.id for row in result}
+
+                if files:
+                    await session.execute(
+                        _insert_ignore(self.dialect, FilesModel, 'document_id'),
+                        [
+                            {
+                                'document_id': str(file.document_id),
+                                'file_name': file.file_name,
+                                'file_type': file.file_type,
+                                'file_path': file.file_path,
+                                'message_id': str(file.message_id),
+                                'chat_id': file.chat_id,
+                                'original_filename': file.original_filename,
+                                'is_downloaded': file.is_downloaded,
+                            }
+                            for file in files
+                        ]
+                    )
+
+                # повтор сообщения внутри пачки получает None, как и сохраненное ранее
+                message_pks = [added.pop((el.chat_id, el.message_id), None) for el in messages]
+
+                if self.dialect == 'sqlite':
+                    fts_rows = [
+                        {'id': pk, 'message': el.message}
+                        for el, pk in zip(messages, message_pks) if pk is not None and el.message
+                    ]
+                    if fts_rows:
+                        await session.execute(
+                            text("INSERT INTO messages_fts(rowid, message) VALUES (:id, :message)"),
+                            fts_rows
+                        )
+
                 await session.commit()
             except IntegrityError as e:
                 await session.rollback()
                 raise e
 
+            return message_pks
+
     async def remove_message(self, message_id: str, chat_id: str):
         logger.debug(f"{LoggerTags.DATABASE.value} Remove message {message_id} from chat {chat_id}")
 
         async with self.asession() as session:
+            if self.dialect == 'sqlite':
+                await session.execute(
+                    text(
+                        "INSERT INTO messages_fts(messages_fts, rowid, message) "
+                        "SELECT 'delete', id, message FROM messages "
+                        "WHERE message_id = :message_id AND chat_id = :chat_id AND message != ''"
+                    ),
+                    {'message_id': message_id, 'chat_id': chat_id}
+                )
             await session.execute(
                 delete(MessagesModel).where(
                     MessagesModel.message_id == message_id,
@@ -476,10 +985,12 @@ class MessagesDataManager(MessagesInterface):
             await session.commit()
 
 
+@instrumented
 class FilesDataManager(FilesInterface):
     def __init__(self):
         super().__init__()
         self.asession = async_session
+        self.dialect = engine.dialect.name
 
     async def all_files(self) -> List[FilesModel]:
         logger.debug(f"{LoggerTags.DATABASE.value} All files")
@@ -488,35 +999,108 @@ class FilesDataManager(FilesInterface):
             return res.scalars().all()
 
     async def add_file(self, file: FileDB):
-        logger.debug(f"{LoggerTags.DATABASE.value} Adding file")
+        sampled_logger.debug(f"{LoggerTags.DATABASE.value} Adding file")
 
         async with self.asession() as session:
-            exists = await self.get_file(file.document_id)
-
-            if exists is None:
-                session.add(
-                    FilesModel(
-                        document_id=file.document_id,
+            try:
+                result = await session.execute(
+                    _insert_ignore(self.dialect, FilesModel, 'document_id').values(
+                        document_id=str(file.document_id),
                         file_name=file.file_name,
                         file_type=file.file_type,
                         file_path=file.file_path,
-                        message_id=file.message_id,
+                        message_id=str(file.message_id),
                         chat_id=file.chat_id,
-                        original_filename=file.original_filename
+                        original_filename=file.original_filename,
+                        is_downloaded=file.is_downloaded
                     )
                 )
-                try:
-                    await session.commit()
-                    logger.debug(f"{LoggerTags.DATABASE.value} File added successfully")
-                except IntegrityError as e:
-                    await session.rollback()
-                    logger.error(f"{LoggerTags.DATABASE.value} Error adding file: {e}")
-                    raise e
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                logger.error(f"{LoggerTags.DATABASE.value} Error adding file: {e}")
+                raise e
+
+            if result.rowcount:
+                logger.debug(f"{LoggerTags.DATABASE.value} File added successfully")
             else:
                 logger.debug(f"{LoggerTags.DATABASE.value} File already exists: {file.document_id}")
 
+    async def file_locations(self) -> List[FileLocationDB]:
+        """
+        Пути всех файлов, только нужные колонки
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} File locations")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(FilesModel.id, FilesModel.file_type, FilesModel.file_name, FilesModel.file_path)
+            )
+
+            return [
+                FileLocationDB(id=row.id, file_type=row.file_type, file_name=row.file_name, file_path=row.file_path)
+                for row in res.all()
+            ]
+
+    async def update_file_paths(self, paths: Dict[int, str]):
+        """
+        Обновить пути файлов одной транзакцией, пачками по IMPORT_QUERY_CHUNK_SIZE строк
+        :param paths: id записи файла -> новый путь
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Update {len(paths)} file paths")
+
+        rows = [{'id': file_id, 'file_path': file_path} for file_id, file_path in paths.items()]
+
+        async with self.asession() as session:
+            for i in range(0, len(rows), IMPORT_QUERY_CHUNK_SIZE):
+                await session.execute(update(FilesModel), rows[i:i + IMPORT_QUERY_CHUNK_SIZE])
+
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+
+    async def pending_files(self, limit: int) -> List[FileDB]:
+        """
+        Файлы, которые не удалось скачать, в порядке сохранения
+        :param limit: сколько файлов вернуть
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Pending files")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(FilesModel).where(FilesModel.is_downloaded.is_(False)).order_by(FilesModel.id).limit(limit)
+            )
+
+            return [
+                FileDB(
+                    chat_id=row.chat_id,
+                    message_id=row.message_id,
+                    document_id=row.document_id,
+                    file_name=row.file_name,
+                    file_path=row.file_path,
+                    file_type=row.file_type,
+                    original_filename=row.original_filename,
+                    is_downloaded=row.is_downloaded
+                )
+                for row in res.scalars().all()
+            ]
+
+    async def set_downloaded(self, document_id: str):
+        """
+        Отметить файл скачанным
+        """
+        sampled_logger.debug(f"{LoggerTags.DATABASE.value} File downloaded {document_id=}")
+
+        async with self.asession() as session:
+            await session.execute(
+                update(FilesModel).where(FilesModel.document_id == str(document_id)).values(is_downloaded=True)
+            )
+            await session.commit()
+
     async def get_file(self, document_id: str) -> Optional[FilesModel]:
-        logger.debug(f"{LoggerTags.DATABASE.value} Get file {document_id=}")
+        sampled_logger.debug(f"{LoggerTags.DATABASE.value} Get file {document_id=}")
 
         async with self.asession() as session:
             res = await session.execute(
@@ -571,11 +1155,412 @@ class FilesDataManager(FilesInterface):
             await session.commit()
 
 
-class DBManager:
+@instrumented
+class BackfillDataManager(BackfillInterface):
+    def __init__(self):
+        super().__init__()
+        self.asession = async_session
+
+    async def get_checkpoint(self, chat_id: str) -> Optional[BackfillCheckpointDB]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Get backfill checkpoint {chat_id=}")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(BackfillCheckpointModel).where(BackfillCheckpointModel.chat_id == chat_id)
+            )
+            res = res.scalars().first()
+
+            if res is None:
+                return None
+
+            return BackfillCheckpointDB(
+                chat_id=res.chat_id,
+                last_message_id=res.last_message_id,
+                is_finished=res.is_finished
+            )
+
+    async def save_checkpoint(self, checkpoint: BackfillCheckpointDB):
+        logger.debug(f"{LoggerTags.DATABASE.value} Save backfill checkpoint {checkpoint}")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(BackfillCheckpointModel).where(BackfillCheckpointModel.chat_id == checkpoint.chat_id)
+            )
+            checkpoint_db = res.scalars().first()
+
+            if checkpoint_db is None:
+                checkpoint_db = BackfillCheckpointModel(chat_id=checkpoint.chat_id)
+                session.add(checkpoint_db)
+
+            checkpoint_db.last_message_id = checkpoint.last_message_id
+            checkpoint_db.is_finished = checkpoint.is_finished
+            checkpoint_db.updated_at = datetime.datetime.now(TIMEZONE)
+
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+
+    async def unfinished_checkpoints(self) -> List[BackfillCheckpointDB]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Unfinished backfill checkpoints")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(BackfillCheckpointModel).where(BackfillCheckpointModel.is_finished.is_(False))
+            )
+
+            return [
+                BackfillCheckpointDB(
+                    chat_id=el.chat_id,
+                    last_message_id=el.last_message_id,
+                    is_finished=el.is_finished
+                )
+                for el in res.scalars().all()
+            ]
+
+
+@instrumented
+class DialogsDataManager(DialogsInterface):
     def __init__(self):
-        # self.all_chats = AllChatsDataManager()
-        self.listening_chats = ListeningChatsDataManager()
-        self.messages = MessagesDataManager()
-        self.keywords = KeywordsDataManager()
-        self.themes = ThemesDataManager()
-        self.files = FilesDataManager()
+        super().__init__()
+        self.asession = async_session
+
+    @staticmethod
+    def _to_db(model: DialogModel) -> DialogDB:
+        return DialogDB(
+            chat_id=model.chat_id,
+            title=model.title,
+            is_channel=model.is_channel,
+            username=model.username
+        )
+
+    async def upsert_dialogs(self, dialogs: List[DialogDB]):
+        logger.debug(f"{LoggerTags.DATABASE.value} Upsert {len(dialogs)} dialogs")
+
+        if not dialogs:
+            return
+
+        updated_at = datetime.datetime.now(TIMEZONE)
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(DialogModel).where(DialogModel.chat_id.in_([el.chat_id for el in dialogs]))
+            )
+            existing = {el.chat_id: el for el in res.scalars().all()}
+
+            for dialog in dialogs:
+                model = existing.get(dialog.chat_id)
+
+                if model is None:
+                    model = DialogModel(chat_id=dialog.chat_id)
+                    session.add(model)
+                    existing[dialog.chat_id] = model
+
+                model.title = dialog.title
+                model.search_title = dialog.title.lower()
+                model.username = dialog.username.lower() if dialog.username else None
+                model.is_channel = dialog.is_channel
+                model.updated_at = updated_at
+
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+
+    async def remove_dialog(self, chat_id: str):
+        logger.debug(f"{LoggerTags.DATABASE.value} Remove dialog {chat_id=}")
+
+        async with self.asession() as session:
+            await session.execute(delete(DialogModel).where(DialogModel.chat_id == chat_id))
+            await session.commit()
+
+    async def get_dialog(self, chat: str) -> Optional[DialogDB]:
+        """
+        Найти диалог по id или по ссылке/юзернейму
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Get dialog {chat=}")
+
+        username = chat.rstrip('/').split('/')[-1].lstrip('@').lower()
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(DialogModel).where(
+                    (DialogModel.chat_id == chat.removeprefix('-100')) | (DialogModel.username == username)
+                )
+            )
+            res = res.scalars().first()
+
+            return self._to_db(res) if res is not None else None
+
+    async def get_dialogs_by_ids(self, chat_ids: List[str]) -> List[DialogDB]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Get dialogs by ids")
+
+        async with self.asession() as session:
+            res = await session.execute(select(DialogModel).where(DialogModel.chat_id.in_(chat_ids)))
+
+            return [self._to_db(el) for el in res.scalars().all()]
+
+    @staticmethod
+    def _filters(channels_only: bool, title_search: Optional[str]) -> list:
+        filters = []
+
+        if channels_only:
+            filters.append(DialogModel.is_channel.is_(True))
+
+        if title_search:
+            filters.append(DialogModel.search_title.contains(title_search.lower(), autoescape=True))
+
+        return filters
+
+    async def list_dialogs(
+            self,
+            channels_only: bool = False,
+            title_search: Optional[str] = None,
+            limit: int = 100,
+            offset: int = 0
+    ) -> List[DialogDB]:
+        """
+        Страница диалогов из кэша, отсортированная по названию
+        :param channels_only: только каналы и супергруппы
+        :param title_search: подстрока названия (без учета регистра)
+        :param limit: размер страницы
+        :param offset: сколько диалогов пропустить
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} List dialogs {channels_only=} {title_search=} {limit=} {offset=}")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(DialogModel)
+                .where(*self._filters(channels_only, title_search))
+                .order_by(DialogModel.search_title, DialogModel.id)
+                .limit(limit)
+                .offset(offset)
+            )
+
+            return [self._to_db(el) for el in res.scalars().all()]
+
+    async def count_dialogs(self, channels_only: bool = False, title_search: Optional[str] = None) -> int:
+        logger.debug(f"{LoggerTags.DATABASE.value} Count dialogs {channels_only=} {title_search=}")
+
+        async with self.asession() as session:
+            res = await session.execute(
+                select(func.count(DialogModel.id)).where(*self._filters(channels_only, title_search))
+            )
+
+            return res.scalar_one()
+
+
+@instrumented
+class MediaRulesDataManager(MediaRulesInterface):
+    def __init__(self):
+        super().__init__()
+        self.asession = async_session
+
+    @staticmethod
+    def _split(value: str) -> tuple:
+        return tuple(el for el in value.split(',') if el)
+
+    async def all_rules(self) -> List[MediaRuleDB]:
+        logger.debug(f"{LoggerTags.DATABASE.value} All media rules")
+
+        async with self.asession() as session:
+            res = await session.execute(select(MediaRuleModel))
+
+            return [
+                MediaRuleDB(
+                    chat_id=el.chat_id,
+                    mode=el.mode,
+                    types=self._split(el.types),
+                    mime_types=self._split(el.mime_types),
+                    max_size=el.max_size
+                )
+                for el in res.scalars().all()
+            ]
+
+    async def set_rule(self, rule: MediaRuleDB):
+        logger.debug(f"{LoggerTags.DATABASE.value} Set media rule {rule}")
+
+        async with self.asession() as session:
+            res = await session.execute(select(MediaRuleModel).where(MediaRuleModel.chat_id == rule.chat_id))
+            model = res.scalars().first()
+
+            if model is None:
+                model = MediaRuleModel(chat_id=rule.chat_id)
+                session.add(model)
+
+            model.mode = rule.mode
+            model.types = ','.join(rule.types)
+            model.mime_types = ','.join(rule.mime_types)
+            model.max_size = rule.max_size
+
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                raise e
+
+    async def remove_rule(self, chat_id: str) -> bool:
+        logger.debug(f"{LoggerTags.DATABASE.value} Remove media rule {chat_id=}")
+
+        async with self.asession() as session:
+            res = await session.execute(delete(MediaRuleModel).where(MediaRuleModel.chat_id == chat_id))
+            await session.commit()
+
+            return res.rowcount > 0
+
+
+@instrumented
+class StatsDataManager(StatsInterface):
+    # таблицы, количество строк которых показывает /stats
+    COUNTED_MODELS = {
+        'messages': MessagesModel,
+        'files': FilesModel,
+        'keywords': KeywordsModel,
+        'themes': ThemeModel,
+        'listening_chats': ListeningChatModel,
+        'dialogs': DialogModel,
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.asession = async_session
+        self.dialect = engine.dialect.name
+
+    async def database_stats(self) -> DatabaseStatsDB:
+        """
+        Размер бд и количество строк в таблицах одним запросом на каждое
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Database stats")
+
+        if self.dialect == 'sqlite':
+            size_query = text("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()")
+        else:
+            size_query = text("SELECT pg_database_size(current_database())")
+
+        counts_query = select(*[
+            select(func.count()).select_from(model).scalar_subquery().label(name)
+            for name, model in self.COUNTED_MODELS.items()
+        ])
+
+        async with self.asession() as session:
+            size = (await session.execute(size_query)).scalar_one()
+            counts = (await session.execute(counts_query)).one()
+
+        return DatabaseStatsDB(size=int(size or 0), rows=dict(counts._mapping))
+
+    def _insert(self):
+        # INSERT ... ON CONFLICT есть в обоих диалектах с одинаковым API
+        return (postgresql if self.dialect == 'postgresql' else sqlite).insert(MatchStatsModel)
+
+    async def track_names(self, kind: str, names: List[str], since: datetime.datetime):
+        """
+        Начать учет совпадений новых слов или тем, у уже учитываемых ничего не меняется
+        :param kind: MATCH_STATS_KEYWORD или MATCH_STATS_THEME
+        :param names: словоформы или названия тем
+        :param since: с какого момента идет учет
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Track {len(names)} names of {kind=}")
+
+        query = self._insert().on_conflict_do_nothing(index_elements=['kind', 'name'])
+
+        async with self.asession() as session:
+            for i in range(0, len(names), IMPORT_QUERY_CHUNK_SIZE):
+                await session.execute(query, [
+                    {'kind': kind, 'name': name, 'hits': 0, 'first_seen': since}
+                    for name in names[i:i + IMPORT_QUERY_CHUNK_SIZE]
+                ])
+
+            await session.commit()
+
+    async def add_match_hits(self, hits: List[MatchHitsDB]):
+        """
+        Прибавить накопленные совпадения пачками upsert
+        """
+        logger.debug(f"{LoggerTags.DATABASE.value} Add hits for {len(hits)} names")
+
+        query = self._insert()
+        query = query.on_conflict_do_update(
+            index_elements=['kind', 'name'],
+            set_={'hits': MatchStatsModel.hits + query.excluded.hits, 'last_hit': query.excluded.last_hit}
+        )
+
+        async with self.asession() as session:
+            for i in range(0, len(hits), IMPORT_QUERY_CHUNK_SIZE):
+                await session.execute(query, [
+                    {'kind': el.kind, 'name': el.name, 'hits': el.hits, 'first_seen': el.last_hit,
+                     'last_hit': el.last_hit}
+                    for el in hits[i:i + IMPORT_QUERY_CHUNK_SIZE]
+                ])
+
+            await session.commit()
+
+    async def _unused(self, kind: str, name_column, since: datetime.datetime) -> List[str]:
+        """
+        Имена без совпадений после since среди тех, что учитываются не позже since
+        (по слову, добавленному вчера, еще нельзя сказать, что оно не совпадает месяц)
+        """
+        async with self.asession() as session:
+            res = await session.execute(
+                select(name_column)
+                .join(MatchStatsModel, (MatchStatsModel.kind == kind) & (MatchStatsModel.name == name_column))
+                .where(
+                    MatchStatsModel.first_seen <= since,
+                    or_(MatchStatsModel.last_hit.is_(None), MatchStatsModel.last_hit < since)
+                )
+                .order_by(name_column)
+            )
+
+            return list(res.scalars().all())
+
+    async def unused_keywords(self, since: datetime.datetime) -> List[str]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Unused keywords {since=}")
+        return await self._unused(MATCH_STATS_KEYWORD, KeywordsModel.word, since)
+
+    async def unused_themes(self, since: datetime.datetime) -> List[str]:
+        logger.debug(f"{LoggerTags.DATABASE.value} Unused themes {since=}")
+        return await self._unused(MATCH_STATS_THEME, ThemeModel.theme_name, since)
+
+
+class DBManager:
+    """
+    Набор DataManager одного компонента. Менеджеры создаются при первом обращении,
+    поэтому компонент не открывает сессии для таблиц, с которыми не работает
+    """
+
+    @cached_property
+    def listening_chats(self) -> ListeningChatsDataManager:
+        return ListeningChatsDataManager()
+
+    @cached_property
+    def messages(self) -> MessagesDataManager:
+        return MessagesDataManager()
+
+    @cached_property
+    def keywords(self) -> KeywordsDataManager:
+        return KeywordsDataManager()
+
+    @cached_property
+    def themes(self) -> ThemesDataManager:
+        return ThemesDataManager()
+
+    @cached_property
+    def files(self) -> FilesDataManager:
+        return FilesDataManager()
+
+    @cached_property
+    def backfill(self) -> BackfillDataManager:
+        return BackfillDataManager()
+
+    @cached_property
+    def dialogs(self) -> DialogsDataManager:
+        return DialogsDataManager()
+
+    @cached_property
+    def media_rules(self) -> MediaRulesDataManager:
+        return MediaRulesDataManager()
+
+    @cached_property
+    def stats(self) -> StatsDataManager:
+        return StatsDataManager()
@@ -0,0 +1,27 @@
+import inspect
+from functools import wraps
+
+from metrics import DB_QUERY_SECONDS
+from tracing import tracer
+
+
+def instrumented(cls):
+    """
+    Декоратор класса DataManager: замеряет время и пишет спан для каждого публичного асинхронного метода
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(method):
+            continue
+
+        setattr(cls, name, _timed(cls.__name__, name, method))
+
+    return cls
+
+
+def _timed(manager: str, method_name: str, method):
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        with DB_QUERY_SECONDS.time(manager=manager, method=method_name), tracer.span(f"db.{manager}.{method_name}"):
+            return await method(*args, **kwargs)
+
+    return wrapper
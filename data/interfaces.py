@@ -1,8 +1,10 @@
+import datetime
 from abc import ABCMeta
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from . import KeywordsModel, ThemeModel, MessagesModel
-from .dataclasses import ListeningChatsDB, KeywordsDB, MessageDB, ThemeDB, AddThemeDB, FileDB
+from .dataclasses import ListeningChatsDB, KeywordsDB, MessageDB, ThemeDB, AddThemeDB, FileDB, BackfillCheckpointDB, \
+    DialogDB, ImportThemeDB, MediaRuleDB, FileLocationDB, DatabaseStatsDB, MatchHitsDB
 from .models import FilesModel
 
 
@@ -33,6 +35,9 @@ class KeywordInterface(metaclass=ABCMeta):
     async def get_keyword(self, keyword_name: str) -> Optional[KeywordsDB]:
         pass
 
+    async def get_keywords_by_words(self, keyword_names: List[str]) -> List[KeywordsDB]:
+        pass
+
     async def remove_keyword(self, keyword_name: str):
         pass
 
@@ -47,9 +52,15 @@ class ThemeInterface(metaclass=ABCMeta):
     async def all_themes(self) -> List[ThemeDB]:
         pass
 
+    async def followed_keywords(self) -> List[str]:
+        pass
+
     async def get_theme(self, theme_name: str) -> Optional[ThemeModel]:
         pass
 
+    async def get_themes_by_names(self, theme_names: List[str]) -> Dict[str, ThemeModel]:
+        pass
+
     async def get_keyword_list_for_theme(self, theme_name: str) -> List[KeywordsDB]:
         pass
 
@@ -77,6 +88,18 @@ class ThemeInterface(metaclass=ABCMeta):
     async def unfollow_themes(self, theme_names: List[str]):
         pass
 
+    async def set_following(self, theme_names: List[str], is_following: bool):
+        pass
+
+    async def import_themes(self, keyword_names: List[str], themes: List[ImportThemeDB]) -> List[str]:
+        pass
+
+    async def change_delivery_mode(self, theme_name: str, delivery_mode: str) -> bool:
+        pass
+
+    async def change_priority(self, theme_name: str, priority: str) -> bool:
+        pass
+
     async def remove_theme(self, theme_name: str):
         pass
 
@@ -91,7 +114,13 @@ class MessagesInterface(metaclass=ABCMeta):
     async def get_message(self, message_id: str, chat_id: str) -> Optional[MessagesModel]:
         pass
 
-    async def add_message(self, message: MessageDB):
+    async def add_message(self, message: MessageDB) -> Optional[int]:
+        pass
+
+    async def add_messages(self, messages: List[MessageDB], files: List[FileDB]) -> List[Optional[int]]:
+        pass
+
+    async def get_last_message_ids(self) -> Dict[str, int]:
         pass
 
     async def remove_message(self, message_id: str, chat_id: str):
@@ -114,6 +143,18 @@ class FilesInterface(metaclass=ABCMeta):
     async def add_file(self, file: FileDB):
         pass
 
+    async def file_locations(self) -> List[FileLocationDB]:
+        pass
+
+    async def update_file_paths(self, paths: Dict[int, str]):
+        pass
+
+    async def pending_files(self, limit: int) -> List[FileDB]:
+        pass
+
+    async def set_downloaded(self, document_id: str):
+        pass
+
     async def remove_file(
             self,
             document_id: Optional[str] = None,
@@ -121,3 +162,68 @@ class FilesInterface(metaclass=ABCMeta):
             chat_id: Optional[str] = None
     ):
         pass
+
+
+class BackfillInterface(metaclass=ABCMeta):
+    async def get_checkpoint(self, chat_id: str) -> Optional[BackfillCheckpointDB]:
+        pass
+
+    async def save_checkpoint(self, checkpoint: BackfillCheckpointDB):
+        pass
+
+    async def unfinished_checkpoints(self) -> List[BackfillCheckpointDB]:
+        pass
+
+
+class DialogsInterface(metaclass=ABCMeta):
+    async def upsert_dialogs(self, dialogs: List[DialogDB]):
+        pass
+
+    async def remove_dialog(self, chat_id: str):
+        pass
+
+    async def get_dialog(self, chat: str) -> Optional[DialogDB]:
+        pass
+
+    async def get_dialogs_by_ids(self, chat_ids: List[str]) -> List[DialogDB]:
+        pass
+
+    async def list_dialogs(
+            self,
+            channels_only: bool = False,
+            title_search: Optional[str] = None,
+            limit: int = 100,
+            offset: int = 0
+    ) -> List[DialogDB]:
+        pass
+
+    async def count_dialogs(self, channels_only: bool = False, title_search: Optional[str] = None) -> int:
+        pass
+
+
+class MediaRulesInterface(metaclass=ABCMeta):
+    async def all_rules(self) -> List[MediaRuleDB]:
+        pass
+
+    async def set_rule(self, rule: MediaRuleDB):
+        pass
+
+    async def remove_rule(self, chat_id: str) -> bool:
+        pass
+
+
+class StatsInterface(metaclass=ABCMeta):
+    async def database_stats(self) -> DatabaseStatsDB:
+        pass
+
+    async def track_names(self, kind: str, names: List[str], since: datetime.datetime):
+        pass
+
+    async def add_match_hits(self, hits: List[MatchHitsDB]):
+        pass
+
+    async def unused_keywords(self, since: datetime.datetime) -> List[str]:
+        pass
+
+    async def unused_themes(self, since: datetime.datetime) -> List[str]:
+        pass
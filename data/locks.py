@@ -0,0 +1,58 @@
+import asyncio
+import inspect
+from functools import wraps
+from typing import Optional
+
+
+class SessionLock:
+    """
+    Реентерабельная блокировка для DataManager с общей сессией:
+    методы менеджера могут вызывать друг друга внутри одной задачи,
+    а разные задачи работают с сессией по очереди
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner: Optional[asyncio.Task] = None
+        self._depth = 0
+
+    async def __aenter__(self):
+        task = asyncio.current_task()
+
+        if self._owner is not task:
+            await self._lock.acquire()
+            self._owner = task
+
+        self._depth += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._depth -= 1
+
+        if not self._depth:
+            self._owner = None
+            self._lock.release()
+
+
+def serialized(cls):
+    """
+    Декоратор класса DataManager, который держит одну AsyncSession на все вызовы:
+    публичные асинхронные методы выполняются по очереди, так как сессия не рассчитана на конкурентный доступ
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(method):
+            continue
+
+        setattr(cls, name, _locked(method))
+
+    return cls
+
+
+def _locked(method):
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        lock = self.__dict__.setdefault('_session_lock', SessionLock())
+
+        async with lock:
+            return await method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,168 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import LoggerTags, THEME_DELIVERY_MESSAGES, OUTBOUND_LANE_NORMAL
+
+
+@dataclass(frozen=True)
+class ColumnMigration:
+    """
+    Колонка, которая появилась в модели после создания таблицы (create_all не меняет существующие таблицы)
+    """
+    table: str
+    column: str
+    # тип и значение по умолчанию для ALTER TABLE ... ADD COLUMN
+    definition: str
+    # индекс по колонке с именем, как его создает create_all
+    index: bool = False
+    # запросы, которые заполняют колонку у строк, сохраненных до ее появления
+    backfill: Tuple[str, ...] = ()
+
+
+# миграции выполняются по порядку, каждая - только если колонки еще нет
+COLUMN_MIGRATIONS: List[ColumnMigration] = [
+    # отпечатки сообщений для поиска дубликатов
+    ColumnMigration('messages', 'fingerprint', 'VARCHAR', index=True),
+    ColumnMigration('messages', 'duplicate_of', 'INTEGER REFERENCES messages (id)', index=True),
+    # время сохранения, по нему рассылка выбирает сообщения за интервал (история загружается с прошлыми датами).
+    # У старых сообщений время сохранения неизвестно, берется дата сообщения
+    ColumnMigration(
+        'messages', 'received_at', 'TIMESTAMP', index=True,
+        backfill=("UPDATE messages SET received_at = date WHERE received_at IS NULL",)
+    ),
+    # режим доставки темы, существующие темы рассылаются по одному сообщению, как раньше
+    ColumnMigration('themes', 'delivery_mode', f"VARCHAR NOT NULL DEFAULT '{THEME_DELIVERY_MESSAGES}'"),
+    # полоса отправки темы
+    ColumnMigration('themes', 'priority', f"VARCHAR NOT NULL DEFAULT '{OUTBOUND_LANE_NORMAL}'"),
+    # файлы, сохраненные до появления колонки, уже скачаны
+    ColumnMigration('files', 'is_downloaded', 'BOOLEAN NOT NULL DEFAULT TRUE', index=True),
+]
+
+
+@dataclass(frozen=True)
+class IndexMigration:
+    """
+    Индекс или ограничение уникальности, которое появилось в модели после создания таблицы
+    """
+    table: str
+    # имя как у ограничения в модели, по нему проверяется, что индекс уже есть
+    name: str
+    columns: Tuple[str, ...]
+    unique: bool = False
+    # запросы, которые приводят старые данные в соответствие индексу (например, удаляют повторы)
+    prepare: Tuple[str, ...] = ()
+    # prepare удаляет сообщения, после него полнотекстовый индекс SQLite перестраивается
+    rebuild_search: bool = False
+
+
+# до ограничения сообщение могло сохраниться дважды, если его одновременно получали обработчик и догрузка.
+# Ссылки duplicate_of переводятся на первую копию сообщения, остальные копии удаляются
+INDEX_MIGRATIONS: List[IndexMigration] = [
+    IndexMigration(
+        'messages', 'uq_messages_chat_id_message_id', ('chat_id', 'message_id'), unique=True,
+        prepare=(
+            "UPDATE messages SET duplicate_of = ("
+            "SELECT MIN(k.id) FROM messages d JOIN messages k "
+            "ON k.chat_id = d.chat_id AND k.message_id = d.message_id "
+            "WHERE d.id = messages.duplicate_of"
+            ") WHERE duplicate_of IS NOT NULL",
+            "DELETE FROM messages WHERE id > ("
+            "SELECT MIN(k.id) FROM messages k "
+            "WHERE k.chat_id = messages.chat_id AND k.message_id = messages.message_id"
+            ")",
+        ),
+        rebuild_search=True
+    ),
+]
+
+
+def _columns(sync_conn, tables: Set[str]) -> Dict[str, Set[str]]:
+    """
+    Колонки существующих таблиц
+    """
+    inspector = inspect(sync_conn)
+
+    return {
+        table: {el['name'] for el in inspector.get_columns(table)}
+        for table in tables if inspector.has_table(table)
+    }
+
+
+def _indexes(sync_conn, tables: Set[str]) -> Dict[str, Set[str]]:
+    """
+    Имена индексов и ограничений уникальности существующих таблиц
+    """
+    inspector = inspect(sync_conn)
+
+    return {
+        table: {el['name'] for el in inspector.get_indexes(table) + inspector.get_unique_constraints(table)}
+        for table in tables if inspector.has_table(table)
+    }
+
+
+def _has_table(sync_conn, table: str) -> bool:
+    return inspect(sync_conn).has_table(table)
+
+
+async def migrate_schema(engine: AsyncEngine,
+                         columns: Optional[List[ColumnMigration]] = None,
+                         indexes: Optional[List[IndexMigration]] = None):
+    """
+    Добавить в существующие таблицы колонки и индексы, которых в них еще нет.
+    Вызывается после create_all: новые таблицы уже созданы по моделям, и для них ничего не выполняется
+    """
+    columns = COLUMN_MIGRATIONS if columns is None else columns
+    indexes = INDEX_MIGRATIONS if indexes is None else indexes
+
+    async with engine.begin() as conn:
+        existing = await conn.run_sync(_columns, {el.table for el in columns})
+
+        for migration in columns:
+            if migration.table not in existing or migration.column in existing[migration.table]:
+                continue
+
+            logger.info(f"{LoggerTags.DATABASE.value} Add column {migration.table}.{migration.column}")
+
+            await conn.execute(text(
+                f"ALTER TABLE {migration.table} ADD COLUMN {migration.column} {migration.definition}"
+            ))
+
+            if migration.index:
+                await conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{migration.table}_{migration.column} "
+                    f"ON {migration.table} ({migration.column})"
+                ))
+
+            for statement in migration.backfill:
+                await conn.execute(text(statement))
+
+            existing[migration.table].add(migration.column)
+
+        existing = await conn.run_sync(_indexes, {el.table for el in indexes})
+
+        for migration in indexes:
+            if migration.table not in existing or migration.name in existing[migration.table]:
+                continue
+
+            logger.info(f"{LoggerTags.DATABASE.value} Add index {migration.name}")
+
+            for statement in migration.prepare:
+                await conn.execute(text(statement))
+
+            await conn.execute(text(
+                f"CREATE {'UNIQUE ' if migration.unique else ''}INDEX IF NOT EXISTS {migration.name} "
+                f"ON {migration.table} ({', '.join(migration.columns)})"
+            ))
+
+            # внешний контент FTS5 не узнает об удаленных строках сам
+            if migration.rebuild_search and engine.dialect.name == 'sqlite' \
+                    and await conn.run_sync(_has_table, 'messages_fts'):
+                await conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+            existing[migration.table].add(migration.name)
+
+    logger.success("Database schema is up to date")
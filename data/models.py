@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, DateTime, UniqueConstraint
 from sqlalchemy.orm import relationship, DeclarativeBase
 
 
@@ -26,6 +26,8 @@ class ThemeModel(Base):
     theme_name = Column(String, unique=True, nullable=False, index=True)
     is_following = Column(Boolean, nullable=False, default=False)
     interval = Column(Integer, nullable=False)
+    delivery_mode = Column(String, nullable=False, default='messages', server_default='messages')
+    priority = Column(String, nullable=False, default='normal', server_default='normal')
     keywords = relationship("KeywordsModel", secondary=theme_keyword_association, back_populates="themes")
 
 
@@ -45,9 +47,15 @@ class MessagesModel(Base):
     grouped_id = Column(Integer, default=None,  nullable=True, index=True)
     date = Column(DateTime, nullable=False)
     links = Column(String, nullable=True, default=None)
+    fingerprint = Column(String, nullable=True, default=None, index=True)
+    duplicate_of = Column(Integer, ForeignKey('messages.id'), nullable=True, default=None, index=True)
+    received_at = Column(DateTime, nullable=True, default=None, index=True)
 
     files = relationship("FilesModel", back_populates="message")
 
+    # одно сообщение чата хранится один раз, повторная вставка пропускается через ON CONFLICT
+    __table_args__ = (UniqueConstraint('chat_id', 'message_id', name='uq_messages_chat_id_message_id'),)
+
 
 class FilesModel(Base):
     __tablename__ = 'files'
@@ -59,6 +67,54 @@ class FilesModel(Base):
     message_id = Column(String, ForeignKey('messages.id'), index=True, nullable=False)
     chat_id = Column(String, ForeignKey('listening_chats.id'), index=True, nullable=False)
     original_filename = Column(String, nullable=True, default=None)
+    # False - файл еще не скачан (ошибка при скачивании), его докачивает повторный проход
+    is_downloaded = Column(Boolean, nullable=False, default=True, index=True)
 
     # Связь с MessagesModel
     message = relationship("MessagesModel", back_populates="files")
+
+
+class BackfillCheckpointModel(Base):
+    __tablename__ = 'backfill_checkpoints'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String, unique=True, nullable=False, index=True)
+    last_message_id = Column(Integer, nullable=False, default=0)
+    is_finished = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, nullable=True, default=None)
+
+
+class DialogModel(Base):
+    __tablename__ = 'dialogs'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String, unique=True, nullable=False, index=True)
+    title = Column(String, nullable=False, default='')
+    # название в нижнем регистре для поиска без учета регистра (lower() в SQLite не работает с кириллицей)
+    search_title = Column(String, nullable=False, default='', index=True)
+    username = Column(String, nullable=True, default=None, index=True)
+    is_channel = Column(Boolean, nullable=False, default=False, index=True)
+    updated_at = Column(DateTime, nullable=True, default=None)
+
+
+class MediaRuleModel(Base):
+    __tablename__ = 'media_rules'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String, unique=True, nullable=False, index=True)
+    mode = Column(String, nullable=False)
+    # типы файлов и MIME типы (или их префиксы вида image/) через запятую, пустая строка - любые
+    types = Column(String, nullable=False, default='')
+    mime_types = Column(String, nullable=False, default='')
+    # максимальный размер файла в байтах, 0 - без ограничения
+    max_size = Column(Integer, nullable=False, default=0)
+
+
+class MatchStatsModel(Base):
+    __tablename__ = 'match_stats'
+    __table_args__ = (UniqueConstraint('kind', 'name'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # keyword - словоформа, theme - название темы
+    kind = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    # с какого момента совпадения слова или темы учитываются
+    first_seen = Column(DateTime, nullable=False)
+    last_hit = Column(DateTime, nullable=True, default=None, index=True)
@@ -1,2 +1,3 @@
 from .keywords_handlers import KeywordsHandler
 from .themes_handler import ThemesHandler
+from .transfer import KeywordsTransfer
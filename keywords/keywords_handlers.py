@@ -1,79 +1,192 @@
-from typing import Optional
+from functools import lru_cache
+import datetime
+from typing import List, Optional, Tuple
 
-import pymorphy2
 from loguru import logger
 
-from config import KEYWORDS_FILENAME, LoggerTags, IGNORE_SYMBOLS
+from config import KEYWORDS_FILENAME, LoggerTags, IGNORE_SYMBOLS, sampled_logger, TIMEZONE, MATCH_STATS_KEYWORD
 from data.dataclasses import KeywordsDB
 from data.db_manager import DBManager
+from messages.match_stats import get_match_stats
+from metrics import KEYWORD_HITS
 
 
-class KeywordsHandler:
-    def __init__(self):
-        self.pymorphy2_311_hotfix()
-        self.morph = pymorphy2.MorphAnalyzer()
-        self.db_manager = DBManager()
+def pymorphy2_311_hotfix():
+    from inspect import getfullargspec
+    from pymorphy2.units.base import BaseAnalyzerUnit
 
-    def pymorphy2_311_hotfix(self):
-        from inspect import getfullargspec
-        from pymorphy2.units.base import BaseAnalyzerUnit
+    def _get_param_names_311(klass):
+        if klass.__init__ is object.__init__:
+            return []
+        args = getfullargspec(klass.__init__).args
+        return sorted(args[1:])
 
-        def _get_param_names_311(klass):
-            if klass.__init__ is object.__init__:
-                return []
-            args = getfullargspec(klass.__init__).args
-            return sorted(args[1:])
+    setattr(BaseAnalyzerUnit, '_get_param_names', _get_param_names_311)
 
-        setattr(BaseAnalyzerUnit, '_get_param_names', _get_param_names_311)
 
-    async def add_keyword(self, keyword: str) -> list:
-        word_variants = self.morph.parse(keyword)
+@lru_cache(maxsize=None)
+def get_morph_analyzer():
+    """
+    Загрузить словари pymorphy2 один раз на процесс (загрузка занимает заметное время)
+    """
+    import pymorphy2
+
+    pymorphy2_311_hotfix()
+    logger.info(f"{LoggerTags.HANDLER.value} Loading morphology dictionaries")
+    return pymorphy2.MorphAnalyzer()
+
+
+def word_forms(keyword: str) -> set:
+    """
+    Все словоформы слова (ё заменяется на е)
+    """
+    keywords = set()
+
+    for word in get_morph_analyzer().parse(keyword):
+        for variant in [el.word for el in word.lexeme]:
+            keywords.add(variant.replace("ё", "е"))
+
+    return keywords
 
-        keywords = set()
 
-        for word in word_variants:
-            lex = [el.word for el in word.lexeme]
+def expand_words(words: List[str]) -> List[str]:
+    """
+    Словоформы для списка слов, вызывается в отдельном процессе при импорте
+    """
+    forms = set()
 
-            for variant in lex:
-                keywords.add(variant.replace("ё", "е"))
+    for word in words:
+        forms |= word_forms(word)
+
+    return list(forms)
+
+
+class KeywordsHandler:
+    def __init__(self):
+        self.db_manager = DBManager()
+        # набор ключевых слов для проверки сообщений, сбрасывается после изменения слов в бд
+        self._keywords: Optional[set] = None
+        # ключевые слова отслеживаемых тем, по ним решается, скачивать ли файлы сообщения
+        self._theme_keywords: Optional[set] = None
+
+    def invalidate(self):
+        logger.debug(f"{LoggerTags.HANDLER.value} Keywords cache invalidated")
+        self._keywords = None
+        self._theme_keywords = None
+
+    @property
+    def morph(self):
+        return get_morph_analyzer()
+
+    async def add_keyword(self, keyword: str) -> list:
+        keywords = word_forms(keyword)
 
         await self.db_manager.keywords.add_keywords(list(keywords))
+        self.invalidate()
 
         logger.info(f"{LoggerTags.HANDLER.value} Added keywords from word '{keyword}'")
         return list(keywords)
 
     async def get_keywords(self) -> set:
-        logger.info(f"{LoggerTags.HANDLER.value} Getting keywords from database")
-        return set([el.word for el in await self.db_manager.keywords.all_keywords()])
+        if self._keywords is None:
+            sampled_logger.debug(f"{LoggerTags.HANDLER.value} Getting keywords from database")
+            self._keywords = set([el.word for el in await self.db_manager.keywords.all_keywords()])
+            get_match_stats().track(MATCH_STATS_KEYWORD, self._keywords)
+
+        return self._keywords
+
+    async def get_theme_keywords(self) -> set:
+        if self._theme_keywords is None:
+            sampled_logger.debug(f"{LoggerTags.HANDLER.value} Getting followed themes keywords from database")
+            self._theme_keywords = set(await self.db_manager.themes.followed_keywords())
+
+        return self._theme_keywords
 
     async def get_keyword(self, word: str) -> Optional[KeywordsDB]:
         logger.info(f"{LoggerTags.HANDLER.value} Getting keyword {word}")
         return await self.db_manager.keywords.get_keyword(word)
 
+    async def get_keywords_by_words(self, words: List[str]) -> tuple[List[KeywordsDB], List[str]]:
+        """
+        Найти ключевые слова одним запросом
+        :return: найденные слова и слова, которых нет в бд
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Getting keywords {words}")
+
+        found = await self.db_manager.keywords.get_keywords_by_words(words)
+        found_words = {el.word for el in found}
+
+        return found, [word for word in words if word not in found_words]
+
     async def remove_keyword(self, keyword: str):
-        if keyword in [el.word for el in await self.db_manager.keywords.all_keywords()]:
+        if await self.db_manager.keywords.get_keyword(keyword) is not None:
             await self.db_manager.keywords.remove_keyword(keyword)
+            self.invalidate()
             logger.info(f"{LoggerTags.HANDLER.value} Removed Keyword from words '{keyword}'")
             return
         raise KeyError(f"Данное ключевое слово - '{keyword}' отсутвует в базе данных")
 
-    async def check_contains(self, msg: str) -> bool:
-        logger.info(f"{LoggerTags.HANDLER.value} Checking if message contains '{msg}'")
+    @staticmethod
+    def matched_keywords(msg: str, keywords: set) -> set:
+        """
+        Слова из набора, которые есть в сообщении
+        :param msg: сообщение в нижнем регистре
+        :param keywords: набор ключевых слов
+        """
         message = msg
 
         for symbol in list(IGNORE_SYMBOLS):
             message = message.replace(symbol, '')
 
-        logger.debug(f"Refactored message: {message}")
+        sampled_logger.debug(f"{LoggerTags.HANDLER.value} Refactored message: {message}")
+
+        return keywords & set(message.split())
+
+    @classmethod
+    def contains_keywords(cls, msg: str, keywords: set) -> bool:
+        """
+        Проверить, есть ли в сообщении хотя бы одно слово из набора
+        :param msg: сообщение в нижнем регистре
+        :param keywords: набор ключевых слов
+        """
+        return bool(cls.matched_keywords(msg, keywords))
+
+    @staticmethod
+    def record_hits(matched: set):
+        """
+        Учесть совпавшие слова в счетчиках /stats и в статистике совпадений
+        """
+        KEYWORD_HITS.inc_many(matched)
+        get_match_stats().add(MATCH_STATS_KEYWORD, matched)
+
+    async def unused(self, days: int) -> Tuple[List[str], List[str]]:
+        """
+        Словоформы и темы без совпадений за days дней
+        :return: словоформы и названия тем
+        """
+        logger.info(f"{LoggerTags.HANDLER.value} Getting keywords and themes unused for {days} days")
+
+        # несохраненные совпадения записываются сразу, чтобы не попасть в список из-за задержки записи
+        await get_match_stats().flush()
+
+        since = datetime.datetime.now(TIMEZONE) - datetime.timedelta(days=days)
+
+        return (
+            await self.db_manager.stats.unused_keywords(since),
+            await self.db_manager.stats.unused_themes(since)
+        )
+
+    async def check_contains(self, msg: str) -> bool:
+        sampled_logger.debug(f"{LoggerTags.HANDLER.value} Checking if message contains '{msg}'")
 
-        sp = set(message.split())
-        kws = await self.get_keywords()
-        sp_bool = bool(await self.get_keywords() & set(message.split()))
+        matched = self.matched_keywords(msg, await self.get_keywords())
+        self.record_hits(matched)
 
-        return bool(await self.get_keywords() & set(message.split()))
+        return bool(matched)
 
     async def remove_keywords(self, keywords: list[str]):
         await self.db_manager.keywords.remove_keywords(keywords)
+        self.invalidate()
         logger.info(f"{LoggerTags.HANDLER.value} Removed keywords {keywords} from database")
 
     async def edit_keyword(self, from_kw: str, to_kw: str):
@@ -84,5 +197,6 @@ class KeywordsHandler:
             raise ValueError(f"Слово, которое вы хотите изменить не записано в базу данных")
 
         await self.db_manager.keywords.edit_keyword(from_kw, to_kw)
+        self.invalidate()
 
 
@@ -2,18 +2,26 @@ from typing import List, Optional
 
 from loguru import logger
 
-from config import async_session, LoggerTags
+from config import LoggerTags, THEME_DELIVERY_MODES, OUTBOUND_LANES
 from data import ThemeModel
-from data.dataclasses import AddThemeDB, KeywordsDB
+from data.dataclasses import AddThemeDB, KeywordsDB, ImportThemeDB
 from data.db_manager import DBManager
-from scheduler_manager import ThemeSchedulerManager
+from scheduler_manager import get_theme_scheduler
+from .keywords_handlers import KeywordsHandler
 
 
 class ThemesHandler:
-    def __init__(self):
-        self.session = async_session()
+    def __init__(self, keywords_handler: Optional[KeywordsHandler] = None):
         self.db_manager = DBManager()
-        self.scheduler = ThemeSchedulerManager()
+        self.scheduler = get_theme_scheduler()
+        self.kh = keywords_handler
+
+    def _changed(self):
+        """
+        Сбросить кэш ключевых слов отслеживаемых тем после изменения тем
+        """
+        if self.kh is not None:
+            self.kh.invalidate()
 
     async def all_themes(self):
         logger.info(f"{LoggerTags.HANDLER.value} Getting all themes")
@@ -28,108 +36,121 @@ class ThemesHandler:
                 keywords=keywords
             )
         )
+        self._changed()
 
     async def add_keyword_to_theme(self, theme_name: str, keywords: List[KeywordsDB]):
         logger.info(LoggerTags.HANDLER.value + f" Adding keyword to theme with {theme_name=}")
 
-        await self.db_manager.themes.add_keyword_to_theme_command(theme_name, keywords)
+        await self.db_manager.themes.add_keyword_to_theme(theme_name, keywords)
+        self._changed()
 
     async def remove_keywords_from_theme(self, theme_name: str, keywords: List[KeywordsDB]):
         logger.info(f"{LoggerTags.HANDLER.value} Removing keyword from theme with {theme_name=}")
 
         await self.db_manager.themes.remove_keywords_from_theme(theme_name, keywords)
+        self._changed()
 
     async def remove_themes(self, theme_names: List[str]) -> dict[str, List[str]]:
-        logger.info(f"{LoggerTags.HANDLER.value} Removing themes from")
-
-        old_themes = await self.db_manager.themes.all_themes()
-        old_themes_names = [el.theme_name for el in old_themes]
+        logger.info(f"{LoggerTags.HANDLER.value} Removing themes {theme_names}")
 
-        errors_names = []
-        valid_names = []
+        themes = await self.db_manager.themes.get_themes_by_names(theme_names)
 
-        for theme_name in theme_names:
-            if theme_name not in old_themes_names:
-                errors_names.append(theme_name)
-                continue
-            valid_names.append(theme_name)
+        valid_names = [name for name in theme_names if name in themes]
+        errors_names = [name for name in theme_names if name not in themes]
 
-        theme_models = [
-            await self.db_manager.themes.get_theme(name)
-            for name in valid_names]
+        await self.db_manager.themes.remove_themes(valid_names)
+        self._changed()
 
-        await self.db_manager.themes.remove_themes(theme_models)
+        if any(themes[name].is_following for name in valid_names):
+            await self.scheduler.sync_theme_jobs()
 
         return {
             'valid_names': valid_names,
             'errors_names': errors_names
         }
 
-    async def follow_themes(self, theme_names: List[str]) -> dict[str, List[str]]:
-        logger.info(f"{LoggerTags.HANDLER.value} Following themes {theme_names}")
-
-        old_themes = await self.db_manager.themes.all_themes()
-        old_themes_names = [theme.theme_name for theme in old_themes]
+    async def _set_following(self, theme_names: List[str], is_following: bool) -> dict[str, List[str]]:
+        """
+        Проверить и обновить статус отслеживания у всех тем за один запрос,
+        задачи планировщика пересобираются один раз после обновления
+        :return: темы с обновленным статусом, отсутствующие в бд и уже имевшие такой статус
+        """
+        themes = await self.db_manager.themes.get_themes_by_names(theme_names)
 
         errors_themes = []
         valid_themes = []
-        already_followed = []
+        unchanged = []
 
         for theme_name in theme_names:
-            if theme_name not in old_themes_names:
+            if theme_name not in themes:
                 errors_themes.append(theme_name)
-                continue
-
-            th = await self.db_manager.themes.get_theme(theme_name)
-            if th.is_following:
-                already_followed.append(theme_name)
-                continue
-
-            valid_themes.append(theme_name)
+            elif themes[theme_name].is_following == is_following:
+                unchanged.append(theme_name)
+            else:
+                valid_themes.append(theme_name)
 
-        await self.db_manager.themes.follow_themes(valid_themes)
+        await self.db_manager.themes.set_following(valid_themes, is_following)
+        self._changed()
 
-        for theme_name_ in valid_themes:
-            await self.scheduler.add_new_theme_job(theme_name_, [el.interval for el in old_themes if el.theme_name == theme_name_][0])
+        if valid_themes:
+            await self.scheduler.sync_theme_jobs()
 
         return {
             'valid_themes': valid_themes,
             'errors_themes': errors_themes,
-            'already_followed': already_followed
+            'unchanged': unchanged
+        }
+
+    async def follow_themes(self, theme_names: List[str]) -> dict[str, List[str]]:
+        logger.info(f"{LoggerTags.HANDLER.value} Following themes {theme_names}")
+
+        data = await self._set_following(theme_names, True)
+
+        return {
+            'valid_themes': data['valid_themes'],
+            'errors_themes': data['errors_themes'],
+            'already_followed': data['unchanged']
         }
 
     async def unfollow_themes(self, theme_names: List[str]) -> dict[str, List[str]]:
         logger.info(f"{LoggerTags.HANDLER.value} Unfollowing themes {theme_names}")
 
-        old_themes = await self.db_manager.themes.all_themes()
-        old_themes_names = [theme.theme_name for theme in old_themes]
+        data = await self._set_following(theme_names, False)
 
-        errors_themes = []
-        valid_themes = []
-        already_unfollowed = []
+        return {
+            'valid_themes': data['valid_themes'],
+            'errors_themes': data['errors_themes'],
+            'already_unfollowed': data['unchanged']
+        }
 
-        for theme_name in theme_names:
-            if theme_name not in old_themes_names:
-                errors_themes.append(theme_name)
-                continue
+    async def import_themes(self, keyword_names: List[str], themes: List[ImportThemeDB]) -> List[str]:
+        logger.info(f"{LoggerTags.HANDLER.value} Importing {len(keyword_names)} keywords and {len(themes)} themes")
 
-            th = await self.db_manager.themes.get_theme(theme_name)
-            if not th.is_following:
-                already_unfollowed.append(theme_name)
-                continue
+        missing_keywords = await self.db_manager.themes.import_themes(keyword_names, themes)
+        self._changed()
 
-            valid_themes.append(theme_name)
+        if themes:
+            await self.scheduler.sync_theme_jobs()
 
-        await self.db_manager.themes.unfollow_themes(valid_themes)
+        return missing_keywords
 
-        for theme_name_ in valid_themes:
-            await self.scheduler.remove_theme_job(theme_name_)
+    async def change_delivery_mode(self, theme_name: str, delivery_mode: str):
+        logger.info(f"{LoggerTags.HANDLER.value} Change delivery mode for {theme_name=} on {delivery_mode=}")
 
-        return {
-            'valid_themes': valid_themes,
-            'errors_themes': errors_themes,
-            'already_unfollowed': already_unfollowed
-        }
+        if delivery_mode not in THEME_DELIVERY_MODES:
+            raise ValueError(f"Режим доставки должен быть одним из: {', '.join(THEME_DELIVERY_MODES)}")
+
+        if not await self.db_manager.themes.change_delivery_mode(theme_name, delivery_mode):
+            raise ValueError(f"Такой темы нет")
+
+    async def change_priority(self, theme_name: str, priority: str):
+        logger.info(f"{LoggerTags.HANDLER.value} Change priority for {theme_name=} on {priority=}")
+
+        if priority not in OUTBOUND_LANES:
+            raise ValueError(f"Приоритет должен быть одним из: {', '.join(OUTBOUND_LANES)}")
+
+        if not await self.db_manager.themes.change_priority(theme_name, priority):
+            raise ValueError(f"Такой темы нет")
 
     async def change_interval_theme(self, theme_name: str, new_interval_seconds: int) -> Optional[ThemeModel]:
         logger.info(f"{LoggerTags.HANDLER.value} Change interval for {theme_name=} on {new_interval_seconds=}")
@@ -0,0 +1,242 @@
+import asyncio
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, List
+
+from loguru import logger
+
+from config import LoggerTags, IMPORT_MORPH_WORKERS, THEME_DELIVERY_MODES, OUTBOUND_LANES
+from data.dataclasses import ImportThemeDB
+from .keywords_handlers import KeywordsHandler, expand_words
+from .themes_handler import ThemesHandler
+
+EXPORT_FORMATS = ('json', 'csv')
+CSV_HEADER = ['type', 'value', 'interval', 'is_following', 'keywords', 'delivery_mode', 'priority']
+CSV_KEYWORDS_SEPARATOR = ';'
+
+# меньше этого количества слов словоформы строятся в одном потоке, без запуска процессов
+MORPH_CHUNK_SIZE = 200
+
+
+@dataclass
+class ImportData:
+    # слова, для которых строятся все словоформы
+    keywords: List[str] = field(default_factory=list)
+    # словоформы, которые записываются как есть (так выгружает экспорт)
+    forms: List[str] = field(default_factory=list)
+    themes: List[ImportThemeDB] = field(default_factory=list)
+
+
+def _word(value) -> str:
+    word = str(value).strip().lower()
+
+    if not word or word.isdigit():
+        raise ValueError(f"Некорректное ключевое слово '{value}'")
+
+    return word
+
+
+def _theme(name, interval, is_following, keywords: List[str], delivery_mode=None, priority=None) -> ImportThemeDB:
+    if not str(name).strip():
+        raise ValueError("У темы должно быть название")
+
+    if not str(interval).strip().isdigit():
+        raise ValueError(f"Интервал темы '{name}' должен быть целым числом")
+
+    if is_following in (None, ''):
+        is_following = None
+    elif isinstance(is_following, str):
+        is_following = is_following.strip().lower() in ('1', 'true', 'yes', 'да')
+
+    delivery_mode = str(delivery_mode).strip().lower() if delivery_mode else None
+
+    if delivery_mode is not None and delivery_mode not in THEME_DELIVERY_MODES:
+        raise ValueError(f"Неизвестный режим доставки темы '{name}': {delivery_mode}")
+
+    priority = str(priority).strip().lower() if priority else None
+
+    if priority is not None and priority not in OUTBOUND_LANES:
+        raise ValueError(f"Неизвестный приоритет темы '{name}': {priority}")
+
+    return ImportThemeDB(
+        theme_name=str(name).strip(),
+        interval=int(interval),
+        is_following=is_following,
+        keywords=[_word(el) for el in keywords if str(el).strip()],
+        delivery_mode=delivery_mode,
+        priority=priority
+    )
+
+
+def parse_json(content: bytes) -> ImportData:
+    try:
+        raw = json.loads(content.decode('utf-8-sig'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Файл не является корректным JSON: {e}")
+
+    if not isinstance(raw, dict):
+        raise ValueError("Ожидается объект с полями keywords, forms и themes")
+
+    return ImportData(
+        keywords=[_word(el) for el in raw.get('keywords', [])],
+        forms=[_word(el) for el in raw.get('forms', [])],
+        themes=[
+            _theme(
+                el.get('name'),
+                el.get('interval'),
+                el.get('is_following'),
+                el.get('keywords', []),
+                el.get('delivery_mode'),
+                el.get('priority')
+            )
+            for el in raw.get('themes', [])
+        ]
+    )
+
+
+def parse_csv(content: bytes) -> ImportData:
+    """
+    Строки вида type,value,interval,is_following,keywords,delivery_mode,priority, где type - keyword, form или theme,
+    слова темы разделяются символом ';'
+    """
+    data = ImportData()
+
+    try:
+        rows = csv.reader(io.StringIO(content.decode('utf-8-sig')))
+
+        for line, row in enumerate(rows, start=1):
+            if not row or not row[0].strip() or row[0].strip().lower() == CSV_HEADER[0]:
+                continue
+
+            row = row + [''] * (len(CSV_HEADER) - len(row))
+            kind, value, interval, is_following, keywords, delivery_mode, priority = [
+                el.strip() for el in row[:len(CSV_HEADER)]
+            ]
+
+            if kind == 'keyword':
+                data.keywords.append(_word(value))
+            elif kind == 'form':
+                data.forms.append(_word(value))
+            elif kind == 'theme':
+                data.themes.append(_theme(
+                    value, interval, is_following, keywords.split(CSV_KEYWORDS_SEPARATOR), delivery_mode, priority
+                ))
+            else:
+                raise ValueError(f"Строка {line}: неизвестный тип '{kind}'")
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f"Файл не является корректным CSV: {e}")
+
+    return data
+
+
+def parse_import_file(filename: str, content: bytes) -> ImportData:
+    if filename.lower().endswith('.json'):
+        return parse_json(content)
+    if filename.lower().endswith('.csv'):
+        return parse_csv(content)
+
+    raise ValueError("Поддерживаются только файлы .json и .csv")
+
+
+def _csv_line(row: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='').writerow(row)
+    return buffer.getvalue()
+
+
+async def expand_keywords(words: List[str]) -> List[str]:
+    """
+    Построить словоформы для всех слов.
+    Большие списки делятся на части и обрабатываются в пуле процессов
+    """
+    if not words:
+        return []
+
+    if IMPORT_MORPH_WORKERS <= 1 or len(words) <= MORPH_CHUNK_SIZE:
+        return await asyncio.to_thread(expand_words, words)
+
+    loop = asyncio.get_running_loop()
+    chunks = [words[i:i + MORPH_CHUNK_SIZE] for i in range(0, len(words), MORPH_CHUNK_SIZE)]
+
+    with ProcessPoolExecutor(max_workers=IMPORT_MORPH_WORKERS) as pool:
+        results = await asyncio.gather(*[loop.run_in_executor(pool, expand_words, chunk) for chunk in chunks])
+
+    return list(set().union(*results))
+
+
+class KeywordsTransfer:
+    """
+    Импорт и экспорт ключевых слов и тем файлом (JSON или CSV) для переноса между установками
+    """
+
+    def __init__(self, keywords_handler: KeywordsHandler, themes_handler: ThemesHandler):
+        self.kh = keywords_handler
+        self.themes = themes_handler
+
+    async def import_file(self, filename: str, content: bytes) -> dict:
+        """
+        Разобрать файл, построить словоформы и записать все в одной транзакции
+        :return: количество слов и тем, а также слова тем, которых нет в бд
+        """
+        data = await asyncio.to_thread(parse_import_file, filename, content)
+
+        logger.info(f"{LoggerTags.HANDLER.value} Import {len(data.keywords)} keywords, "
+                    f"{len(data.forms)} forms and {len(data.themes)} themes")
+
+        forms = set(data.forms) | set(await expand_keywords(list(dict.fromkeys(data.keywords))))
+
+        missing_keywords = await self.themes.import_themes(list(forms), data.themes)
+        self.kh.invalidate()
+
+        return {
+            'keywords_count': len(forms),
+            'themes_count': len(data.themes),
+            'missing_keywords': missing_keywords
+        }
+
+    async def export_items(self, fmt: str) -> Iterable[str]:
+        """
+        Все ключевые слова и темы в формате, который принимает import_file
+        :param fmt: json или csv
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Поддерживаются форматы: {', '.join(EXPORT_FORMATS)}")
+
+        words = sorted(await self.kh.get_keywords())
+        themes = await self.themes.all_themes()
+
+        if fmt == 'json':
+            return [json.dumps({
+                'forms': words,
+                'themes': [
+                    {
+                        'name': theme.theme_name,
+                        'interval': theme.interval,
+                        'is_following': theme.is_following,
+                        'keywords': [el.word for el in theme.keywords],
+                        'delivery_mode': theme.delivery_mode,
+                        'priority': theme.priority
+                    }
+                    for theme in themes
+                ]
+            }, ensure_ascii=False, indent=1)]
+
+        return [
+            _csv_line(CSV_HEADER),
+            *(_csv_line(['form', word, '', '', '', '', '']) for word in words),
+            *(
+                _csv_line([
+                    'theme',
+                    theme.theme_name,
+                    theme.interval,
+                    int(theme.is_following),
+                    CSV_KEYWORDS_SEPARATOR.join(el.word for el in theme.keywords),
+                    theme.delivery_mode,
+                    theme.priority
+                ])
+                for theme in themes
+            )
+        ]
@@ -1,25 +1,33 @@
 import asyncio
-import sqlite3
-from typing import Callable
+import datetime
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict
 
-import asyncpg
 from apscheduler.triggers.interval import IntervalTrigger
 from loguru import logger
 from sqlalchemy import MetaData
 from telethon import events
 from telethon.errors import FloodWaitError
 
-from chats import ChatsHandler
-from commands import CommandsHandler
+from chats import ChatsHandler, BackfillManager
+from commands import CommandsHandler, CommandDispatcher
 from config import *
 from data import Base
 from data.db_manager import DBManager
-from scheduler_manager import ThemeSchedulerManager
+from data.migrations import migrate_schema
+from keywords.keywords_handlers import get_morph_analyzer
+from messages.match_stats import get_match_stats
+from metrics import instrument_scheduler, start_metrics_server
+from scheduler_manager import get_theme_scheduler
+from storage import migrate_media_layout
+from tracing import tracer
 
 db_manager = DBManager()
 chats_handler = ChatsHandler(client)
-commands_handler = CommandsHandler(client, chats_handler)
-theme_scheduler = ThemeSchedulerManager()
+backfill_manager = BackfillManager(client, chats_handler)
+commands_handler = CommandsHandler(client, chats_handler, backfill_manager)
+theme_scheduler = get_theme_scheduler()
 
 commands: dict[str, Callable] = {
     '/start': commands_handler.start_command,
@@ -40,28 +48,45 @@ commands: dict[str, Callable] = {
     '/followThemes': commands_handler.follow_themes_command,
     '/unfollowThemes': commands_handler.unfollow_themes_command,
     '/changeIntervalTheme': commands_handler.change_interval_theme,
+    '/themeDelivery': commands_handler.theme_delivery_command,
+    '/themePriority': commands_handler.theme_priority_command,
+    '/mediaPolicy': commands_handler.media_policy_command,
+    '/search': commands_handler.search_command,
+    '/stats': commands_handler.stats_command,
+    '/unusedKeywords': commands_handler.unused_keywords_command,
+    '/importKeywords': commands_handler.import_keywords_command,
+    '/exportKeywords': commands_handler.export_keywords_command,
 }
 
-
-def check_file(file_name: str):
-    if not os.path.isfile(file_name):
-        with open(file_name, 'w') as _:
-            pass
-        logger.info(f"Added file {file_name}")
+command_dispatcher = CommandDispatcher(commands)
 
 
 def create_directories():
     logger.info("Creating directories")
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    os.makedirs(f"{UPLOAD_FOLDER}/{MessageFiletypes.DOCUMENT.value}", exist_ok=True)
-    os.makedirs(f"{UPLOAD_FOLDER}/{MessageFiletypes.PHOTO.value}", exist_ok=True)
+    for file_type in MessageFiletypes:
+        (MEDIA_ROOT / file_type.value).mkdir(parents=True, exist_ok=True)
+
+
+class StartupTimer:
+    """
+    Замер длительности этапов запуска, этапы могут выполняться параллельно
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
 
+    @asynccontextmanager
+    async def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
 
-def create_database(db_path: str):
-    # Попытка соединения с базой данных, которое приведет к ее созданию, если она еще не существует
-    conn = sqlite3.connect(db_path)
-    conn.close()
-    logger.success("Database created successfully")
+    def report(self):
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        logger.info(f"Startup finished in {time.perf_counter() - self.started:.2f}s ({phases})")
 
 
 async def create_tables(*metadata: MetaData):
@@ -72,6 +97,8 @@ async def create_tables(*metadata: MetaData):
 
 
 async def try_to_connect_postgres():
+    import asyncpg
+
     try:
         connection = await asyncpg.connect(
             user=PG_USERNAME,
@@ -100,10 +127,42 @@ async def update_channels():
         logger.error(f"Ошибка при обновлении каналов: {e}")
 
 
+async def refresh_dialogs():
+    try:
+        await chats_handler.dialogs.refresh()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении кэша диалогов: {e}")
+
+
+async def catch_up():
+    backfill_manager.start_catch_up()
+
+
+async def reconnect():
+    """
+    Переподключиться к телеграм, повторяя попытки с растущей паузой
+    """
+    delay = RECONNECT_MIN_DELAY
+
+    while True:
+        await asyncio.sleep(delay)
+
+        try:
+            await client.connect()
+            logger.success("Telethon reconnected")
+            return
+        except Exception as e:
+            logger.warning(f"Не удалось переподключиться, следующая попытка через {delay} с: {e}")
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+async def flush_match_stats():
+    await get_match_stats().flush()
+
+
 async def run_themes_scheduler():
     logger.debug(f"{LoggerTags.SCHEDULER.value} start themes scheduler")
-    themes = await db_manager.themes.all_themes()
-    _ = [await theme_scheduler.add_new_theme_job(theme.theme_name, theme.interval) for theme in themes if theme.is_following]
+    await theme_scheduler.sync_theme_jobs()
 
 
 async def run_scheduled_tasks():
@@ -111,32 +170,89 @@ async def run_scheduled_tasks():
     await run_themes_scheduler()
 
 
+async def prepare_database():
+    create_directories()
+
+    await create_tables(Base.metadata)
+    await migrate_schema(engine)
+    await migrate_media_layout(db_manager)
+    await db_manager.messages.create_search_index()
+
+    await chats_handler.load_fingerprints()
+
+
+async def connect_telegram():
+    if PASSWORD:
+        await client.start(phone=PHONE_NUMBER, password=PASSWORD)
+    else:
+        await client.start(phone=PHONE_NUMBER)
+
+
 async def startup():
-    await add_command_chat(COMMAND_CHAT)
+    timer = StartupTimer()
 
-    # await try_to_connect_postgres()
+    async def timed(name: str, coro):
+        async with timer.phase(name):
+            await coro
 
-    scheduler.add_job(update_channels, IntervalTrigger(seconds=15), id="update_channels")
-    scheduler.start()
+    # словари pymorphy2 грузятся в отдельном потоке, пока идет подключение к телеграм и бд
+    morph_loading = asyncio.create_task(timed('morphology', asyncio.to_thread(get_morph_analyzer)))
 
-    # для создания файлов
-    check_file(ALL_CHATS_FILENAME)
-    check_file(LISTENING_CHATS_FILENAME)
-    check_file(KEYWORDS_FILENAME)
+    # await try_to_connect_postgres()
 
-    create_directories()
+    if METRICS_PORT:
+        # без метрик парсер продолжает работу, например если порт уже занят
+        try:
+            await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.warning(f"Не удалось запустить сервер метрик на {METRICS_HOST}:{METRICS_PORT}: {e}")
 
-    create_database(SQLITE_DATABASE_PATH)
-    await create_tables(Base.metadata)
+    await asyncio.gather(
+        timed('database', prepare_database()),
+        timed('telegram', connect_telegram())
+    )
 
-    client.add_event_handler(
-        chats_handler.normal_handler,
-        events.NewMessage(
-            chats=await chats_handler.listening_chats_list()
+    async with timer.phase('handlers'):
+        command_dispatcher.start()
+        await add_command_chat(COMMAND_CHAT)
+
+        client.add_event_handler(
+            chats_handler.normal_handler,
+            events.NewMessage(
+                chats=await chats_handler.listening_chats_list()
+            )
         )
-    )
+        chats_handler.dialogs.add_event_handlers()
+
+    async with timer.phase('scheduler'):
+        instrument_scheduler(scheduler)
+        scheduler.add_job(update_channels, IntervalTrigger(seconds=15), id="update_channels")
+        scheduler.add_job(
+            flush_match_stats,
+            IntervalTrigger(seconds=MATCH_STATS_FLUSH_SECONDS),
+            id="flush_match_stats"
+        )
+        # догрузка сообщений, пропущенных за время отключения, сразу после запуска и затем периодически
+        scheduler.add_job(
+            catch_up,
+            IntervalTrigger(seconds=CATCH_UP_INTERVAL),
+            id="catch_up",
+            next_run_time=datetime.datetime.now(TIMEZONE)
+        )
+        # первое заполнение кэша диалогов идет в фоне сразу после запуска планировщика
+        scheduler.add_job(
+            refresh_dialogs,
+            IntervalTrigger(seconds=DIALOGS_REFRESH_INTERVAL),
+            id="refresh_dialogs",
+            next_run_time=datetime.datetime.now(TIMEZONE)
+        )
+        scheduler.start()
 
-    await run_scheduled_tasks()
+        await run_scheduled_tasks()
+
+    await morph_loading
+
+    timer.report()
 
     logger.success('Telethon started')
     logger.info(f"Set moderation chat - {BOT_URL}")
@@ -149,35 +265,37 @@ async def add_command_chat(chat: str):
 
 async def commands_handler(event: events.NewMessage.Event):
     """
-    Обработчик команд
+    Обработчик команд: команда ставится в очередь диспетчера и выполняется в его обработчиках
     :param event: событие
     """
-    msg = event.message.to_dict()['message']
-
-    command = msg.split(' ')[0]
-
-    print(f"{command=}")
-
-    if command not in commands.keys():
-        await event.reply("**Нет** такой команды")
-        return
-
-    logger.info(f"Command {command=}")
-
-    await commands[command](event)
+    await command_dispatcher.submit(event)
 
 
 async def main():
     await startup()
 
-    if PASSWORD:
-        await client.start(phone=PHONE_NUMBER, password=PASSWORD)
-    else:
-        await client.start(phone=PHONE_NUMBER)
+    await backfill_manager.resume()
 
-    await client.run_until_disconnected()
+    while True:
+        await client.run_until_disconnected()
+
+        logger.warning("Telethon disconnected, reconnecting")
+        await reconnect()
+        backfill_manager.start_catch_up()
 
 try:
     client.loop.run_until_complete(main())
 except Exception as e:
-    logger.error("e")
+    logger.exception(f"Ошибка в основном цикле: {e}")
+finally:
+    # записать совпадения, накопленные с последней записи
+    try:
+        client.loop.run_until_complete(flush_match_stats())
+    except Exception as e:
+        logger.error(f"Ошибка при записи статистики совпадений: {e}")
+    # дописать записанные сообщения и спаны, оставшиеся в очереди
+    if chats_handler.recorder is not None:
+        chats_handler.recorder.close()
+    tracer.close()
+    # дописать логи, оставшиеся в очереди фонового потока
+    logger.complete()
@@ -0,0 +1,162 @@
+import datetime
+import hashlib
+import heapq
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from .messages_handler import message_tokens
+
+SIMHASH_BITS = 64
+
+
+@dataclass
+class FingerprintEntry:
+    fingerprint: int
+    message_pk: int
+    date: datetime.datetime
+
+
+def _token_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode('utf8'), digest_size=8).digest(), 'big')
+
+
+def simhash(tokens: List[str]) -> int:
+    """
+    Посчитать 64-битный SimHash по словам сообщения.
+    Похожие тексты дают отпечатки с маленьким расстоянием Хэмминга
+    :param tokens: слова сообщения
+    :return: отпечаток
+    """
+    weights = [0] * SIMHASH_BITS
+
+    for token in tokens:
+        h = _token_hash(token)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+
+    return fingerprint
+
+
+def hamming_distance(fp1: int, fp2: int) -> int:
+    return (fp1 ^ fp2).bit_count()
+
+
+def fingerprint_to_str(fingerprint: int) -> str:
+    return f"{fingerprint:016x}"
+
+
+def fingerprint_from_str(fingerprint: str) -> int:
+    return int(fingerprint, 16)
+
+
+class DuplicateDetector:
+    """
+    Поиск почти одинаковых сообщений (репостов) среди недавно полученных.
+
+    Отпечаток делится на max_distance + 1 полос, поэтому два отпечатка с расстоянием
+    не больше max_distance обязательно совпадут хотя бы в одной полосе (LSH индекс).
+    В индексе хранятся только сообщения за window_seconds до самого нового из запомненных.
+    Сообщения приходят не по порядку дат (догрузка истории и пропусков), поэтому они вытесняются
+    по куче дат, а оригинал ищется только среди сообщений не дальше окна от даты нового сообщения
+    """
+
+    def __init__(self, window_seconds: int, max_distance: int, min_words: int):
+        self.window = datetime.timedelta(seconds=window_seconds)
+        self.max_distance = max_distance
+        self.min_words = min_words
+
+        self.bands_count = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands_count
+        self.band_mask = (1 << self.band_bits) - 1
+
+        # куча (дата, первичный ключ) для вытеснения самых старых сообщений
+        self.dates: List[Tuple[datetime.datetime, int]] = []
+        self.newest: Optional[datetime.datetime] = None
+        self.bands: List[Dict[int, Set[int]]] = [dict() for _ in range(self.bands_count)]
+        self.by_pk: Dict[int, FingerprintEntry] = {}
+
+    def fingerprint(self, text: Optional[str]) -> Optional[int]:
+        """
+        Посчитать отпечаток сообщения
+        :param text: текст сообщения
+        :return: None, если текст слишком короткий для надежного сравнения
+        """
+        if not text:
+            return None
+
+        tokens = message_tokens(text)
+        if len(tokens) < self.min_words:
+            return None
+
+        return simhash(tokens)
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [fingerprint >> (band * self.band_bits) & self.band_mask for band in range(self.bands_count)]
+
+    def _evict(self):
+        oldest = self.newest - self.window
+
+        while self.dates and self.dates[0][0] < oldest:
+            _, message_pk = heapq.heappop(self.dates)
+            entry = self.by_pk.pop(message_pk)
+
+            for band, key in enumerate(self._band_keys(entry.fingerprint)):
+                bucket = self.bands[band].get(key)
+                if bucket is None:
+                    continue
+                bucket.discard(entry.message_pk)
+                if not bucket:
+                    del self.bands[band][key]
+
+    def find_original(self, fingerprint: int, date: datetime.datetime) -> Optional[int]:
+        """
+        Найти оригинал для сообщения с таким отпечатком
+        :param fingerprint: отпечаток нового сообщения
+        :param date: дата нового сообщения
+        :return: первичный ключ оригинального сообщения в бд или None
+        """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            candidates |= self.bands[band].get(key, set())
+
+        best_pk = best_distance = None
+        for pk in candidates:
+            entry = self.by_pk[pk]
+            if abs(entry.date - date) > self.window:
+                continue
+
+            distance = hamming_distance(entry.fingerprint, fingerprint)
+            if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                best_pk, best_distance = pk, distance
+
+        return best_pk
+
+    def remember(self, fingerprint: int, message_pk: int, date: datetime.datetime):
+        """
+        Добавить оригинальное сообщение в индекс
+        :param fingerprint: отпечаток
+        :param message_pk: первичный ключ сообщения в бд
+        :param date: дата сообщения
+        """
+        if message_pk in self.by_pk:
+            return
+
+        if self.newest is None or date > self.newest:
+            self.newest = date
+        elif self.newest - date > self.window:
+            # старое сообщение из истории было бы сразу вытеснено
+            return
+
+        entry = FingerprintEntry(fingerprint=fingerprint, message_pk=message_pk, date=date)
+        heapq.heappush(self.dates, (date, message_pk))
+        self.by_pk[message_pk] = entry
+
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            self.bands[band].setdefault(key, set()).add(message_pk)
+
+        self._evict()
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Set, Tuple
+
+from loguru import logger
+
+from config import LoggerTags, TIMEZONE, MATCH_STATS_KEYWORD, MATCH_STATS_THEME
+from data.dataclasses import MatchHitsDB
+from data.db_manager import DBManager
+
+
+class MatchStats:
+    """
+    Счетчики совпадений ключевых слов и тем в памяти.
+    Сопоставление сообщений только увеличивает счетчики, в таблицу match_stats они записываются
+    пачками upsert при flush (задача планировщика раз в MATCH_STATS_FLUSH_SECONDS).
+    Новые слова и темы регистрируются в таблице с нулем совпадений, чтобы по ним можно было найти неиспользуемые
+    """
+
+    def __init__(self, db_manager: DBManager = None):
+        self.db_manager = db_manager or DBManager()
+        # (kind, имя) -> количество совпадений и время последнего с прошлой записи
+        self.hits: Dict[Tuple[str, str], int] = {}
+        self.last_hit: Dict[Tuple[str, str], datetime.datetime] = {}
+        # имена, которые уже учитываются, и новые, которые надо зарегистрировать при следующей записи
+        self.tracked: Dict[str, Set[str]] = {MATCH_STATS_KEYWORD: set(), MATCH_STATS_THEME: set()}
+        self.untracked: Dict[str, Set[str]] = {MATCH_STATS_KEYWORD: set(), MATCH_STATS_THEME: set()}
+        self.lock = asyncio.Lock()
+
+    def track(self, kind: str, names: Iterable[str]):
+        """
+        Отметить текущие слова или темы, чтобы их учет начался при следующей записи
+        """
+        new = set(names) - self.tracked[kind]
+
+        if new:
+            self.tracked[kind] |= new
+            self.untracked[kind] |= new
+
+    def add(self, kind: str, names: Iterable[str], amount: int = 1):
+        """
+        Учесть совпадения
+        :param kind: MATCH_STATS_KEYWORD или MATCH_STATS_THEME
+        :param names: совпавшие словоформы или темы
+        :param amount: сколько совпадений у каждого имени
+        """
+        now = None
+
+        for name in names:
+            now = now or datetime.datetime.now(TIMEZONE)
+            key = (kind, name)
+            self.hits[key] = self.hits.get(key, 0) + amount
+            self.last_hit[key] = now
+
+    def _restore(self,
+                 hits: Dict[Tuple[str, str], int],
+                 last_hit: Dict[Tuple[str, str], datetime.datetime],
+                 untracked: Dict[str, Set[str]]):
+        # вернуть не записанные данные, чтобы они ушли со следующей записью
+        for key, count in hits.items():
+            self.hits[key] = self.hits.get(key, 0) + count
+            self.last_hit[key] = max(self.last_hit.get(key, last_hit[key]), last_hit[key])
+
+        for kind, names in untracked.items():
+            self.untracked[kind] |= names
+
+    async def flush(self):
+        """
+        Записать накопленные совпадения в бд
+        """
+        async with self.lock:
+            hits, last_hit, untracked = self.hits, self.last_hit, self.untracked
+            self.hits, self.last_hit = {}, {}
+            self.untracked = {kind: set() for kind in untracked}
+
+            if not hits and not any(untracked.values()):
+                return
+
+            try:
+                now = datetime.datetime.now(TIMEZONE)
+                for kind, names in untracked.items():
+                    if names:
+                        await self.db_manager.stats.track_names(kind, sorted(names), now)
+
+                if hits:
+                    await self.db_manager.stats.add_match_hits([
+                        MatchHitsDB(kind=kind, name=name, hits=count, last_hit=last_hit[(kind, name)])
+                        for (kind, name), count in hits.items()
+                    ])
+            except Exception as e:
+                logger.error(f"{LoggerTags.DATABASE.value} Failed to flush match stats: {e}")
+                self._restore(hits, last_hit, untracked)
+                return
+
+            logger.debug(f"{LoggerTags.DATABASE.value} Flushed hits of {len(hits)} names, "
+                         f"tracked {sum(len(el) for el in untracked.values())} new names")
+
+
+@lru_cache(maxsize=None)
+def get_match_stats() -> MatchStats:
+    """
+    Общие на процесс счетчики совпадений: слова считает обработчик сообщений, темы - рассылка
+    """
+    return MatchStats()
@@ -1,3 +1,17 @@
 """
 приходит сообщение строкой, в ней я должен выделить какие-то ключевые слова и отправить обратно
-"""
\ No newline at end of file
+"""
+from typing import List
+
+from config import IGNORE_SYMBOLS
+
+_PUNCTUATION_TABLE = str.maketrans('', '', IGNORE_SYMBOLS)
+
+
+def message_tokens(text: str) -> List[str]:
+    """
+    Разбить текст сообщения на нормализованные слова
+    :param text: текст сообщения
+    :return: список слов без пунктуации, в нижнем регистре
+    """
+    return text.lower().replace("ё", "е").translate(_PUNCTUATION_TABLE).split()
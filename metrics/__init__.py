@@ -0,0 +1,29 @@
+from .registry import Registry, Counter, Gauge, Histogram
+from .pipeline import (
+    registry,
+    instrument_scheduler,
+    MESSAGES_RECEIVED,
+    HANDLER_STAGE_SECONDS,
+    DB_QUERY_SECONDS,
+    SCHEDULER_JOB_SECONDS,
+    SCHEDULER_JOB_LAG_SECONDS,
+    OUTBOUND_QUEUE_DEPTH,
+    OUTBOUND_WAIT_SECONDS,
+    FLOOD_WAIT_SECONDS,
+    MEDIA_DECISIONS,
+    MEDIA_DOWNLOAD_SECONDS,
+    MEDIA_DOWNLOADS_ACTIVE,
+    MEDIA_DOWNLOAD_PARTS_PENDING,
+    COMMAND_SECONDS,
+    COMMAND_QUEUE_DEPTH,
+)
+from .rolling import RollingCounter, FloodWaitEvent
+from .live import (
+    CHAT_MESSAGES,
+    KEYWORD_HITS,
+    THEME_DELIVERIES,
+    THEME_DELIVERY_SECONDS,
+    record_flood_wait,
+    last_flood_wait,
+)
+from .server import start_metrics_server
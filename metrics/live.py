@@ -0,0 +1,30 @@
+import time
+from typing import Optional
+
+from config import STATS_WINDOW_SECONDS, STATS_BUCKET_SECONDS
+from .pipeline import FLOOD_WAIT_SECONDS
+from .rolling import RollingCounter, FloodWaitEvent
+
+# скользящие счетчики для команды /stats (метрики Prometheus копятся с запуска и не показывают текущую нагрузку)
+CHAT_MESSAGES = RollingCounter(STATS_WINDOW_SECONDS, STATS_BUCKET_SECONDS)
+KEYWORD_HITS = RollingCounter(STATS_WINDOW_SECONDS, STATS_BUCKET_SECONDS)
+THEME_DELIVERIES = RollingCounter(STATS_WINDOW_SECONDS, STATS_BUCKET_SECONDS)
+THEME_DELIVERY_SECONDS = RollingCounter(STATS_WINDOW_SECONDS, STATS_BUCKET_SECONDS)
+
+_last_flood_wait: Optional[FloodWaitEvent] = None
+
+
+def record_flood_wait(seconds: int, source: str):
+    """
+    Учесть FloodWait: секунды ожидания в метрике и последнее событие для /stats
+    :param seconds: сколько секунд надо ждать
+    :param source: полоса отправки или загрузка истории
+    """
+    global _last_flood_wait
+
+    FLOOD_WAIT_SECONDS.inc(seconds, source=source)
+    _last_flood_wait = FloodWaitEvent(source=source, seconds=seconds, at=time.time())
+
+
+def last_flood_wait() -> Optional[FloodWaitEvent]:
+    return _last_flood_wait
@@ -0,0 +1,111 @@
+import time
+from typing import Dict
+
+from apscheduler.events import JobSubmissionEvent, JobExecutionEvent, EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, \
+    EVENT_JOB_ERROR
+from apscheduler.schedulers.base import BaseScheduler
+
+from .registry import Registry, Counter, Histogram, Gauge
+
+registry = Registry()
+
+MESSAGES_RECEIVED = registry.register(Counter(
+    'telethon_messages_received',
+    'Messages received from listening chats',
+    ('chat_id',)
+))
+
+HANDLER_STAGE_SECONDS = registry.register(Histogram(
+    'telethon_handler_stage_seconds',
+    'normal_handler latency by stage (download, store, match, forward)',
+    ('stage',)
+))
+
+DB_QUERY_SECONDS = registry.register(Histogram(
+    'telethon_db_query_seconds',
+    'Database call latency by DataManager method',
+    ('manager', 'method')
+))
+
+SCHEDULER_JOB_SECONDS = registry.register(Histogram(
+    'telethon_scheduler_job_seconds',
+    'Scheduler job duration',
+    ('job_id',)
+))
+
+SCHEDULER_JOB_LAG_SECONDS = registry.register(Histogram(
+    'telethon_scheduler_job_lag_seconds',
+    'Delay between scheduled and actual job start',
+    ('job_id',)
+))
+
+OUTBOUND_QUEUE_DEPTH = registry.register(Gauge(
+    'telethon_outbound_queue_depth',
+    'Sends waiting in the outbound queue by priority lane',
+    ('lane',)
+))
+
+OUTBOUND_WAIT_SECONDS = registry.register(Histogram(
+    'telethon_outbound_wait_seconds',
+    'Time from queueing a send to its completion by priority lane',
+    ('lane',)
+))
+
+COMMAND_SECONDS = registry.register(Histogram(
+    'telethon_command_seconds',
+    'Command execution time by command and result (ok, error, timeout)',
+    ('command', 'status')
+))
+
+COMMAND_QUEUE_DEPTH = registry.register(Gauge(
+    'telethon_command_queue_depth',
+    'Commands waiting in the dispatcher queue'
+))
+
+MEDIA_DECISIONS = registry.register(Counter(
+    'telethon_media_decisions',
+    'Media of received messages by download decision (full, thumb, skip)',
+    ('decision',)
+))
+
+MEDIA_DOWNLOAD_SECONDS = registry.register(Histogram(
+    'telethon_media_download_seconds',
+    'Media download time by method (simple, chunked)',
+    ('method',)
+))
+
+MEDIA_DOWNLOADS_ACTIVE = registry.register(Gauge(
+    'telethon_media_downloads_active',
+    'Media downloads in progress'
+))
+
+MEDIA_DOWNLOAD_PARTS_PENDING = registry.register(Gauge(
+    'telethon_media_download_parts_pending',
+    'Parts of chunked downloads waiting for a download worker'
+))
+
+FLOOD_WAIT_SECONDS = registry.register(Counter(
+    'telethon_flood_wait_seconds',
+    'Seconds spent waiting on FloodWait errors',
+    ('source',)
+))
+
+
+def instrument_scheduler(scheduler: BaseScheduler):
+    """
+    Подписаться на события планировщика, чтобы считать длительность задач и задержку их запуска
+    """
+    started: Dict[str, float] = {}
+
+    def on_submitted(event: JobSubmissionEvent):
+        started[event.job_id] = time.perf_counter()
+        lag = time.time() - event.scheduled_run_times[-1].timestamp()
+        SCHEDULER_JOB_LAG_SECONDS.observe(max(lag, 0), job_id=event.job_id)
+
+    def on_finished(event: JobExecutionEvent):
+        start = started.pop(event.job_id, None)
+        if start is not None:
+            SCHEDULER_JOB_SECONDS.observe(time.perf_counter() - start, job_id=event.job_id)
+
+    scheduler.add_listener(on_submitted, EVENT_JOB_SUBMITTED)
+    scheduler.add_listener(on_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
@@ -0,0 +1,89 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+class RollingCounter:
+    """
+    Счетчики по ключам за скользящее окно в памяти.
+    Значения копятся в корзинах по bucket_seconds, корзины старше окна отбрасываются при обращении к ключу,
+    поэтому запись и чтение не зависят от объема накопленных данных
+    """
+
+    def __init__(self,
+                 window_seconds: float = 3600,
+                 bucket_seconds: float = 60,
+                 clock: Callable[[], float] = time.monotonic):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.clock = clock
+        self.started = clock()
+        # ключ -> корзины [номер корзины, значение] от старых к новым
+        self.buckets: Dict[str, Deque[list]] = {}
+
+    def _bucket(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def _expire(self, key: str, now: float) -> Optional[Deque[list]]:
+        buckets = self.buckets.get(key)
+        if buckets is None:
+            return None
+
+        oldest = self._bucket(now - self.window_seconds)
+        while buckets and buckets[0][0] <= oldest:
+            buckets.popleft()
+
+        if not buckets:
+            del self.buckets[key]
+            return None
+
+        return buckets
+
+    def inc(self, key: str, amount: float = 1):
+        now = self.clock()
+        bucket = self._bucket(now)
+        buckets = self._expire(key, now)
+
+        if buckets is None:
+            buckets = self.buckets[key] = deque()
+
+        if buckets and buckets[-1][0] == bucket:
+            buckets[-1][1] += amount
+        else:
+            buckets.append([bucket, amount])
+
+    def inc_many(self, keys: Iterable[str], amount: float = 1):
+        for key in keys:
+            self.inc(key, amount)
+
+    def total(self, key: str) -> float:
+        buckets = self._expire(key, self.clock())
+        return sum(value for _, value in buckets) if buckets else 0
+
+    def totals(self) -> Dict[str, float]:
+        totals = {key: self.total(key) for key in list(self.buckets)}
+        return {key: value for key, value in totals.items() if value}
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        """
+        n ключей с наибольшими значениями за окно
+        """
+        return sorted(self.totals().items(), key=lambda el: el[1], reverse=True)[:n]
+
+    def span_seconds(self) -> float:
+        """
+        Фактическая длина окна: меньше window_seconds, пока процесс работает меньше окна
+        """
+        return max(min(self.window_seconds, self.clock() - self.started), 1)
+
+    def per_minute(self, value: float) -> float:
+        return value * 60 / self.span_seconds()
+
+
+@dataclass(frozen=True, slots=True)
+class FloodWaitEvent:
+    source: str
+    seconds: int
+    # время по time.time()
+    at: float
@@ -0,0 +1,45 @@
+import asyncio
+
+from loguru import logger
+
+from config import LoggerTags
+from .pipeline import registry
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+
+        # заголовки запроса не нужны, но их надо дочитать
+        while (await reader.readline()).strip():
+            pass
+
+        parts = request_line.decode('latin-1').split()
+
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status = '200 OK'
+            body = registry.render().encode('utf8')
+        else:
+            status = '404 Not Found'
+            body = b'Not Found\n'
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Ошибка при отдаче метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    """
+    Запустить HTTP сервер, который отдает метрики по адресу /metrics
+    """
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"{LoggerTags.SCHEDULER.value} Metrics available at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,11 @@
+from functools import lru_cache
+
+from .scheduler import OutboundScheduler, OutboundJob
+
+
+@lru_cache(maxsize=None)
+def get_outbound_scheduler() -> OutboundScheduler:
+    """
+    Общая очередь исходящих отправок на процесс (один аккаунт - одни лимиты)
+    """
+    return OutboundScheduler()
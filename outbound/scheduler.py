@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from loguru import logger
+from telethon.errors import FloodWaitError
+
+from config import LoggerTags, OUTBOUND_LANES, OUTBOUND_MAX_RETRIES, OUTBOUND_BACKOFF_FACTOR, SEND_DELAY_SECONDS
+from metrics import OUTBOUND_QUEUE_DEPTH, OUTBOUND_WAIT_SECONDS, record_flood_wait
+
+
+@dataclass
+class OutboundJob:
+    lane: str
+    send: Callable[[], Awaitable]
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class OutboundScheduler:
+    """
+    Единая очередь исходящих отправок с полосами приоритета (OUTBOUND_LANES, первая - самая срочная).
+    Отправки выполняются по одной с паузой SEND_DELAY_SECONDS, следующей всегда берется задача
+    из самой приоритетной непустой полосы, поэтому пересылки в реальном времени обгоняют рассылку тем.
+    При FloodWait полоса (и все менее приоритетные, с увеличенной паузой) откладывается,
+    а более приоритетные полосы продолжают работать
+    """
+
+    def __init__(self, lanes=OUTBOUND_LANES, send_delay: float = SEND_DELAY_SECONDS):
+        self.lanes = tuple(lanes)
+        self.send_delay = send_delay
+        self.queues: Dict[str, Deque[OutboundJob]] = {lane: deque() for lane in self.lanes}
+        self.paused_until: Dict[str, float] = {lane: 0.0 for lane in self.lanes}
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.last_send = 0.0
+
+    def lane(self, lane: Optional[str]) -> str:
+        """
+        Полоса по названию, неизвестные и пустые значения - самая низкая полоса
+        """
+        return lane if lane in self.queues else self.lanes[-1]
+
+    async def send(self, lane: str, send: Callable[[], Awaitable]):
+        """
+        Поставить отправку в очередь полосы и дождаться ее выполнения
+        :param lane: полоса приоритета
+        :param send: функция без аргументов, которая выполняет запрос к телеграм
+        :return: результат запроса
+        """
+        lane = self.lane(lane)
+        job = OutboundJob(lane=lane, send=send, future=asyncio.get_running_loop().create_future())
+
+        self.queues[lane].append(job)
+        OUTBOUND_QUEUE_DEPTH.inc(lane=lane)
+        self._ensure_worker()
+        self.wakeup.set()
+
+        return await job.future
+
+    def _ensure_worker(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    def _next_lane(self, now: float) -> Optional[str]:
+        for lane in self.lanes:
+            if self.queues[lane] and self.paused_until[lane] <= now:
+                return lane
+        return None
+
+    async def _wait_for_work(self, now: float):
+        resume_at = [self.paused_until[lane] for lane in self.lanes if self.queues[lane]]
+        self.wakeup.clear()
+
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), min(resume_at) - now if resume_at else None)
+        except asyncio.TimeoutError:
+            pass
+
+    def _back_off(self, lane: str, seconds: float):
+        """
+        Отложить полосу, получившую FloodWait, и все менее приоритетные полосы (каждую следующую - дольше).
+        FloodWait в самой срочной полосе откладывает все полосы
+        """
+        now = time.monotonic()
+        index = self.lanes.index(lane)
+
+        for i, other in enumerate(self.lanes[index:]):
+            pause = seconds * (OUTBOUND_BACKOFF_FACTOR ** i)
+            self.paused_until[other] = max(self.paused_until[other], now + pause)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            lane = self._next_lane(now)
+
+            if lane is None:
+                await self._wait_for_work(now)
+                continue
+
+            job = self.queues[lane].popleft()
+
+            if job.future.cancelled():
+                OUTBOUND_QUEUE_DEPTH.dec(lane=lane)
+                continue
+
+            delay = self.last_send + self.send_delay - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            job.attempts += 1
+
+            try:
+                result = await job.send()
+            except FloodWaitError as e:
+                record_flood_wait(e.seconds, lane)
+                logger.warning(f"{LoggerTags.SCHEDULER.value} Flood wait {e.seconds} seconds in lane {lane}")
+                self._back_off(lane, e.seconds)
+
+                if job.attempts <= OUTBOUND_MAX_RETRIES:
+                    self.queues[lane].appendleft(job)
+                    continue
+
+                self._finish(job, exception=e)
+            except Exception as e:
+                self._finish(job, exception=e)
+            else:
+                self._finish(job, result=result)
+            finally:
+                self.last_send = time.monotonic()
+
+    @staticmethod
+    def _finish(job: OutboundJob, result=None, exception: Optional[BaseException] = None):
+        OUTBOUND_QUEUE_DEPTH.dec(lane=job.lane)
+        OUTBOUND_WAIT_SECONDS.observe(time.monotonic() - job.queued_at, lane=job.lane)
+
+        if job.future.done():
+            return
+
+        if exception is not None:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(result)
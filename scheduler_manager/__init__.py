@@ -1 +1 @@
-from .manager import SchedulerManager, ThemeSchedulerManager
+from .manager import SchedulerManager, ThemeSchedulerManager, get_theme_scheduler
@@ -0,0 +1,135 @@
+import html
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import DIGEST_MAX_LENGTH, DIGEST_SNIPPET_LENGTH, TIMEZONE
+from data.dataclasses import DeliveryMessageDB, DialogDB, FileDB
+
+# максимальное количество файлов в одной медиагруппе телеграм
+MEDIA_GROUP_SIZE = 10
+
+
+@dataclass(frozen=True, slots=True)
+class DigestEntry:
+    """
+    Одна позиция дайджеста: сообщение или весь альбом
+    """
+    chat_id: str
+    message_id: str
+    text: str
+    date: object
+    links: Tuple[str, ...]
+    files: Tuple[FileDB, ...]
+    grouped_id: Optional[int] = None
+
+
+def group_entries(messages: List[DeliveryMessageDB]) -> List[DigestEntry]:
+    """
+    Объединить части альбомов в одну позицию, порядок - по первому сообщению
+    """
+    entries: Dict[tuple, List[DeliveryMessageDB]] = {}
+
+    for msg in messages:
+        key = (msg.chat_id, msg.grouped_id) if msg.grouped_id else (msg.chat_id, None, msg.id)
+        entries.setdefault(key, []).append(msg)
+
+    result = []
+    for parts in entries.values():
+        first = parts[0]
+        links = tuple(dict.fromkeys(link for msg in parts if msg.links for link in msg.links.split(',')))
+
+        result.append(DigestEntry(
+            chat_id=first.chat_id,
+            message_id=first.message_id,
+            text=next((msg.message for msg in parts if msg.message), ''),
+            date=first.date,
+            links=links,
+            files=tuple(file for msg in parts for file in msg.files),
+            grouped_id=first.grouped_id
+        ))
+
+    return result
+
+
+def message_link(chat_id: str, message_id: str, dialog: Optional[DialogDB]) -> str:
+    if dialog is not None and dialog.username:
+        return f"https://t.me/{dialog.username}/{message_id}"
+
+    return f"https://t.me/c/{chat_id.removeprefix('-100')}/{message_id}"
+
+
+def snippet(text: str, length: int = DIGEST_SNIPPET_LENGTH) -> str:
+    text = ' '.join(text.split())
+
+    if len(text) <= length:
+        return text
+
+    return text[:length].rsplit(' ', 1)[0] + '…'
+
+
+def render_entry(entry: DigestEntry, dialog: Optional[DialogDB]) -> str:
+    title = dialog.title if dialog is not None and dialog.title else entry.chat_id
+    date = entry.date.astimezone(TIMEZONE) if getattr(entry.date, 'tzinfo', None) else entry.date
+
+    lines = [
+        f'<b>{html.escape(title)}</b> · '
+        f'<a href="{html.escape(message_link(entry.chat_id, entry.message_id, dialog))}">{date:%d.%m %H:%M}</a>'
+    ]
+
+    if entry.text:
+        lines.append(html.escape(snippet(entry.text)))
+
+    if entry.files:
+        lines.append(f'📎 файлов: {len(entry.files)}')
+
+    lines += [html.escape(link[:DIGEST_SNIPPET_LENGTH]) for link in entry.links[:3]]
+
+    return '\n'.join(lines)
+
+
+def render_digest(theme_name: str, entries: List[DigestEntry], dialogs: Dict[str, DialogDB]) -> List[str]:
+    """
+    Разбить дайджест темы на сообщения не длиннее DIGEST_MAX_LENGTH символов (разметка HTML)
+    :return: тексты сообщений
+    """
+    header = f'<b>Дайджест: {html.escape(theme_name)}</b> ({len(entries)})'
+    chunks = []
+    current = header
+
+    for entry in entries:
+        block = render_entry(entry, dialogs.get(entry.chat_id))
+
+        if len(current) + 2 + len(block) > DIGEST_MAX_LENGTH:
+            chunks.append(current)
+            current = header
+
+        current += '\n\n' + block
+
+    chunks.append(current)
+    return chunks
+
+
+def media_groups(entries: List[DigestEntry]) -> List[List[FileDB]]:
+    """
+    Файлы для отправки медиагруппами: альбом - отдельной группой,
+    одиночные файлы разных сообщений объединяются по типу (фото и документы нельзя смешивать в одной группе),
+    в группе не больше MEDIA_GROUP_SIZE файлов
+    """
+    groups = []
+    singles: Dict[str, List[FileDB]] = {}
+
+    for entry in entries:
+        if not entry.files:
+            continue
+
+        if entry.grouped_id:
+            files = list(entry.files)
+            groups += [files[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(files), MEDIA_GROUP_SIZE)]
+        else:
+            for file in entry.files:
+                singles.setdefault(file.file_type, []).append(file)
+
+    for files in singles.values():
+        groups += [files[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(files), MEDIA_GROUP_SIZE)]
+
+    return groups
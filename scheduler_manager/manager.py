@@ -1,17 +1,26 @@
-import asyncio
 import os
+import time
 from abc import ABCMeta, abstractmethod
 from datetime import datetime, timedelta
-from typing import Optional, List
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple, Callable, Awaitable
 
 from apscheduler.triggers.interval import IntervalTrigger
 from loguru import logger
 from telethon.tl.types import InputMediaPhoto, InputMediaDocument, MessageMediaPhoto, MessageMediaDocument, \
     TypeDocumentAttribute, DocumentAttributeFilename
 
-from config import scheduler, TIMEZONE, client, MessageFiletypes, LoggerTags, BOT_URL
-from data import MessagesModel
+from config import scheduler, TIMEZONE, client, MessageFiletypes, LoggerTags, BOT_URL, THEMES_JOBSTORE, \
+    COALESCE_THEME_JOBS, THEME_DELIVERY_DIGEST, OUTBOUND_LANE_NORMAL, MATCH_STATS_THEME
+from data.dataclasses import ThemeDB, DeliveryMessageDB, FileDB
 from data.db_manager import DBManager
+from messages.match_stats import get_match_stats
+from messages.messages_handler import message_tokens
+from metrics import THEME_DELIVERIES, THEME_DELIVERY_SECONDS
+from outbound import get_outbound_scheduler
+from storage import get_storage
+from tracing import tracer
+from .digest import group_entries, render_digest, media_groups
 
 
 class SchedulerManager(metaclass=ABCMeta):
@@ -19,9 +28,12 @@ class SchedulerManager(metaclass=ABCMeta):
         self.scheduler = scheduler
         self.client = client
         self.db_manager = DBManager()
+        self.outbound = get_outbound_scheduler()
+        self.storage = get_storage()
+        self.match_stats = get_match_stats()
 
     @abstractmethod
-    async def _send_messages(self, messages: List[MessagesModel]):
+    async def _send_messages(self, messages: List[DeliveryMessageDB], lane: str = OUTBOUND_LANE_NORMAL):
         logger.info(f"{LoggerTags.SCHEDULER.value} Sending {len(messages)} messages")
         pass
 
@@ -30,7 +42,7 @@ class ThemeSchedulerManager(SchedulerManager):
     def __init__(self):
         super().__init__()
 
-    async def _get_messages_by_interval(self, interval: int) -> Optional[List[MessagesModel]]:
+    async def _get_messages_by_interval(self, interval: int) -> Optional[List[DeliveryMessageDB]]:
         logger.debug(f"{LoggerTags.SCHEDULER.value} Getting messages by {interval=}")
         utc_now = datetime.now(TIMEZONE)
 
@@ -38,64 +50,243 @@ class ThemeSchedulerManager(SchedulerManager):
 
         return await self.db_manager.messages.get_message_by_interval(start_time)
 
-    async def _send_messages(self, messages: List[MessagesModel]):
-        logger.info(f"{LoggerTags.SCHEDULER.value} Sending {len(messages)} messages")
+    async def _send(self, lane: str, send: Callable[[], Awaitable]):
+        """
+        Выполнить отправку через общую очередь исходящих с приоритетом полосы (паузы и FloodWait - там же)
+        """
+        await self.outbound.send(lane, send)
+
+    async def _send_files(self, files: List[FileDB], caption: str):
+        """
+        Отправить файлы из хранилища одной медиагруппой.
+        Файлы берутся из хранилища при каждой попытке, чтобы повтор после FloodWait не отправил прочитанные потоки
+        """
+        return await self.client.send_file(
+            entity=BOT_URL,
+            file=[await self.storage.sendable(el.file_path) for el in files],
+            caption=caption
+        )
+
+    async def _send_messages(self, messages: List[DeliveryMessageDB], lane: str = OUTBOUND_LANE_NORMAL):
+        logger.info(f"{LoggerTags.SCHEDULER.value} Sending {len(messages)} messages in lane {lane}")
 
+        with tracer.span('scheduler.send_messages', count=len(messages), lane=lane):
+            await self._send_all(messages, lane)
+
+    async def _send_all(self, messages: List[DeliveryMessageDB], lane: str):
         is_file_sent = False
 
         for message in messages:
-            grouped_msgs = []
+            with tracer.span('scheduler.send', chat_id=message.chat_id, message_id=message.message_id):
+                is_file_sent = await self._send_message(message, messages, is_file_sent, lane)
 
-            if message.grouped_id:
-                grouped_msgs = [
-                    msg for msg in messages
-                    if msg.grouped_id == message.grouped_id and
-                       msg.chat_id == message.chat_id
-                ]
-            else:
-                grouped_msgs.append(message)
+    async def _send_message(self,
+                            message: DeliveryMessageDB,
+                            messages: List[DeliveryMessageDB],
+                            is_file_sent: bool,
+                            lane: str = OUTBOUND_LANE_NORMAL) -> bool:
+        """
+        Отправить одно сообщение (с файлами его альбома)
+        :return: был ли уже отправлен файл
+        """
+        grouped_msgs = []
 
-            media = []
+        if message.grouped_id:
+            grouped_msgs = [
+                msg for msg in messages
+                if msg.grouped_id == message.grouped_id and
+                   msg.chat_id == message.chat_id
+            ]
+        else:
+            grouped_msgs.append(message)
 
-            for msg in grouped_msgs:
-                media += await self.db_manager.files.get_files_for_message(msg.chat_id, msg.message_id)
+        media = [file for msg in grouped_msgs for file in msg.files]
 
-            if media and not is_file_sent:
-                logger.debug(f"Sending media files for message {message.message_id} from chat {message.chat_id}")
-                await self.client.send_file(
-                    entity=BOT_URL,
-                    file=[el.file_path for el in media],
-                    caption=message.message if message.message else "",
-                )
-                is_file_sent = True
-
-            else:
-                logger.debug(f"Sending text message {message.message_id} in chat {message.chat_id}")
-                await self.client.send_message(
+        if media and not is_file_sent:
+            logger.debug(f"Sending media files for message {message.message_id} from chat {message.chat_id}")
+            await self._send(lane, lambda: self._send_files(media, message.message if message.message else ""))
+            return True
+
+        logger.debug(f"Sending text message {message.message_id} in chat {message.chat_id}")
+        await self._send(lane, lambda: self.client.send_message(
+            entity=BOT_URL,
+            message=message.message
+        ))
+        return is_file_sent
+
+    async def _send_digest(self, theme: ThemeDB, messages: List[DeliveryMessageDB]):
+        """
+        Отправить все сообщения темы за интервал сводкой: несколько текстовых сообщений ограниченной длины
+        и файлы медиагруппами (альбом - одной группой) вместо отправки каждого сообщения
+        """
+        entries = group_entries(messages)
+        dialogs = {
+            el.chat_id: el
+            for el in await self.db_manager.dialogs.get_dialogs_by_ids(list({entry.chat_id for entry in entries}))
+        }
+
+        chunks = render_digest(theme.theme_name, entries, dialogs)
+        groups = media_groups(entries)
+
+        logger.info(f"{LoggerTags.SCHEDULER.value} Digest {theme.theme_name}: {len(entries)} entries, "
+                    f"{len(chunks)} messages, {len(groups)} media groups")
+
+        with tracer.span('scheduler.send_digest', theme=theme.theme_name, entries=len(entries), lane=theme.priority):
+            for chunk in chunks:
+                await self._send(theme.priority, lambda chunk=chunk: self.client.send_message(
                     entity=BOT_URL,
-                    message=message.message
-                )
-            await asyncio.sleep(0.3)
+                    message=chunk,
+                    parse_mode='html',
+                    link_preview=False
+                ))
+
+            for i, group in enumerate(groups, start=1):
+                await self._send(theme.priority, lambda i=i, group=group: self._send_files(
+                    group, f"Дайджест: {theme.theme_name}, файлы {i}/{len(groups)}"
+                ))
+
+    @staticmethod
+    def _filter_theme_messages(messages: List[DeliveryMessageDB], theme: ThemeDB) -> List[DeliveryMessageDB]:
+        """
+        Оставить сообщения, в которых есть ключевые слова темы, вместе с остальными частями их альбомов
+        """
+        keywords = {el.word for el in theme.keywords}
+
+        matched = {msg.id for msg in messages if msg.message and keywords & set(message_tokens(msg.message))}
+        matched_groups = {(msg.chat_id, msg.grouped_id) for msg in messages if msg.id in matched and msg.grouped_id}
+
+        return [
+            msg for msg in messages
+            if msg.id in matched or (msg.grouped_id and (msg.chat_id, msg.grouped_id) in matched_groups)
+        ]
+
+    @classmethod
+    def _theme_deliveries(cls,
+                          messages: List[DeliveryMessageDB],
+                          themes: List[ThemeDB]) -> List[Tuple[ThemeDB, List[DeliveryMessageDB], int]]:
+        """
+        Распределить сообщения интервала по темам.
+        Темы с доставкой по одному сообщению пишут в один чат, поэтому сообщение, подходящее под несколько
+        таких тем, отправляется только с первой из них (в порядке themes). Дайджест - отдельная сводка темы,
+        в него попадают все подходящие сообщения. Результат не зависит от того, объединены ли задачи тем
+        :return: тема, ее сообщения для отправки и количество совпавших сообщений
+        """
+        deliveries = []
+        sent = set()
+
+        for theme in themes:
+            matched = cls._filter_theme_messages(messages, theme)
+
+            if theme.delivery_mode == THEME_DELIVERY_DIGEST:
+                deliveries.append((theme, matched, len(matched)))
+                continue
+
+            deliveries.append((theme, [msg for msg in matched if msg.id not in sent], len(matched)))
+            sent |= {msg.id for msg in matched}
+
+        return deliveries
 
-    async def _send_messages_job(self, interval: int):
-        logger.info(f"{LoggerTags.SCHEDULER.value} - Sending messages job")
+    async def _send_messages_job(self, interval: int, theme_name: Optional[str] = None):
+        """
+        Выбрать сообщения за интервал один раз и разослать их по всем отслеживаемым темам с этим интервалом
+        :param interval: интервал задачи в секундах
+        :param theme_name: только эта тема (если задачи тем не объединяются)
+        """
+        logger.info(f"{LoggerTags.SCHEDULER.value} - Sending messages job {interval=} {theme_name=}")
         try:
+            # все темы интервала нужны и отдельной задаче темы: от них зависит, какие сообщения она отправит
+            themes = [
+                theme for theme in await self.db_manager.themes.all_themes()
+                if theme.is_following and theme.interval == interval
+            ]
+
+            if not any(theme_name in (None, theme.theme_name) for theme in themes):
+                return
+
             msgs = await self._get_messages_by_interval(interval)
-            await self._send_messages(msgs)
+
+            for theme, theme_msgs, matched_count in self._theme_deliveries(msgs, themes):
+                if theme_name not in (None, theme.theme_name):
+                    continue
+
+                self.match_stats.track(MATCH_STATS_THEME, [theme.theme_name])
+                if matched_count:
+                    self.match_stats.add(MATCH_STATS_THEME, [theme.theme_name], matched_count)
+
+                if not theme_msgs:
+                    continue
+
+                logger.info(f"{LoggerTags.SCHEDULER.value} Theme {theme.theme_name}: {len(theme_msgs)} messages")
+                start = time.perf_counter()
+
+                if theme.delivery_mode == THEME_DELIVERY_DIGEST:
+                    await self._send_digest(theme, theme_msgs)
+                else:
+                    await self._send_messages(theme_msgs, theme.priority)
+
+                THEME_DELIVERIES.inc(theme.theme_name, len(theme_msgs))
+                THEME_DELIVERY_SECONDS.inc(theme.theme_name, time.perf_counter() - start)
         except Exception as e:
             logger.error(f"Error sending messages: {e}")
 
+    @staticmethod
+    def _theme_jobs(themes: List[ThemeDB]) -> Dict[str, Tuple[int, Optional[str]]]:
+        # id задачи -> аргументы задачи
+        if COALESCE_THEME_JOBS:
+            return {f"theme_interval_{theme.interval}": (theme.interval, None) for theme in themes}
+
+        return {theme.theme_name: (theme.interval, theme.theme_name) for theme in themes}
+
+    async def sync_theme_jobs(self):
+        """
+        Привести задачи в хранилище планировщика в соответствие с отслеживаемыми темами в бд
+        """
+        themes = [theme for theme in await self.db_manager.themes.all_themes() if theme.is_following]
+        jobs = self._theme_jobs(themes)
+
+        for job in self.scheduler.get_jobs(jobstore=THEMES_JOBSTORE):
+            if job.id not in jobs or tuple(job.args) != jobs[job.id]:
+                logger.info(f"{LoggerTags.SCHEDULER.value} Removing schedule {job.id}")
+                job.remove()
+
+        for job_id, args in jobs.items():
+            if self.scheduler.get_job(job_id, jobstore=THEMES_JOBSTORE) is not None:
+                continue
+
+            logger.info(f"{LoggerTags.SCHEDULER.value} Adding schedule {job_id} with interval {args[0]}")
+            self.scheduler.add_job(
+                theme_messages_job,
+                IntervalTrigger(seconds=args[0]),
+                args=list(args),
+                id=job_id,
+                jobstore=THEMES_JOBSTORE,
+                replace_existing=True
+            )
+
     async def add_new_theme_job(self, theme_name: str, interval: int):
         logger.info(f"{LoggerTags.SCHEDULER.value} Adding new schedule for theme {theme_name=}")
-        self.scheduler.add_job(self._send_messages_job, IntervalTrigger(seconds=interval), args=[interval],
-                               id=theme_name)
+        await self.sync_theme_jobs()
 
     async def remove_theme_job(self, theme_name: str):
         logger.info(f"{LoggerTags.SCHEDULER.value} Removing schedule for theme {theme_name=}")
-        self.scheduler.remove_job(theme_name)
+        await self.sync_theme_jobs()
 
     async def update_theme_job_interval(self, theme_name: str, new_interval: int):
         logger.info(
             f"{LoggerTags.SCHEDULER.value} Updating schedule for theme {theme_name=} with new interval {new_interval=}")
-        await self.remove_theme_job(theme_name)
-        await self.add_new_theme_job(theme_name, new_interval)
+        await self.sync_theme_jobs()
+
+
+@lru_cache(maxsize=None)
+def get_theme_scheduler() -> ThemeSchedulerManager:
+    """
+    Общий на процесс ThemeSchedulerManager (используется командами и задачами планировщика)
+    """
+    return ThemeSchedulerManager()
+
+
+async def theme_messages_job(interval: int, theme_name: Optional[str] = None):
+    """
+    Задача рассылки по темам. Функция уровня модуля, чтобы задачу можно было сохранить в хранилище планировщика
+    """
+    await get_theme_scheduler()._send_messages_job(interval, theme_name)
@@ -0,0 +1,31 @@
+from functools import lru_cache
+
+from loguru import logger
+
+from config import MEDIA_STORAGE, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY, S3_SECRET_KEY, \
+    S3_PART_SIZE
+from .backends import StorageBackend, LocalStorage, S3Storage
+from .paths import media_key, resolve_media_path, shard_parts
+from .migration import migrate_media_layout
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """
+    Хранилище файлов из MEDIA_STORAGE, одно на процесс
+    """
+    if MEDIA_STORAGE == 's3':
+        try:
+            return S3Storage(
+                bucket=S3_BUCKET,
+                prefix=S3_PREFIX,
+                endpoint_url=S3_ENDPOINT_URL,
+                region=S3_REGION,
+                access_key=S3_ACCESS_KEY,
+                secret_key=S3_SECRET_KEY,
+                part_size=S3_PART_SIZE
+            )
+        except ImportError:
+            logger.error("Пакет boto3 не установлен, файлы сохраняются локально")
+
+    return LocalStorage()
@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import hashlib
+import io
+from abc import ABCMeta, abstractmethod
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, Optional, Union
+
+from loguru import logger
+
+from config import LoggerTags
+from .paths import resolve_media_path
+
+# минимальный размер части multipart загрузки в S3 (кроме последней)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StorageBackend(metaclass=ABCMeta):
+    """
+    Хранилище файлов сообщений. Ключ файла - путь относительно корня хранилища из FilesModel.file_path
+    """
+    name = 'base'
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """
+        Путь файла на диске, если хранилище локальное, иначе None - файл сохраняется через save
+        """
+        return None
+
+    @abstractmethod
+    async def save(self, key: str, chunks: AsyncIterator[bytes]):
+        """
+        Записать файл потоком частей, без промежуточного файла на диске
+        """
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    async def sendable(self, key: str) -> Union[str, io.BytesIO]:
+        """
+        Файл в виде, который принимает client.send_file: путь или объект в памяти с именем
+        """
+
+
+class LocalStorage(StorageBackend):
+    """
+    Файлы в MEDIA_ROOT на диске бота
+    """
+    name = 'local'
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = resolve_media_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]):
+        path = self.local_path(key)
+
+        with open(path, 'wb') as f:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(resolve_media_path(key).exists)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(resolve_media_path(key).unlink, True)
+
+    async def sendable(self, key: str) -> Union[str, io.BytesIO]:
+        return str(resolve_media_path(key))
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-совместимое хранилище (AWS S3, MinIO). Нужен пакет boto3.
+    Файл загружается по мере скачивания из телеграм: части копятся в памяти до part_size
+    и отправляются через multipart upload, файлы меньше одной части - одним put_object
+    """
+    name = 's3'
+
+    def __init__(self,
+                 bucket: str,
+                 prefix: str = '',
+                 endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None,
+                 access_key: Optional[str] = None,
+                 secret_key: Optional[str] = None,
+                 part_size: int = 8 * 1024 * 1024):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.s3 = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None
+        )
+
+    def _object_key(self, key: str) -> str:
+        return str(PurePosixPath(self.prefix, key)) if self.prefix else key
+
+    @staticmethod
+    def _md5(data: bytes) -> str:
+        return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        # S3 сверяет ContentMD5 с полученными данными и отклоняет поврежденную часть
+        res = await asyncio.to_thread(
+            self.s3.upload_part,
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+            ContentMD5=self._md5(data)
+        )
+        return {'PartNumber': number, 'ETag': res['ETag']}
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]):
+        key = self._object_key(key)
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+
+                if len(buffer) < self.part_size:
+                    continue
+
+                if upload_id is None:
+                    res = await asyncio.to_thread(self.s3.create_multipart_upload, Bucket=self.bucket, Key=key)
+                    upload_id = res['UploadId']
+
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                buffer.clear()
+
+            if upload_id is None:
+                data = bytes(buffer)
+                await asyncio.to_thread(
+                    self.s3.put_object, Bucket=self.bucket, Key=key, Body=data, ContentMD5=self._md5(data)
+                )
+                return
+
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+
+            await asyncio.to_thread(
+                self.s3.complete_multipart_upload,
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            if upload_id is not None:
+                logger.warning(f"{LoggerTags.HANDLER.value} Abort upload of {key} after {len(parts)} parts")
+                await asyncio.to_thread(
+                    self.s3.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+            raise
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.s3.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+        return True
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.s3.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+
+    async def sendable(self, key: str) -> Union[str, io.BytesIO]:
+        res = await asyncio.to_thread(self.s3.get_object, Bucket=self.bucket, Key=self._object_key(key))
+        data = io.BytesIO(await asyncio.to_thread(res['Body'].read))
+        # по имени telethon определяет тип файла
+        data.name = PurePosixPath(key).name
+        return data
@@ -0,0 +1,84 @@
+import asyncio
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from config import LoggerTags, MEDIA_ROOT, LEGACY_UPLOAD_FOLDER
+from data.dataclasses import FileLocationDB
+from data.db_manager import DBManager
+from .paths import media_key, resolve_media_path, is_media_key
+
+# файл в MEDIA_ROOT, который появляется после переноса файлов в каталоги по хэшу
+MIGRATION_MARKER = '.sharded'
+
+
+def _candidates(location: FileLocationDB) -> List[Path]:
+    """
+    Где может лежать файл старой записи: по пути из бд, в старом каталоге или в плоском каталоге типа
+    """
+    return [
+        Path(location.file_path),
+        Path(f"{LEGACY_UPLOAD_FOLDER}/{location.file_type}/{location.file_name}"),
+        MEDIA_ROOT / location.file_type / location.file_name,
+    ]
+
+
+def _move(location: FileLocationDB) -> Optional[str]:
+    key = media_key(location.file_type, location.file_name)
+    target = resolve_media_path(key)
+
+    if target.exists():
+        return key
+
+    for source in _candidates(location):
+        if source.is_file():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(source, target)
+            return key
+
+    return None
+
+
+def _move_all(locations: List[FileLocationDB]) -> Tuple[Dict[int, str], int]:
+    paths = {}
+    missing = 0
+
+    for location in locations:
+        key = _move(location)
+
+        if key is None:
+            missing += 1
+            logger.warning(f"{LoggerTags.DATABASE.value} File {location.file_path} not found, path is kept")
+        else:
+            paths[location.id] = key
+
+    return paths, missing
+
+
+async def migrate_media_layout(db_manager: DBManager):
+    """
+    Однократно перенести файлы из старой схемы (os.getcwd() + "\\media" и плоские каталоги типов)
+    в каталоги по хэшу внутри MEDIA_ROOT и записать в бд относительные пути.
+    Повторный запуск после сбоя безопасен: уже перенесенные файлы только получают новый путь в бд
+    """
+    marker = MEDIA_ROOT / MIGRATION_MARKER
+
+    if marker.exists():
+        return
+
+    locations = [
+        el for el in await db_manager.files.file_locations()
+        if not is_media_key(el.file_path, el.file_type, el.file_name)
+    ]
+
+    if locations:
+        logger.info(f"{LoggerTags.DATABASE.value} Migrating {len(locations)} files to {MEDIA_ROOT}")
+
+        paths, missing = await asyncio.to_thread(_move_all, locations)
+        await db_manager.files.update_file_paths(paths)
+
+        logger.success(f"{LoggerTags.DATABASE.value} Migrated {len(paths)} files, {missing} not found")
+
+    marker.touch()
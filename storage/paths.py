@@ -0,0 +1,34 @@
+import hashlib
+from pathlib import Path, PurePosixPath, PureWindowsPath
+
+from config import MEDIA_ROOT, MEDIA_SHARD_DEPTH
+
+
+def shard_parts(file_name: str, depth: int = MEDIA_SHARD_DEPTH) -> list[str]:
+    """
+    Подкаталоги файла: по два символа хэша имени на уровень, например ['3f', 'a9']
+    """
+    digest = hashlib.sha1(file_name.encode('utf8')).hexdigest()
+    return [digest[i * 2:i * 2 + 2] for i in range(depth)]
+
+
+def media_key(file_type: str, file_name: str) -> str:
+    """
+    Путь файла относительно MEDIA_ROOT, который хранится в бд (всегда через "/", не зависит от ОС и корня)
+    """
+    return str(PurePosixPath(file_type, *shard_parts(file_name), file_name))
+
+
+def resolve_media_path(key: str) -> Path:
+    """
+    Локальный путь файла по значению из бд.
+    Абсолютные пути (записи, еще не перенесенные в новую схему) возвращаются как есть
+    """
+    if Path(key).is_absolute() or PureWindowsPath(key).is_absolute():
+        return Path(key)
+
+    return MEDIA_ROOT.joinpath(*PurePosixPath(key).parts)
+
+
+def is_media_key(key: str, file_type: str, file_name: str) -> bool:
+    return key == media_key(file_type, file_name)
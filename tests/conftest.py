@@ -0,0 +1,24 @@
+"""
+Окружение тестов: конфиг читается при импорте модулей проекта, поэтому переменные задаются до импорта,
+а бд, медиа и логи создаются во временной папке
+"""
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='telethon_tests_')
+
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'tests')
+os.environ['SQLITE_DATABASE_PATH'] = os.path.join(WORKDIR, 'tests.db')
+os.environ['SCHEDULER_JOBSTORE_URL'] = 'sqlite://'
+os.environ['METRICS_PORT'] = '0'
+os.environ['SEND_DELAY_SECONDS'] = '0'
+os.environ['MEDIA_STORAGE'] = 'local'
+os.environ['MEDIA_ROOT'] = os.path.join(WORKDIR, 'media')
+os.environ['RECORD_MESSAGES_FILENAME'] = ''
+os.environ['TRACING_EXPORTER'] = 'none'
+
+sys.path.insert(0, PROJECT_ROOT)
+os.chdir(WORKDIR)
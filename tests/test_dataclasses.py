@@ -0,0 +1,16 @@
+import datetime
+
+import pytest
+
+from data.dataclasses import ListeningChatsDB, MessageDB
+
+
+def test_slotted_dto_have_no_dict():
+    chat = ListeningChatsDB(chat_id='1', id=1)
+    message = MessageDB(chat_id='1', message_id='10', message='text', date=datetime.datetime(2024, 1, 1))
+
+    for dto in (chat, message):
+        assert not hasattr(dto, '__dict__')
+
+        with pytest.raises((AttributeError, TypeError)):
+            dto.extra = 1
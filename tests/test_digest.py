@@ -0,0 +1,74 @@
+import datetime
+
+from data.dataclasses import DeliveryMessageDB, DialogDB, FileDB
+from scheduler_manager import digest
+from scheduler_manager.digest import group_entries, media_groups, message_link, render_digest, snippet
+
+DATE = datetime.datetime(2024, 1, 1, 9, 30, tzinfo=datetime.timezone.utc)
+
+
+def _file(message_id: str, document_id: str, file_type: str = 'photo') -> FileDB:
+    return FileDB(chat_id='-1001', document_id=document_id, file_name=document_id, file_path=document_id,
+                  file_type=file_type, message_id=message_id)
+
+
+def _message(pk: int, text: str = '', grouped_id=None, links=None, files=(), chat_id='-1001') -> DeliveryMessageDB:
+    return DeliveryMessageDB(chat_id=chat_id, id=pk, message_id=str(pk * 10), message=text, date=DATE,
+                             grouped_id=grouped_id, links=links, files=tuple(files))
+
+
+def test_album_parts_are_one_entry():
+    entries = group_entries([
+        _message(1, files=[_file('10', 'a')], grouped_id=7, links='https://a'),
+        _message(2, 'одиночное'),
+        _message(3, 'подпись альбома', files=[_file('30', 'b')], grouped_id=7, links='https://a,https://b'),
+        _message(4, 'другой чат', grouped_id=7, chat_id='-1002'),
+    ])
+
+    assert [(el.chat_id, el.message_id) for el in entries] == [('-1001', '10'), ('-1001', '20'), ('-1002', '40')]
+    assert entries[0].text == 'подпись альбома'
+    assert entries[0].links == ('https://a', 'https://b')
+    assert [el.document_id for el in entries[0].files] == ['a', 'b']
+
+
+def test_messages_without_album_stay_separate():
+    entries = group_entries([_message(1, 'первое'), _message(2, 'второе')])
+
+    assert [el.text for el in entries] == ['первое', 'второе']
+
+
+def test_digest_is_split_by_length(monkeypatch):
+    monkeypatch.setattr(digest, 'DIGEST_MAX_LENGTH', 300)
+    entries = group_entries([_message(i, 'слово ' * 20) for i in range(1, 6)])
+
+    chunks = render_digest('новости <важное>', entries, {})
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert all(chunk.startswith('<b>Дайджест: новости &lt;важное&gt;</b> (5)') for chunk in chunks)
+    assert sum(chunk.count('t.me/c/1/') for chunk in chunks) == 5
+
+
+def test_media_groups_keep_albums_and_split_singles_by_type():
+    entries = group_entries([
+        _message(1, files=[_file('10', 'a'), _file('10', 'b')], grouped_id=7),
+        _message(2, files=[_file('20', 'c')]),
+        _message(3, files=[_file('30', 'd', 'document')]),
+        *[_message(i, files=[_file(str(i), f'p{i}')]) for i in range(4, 15)],
+    ])
+
+    groups = [[el.document_id for el in group] for group in media_groups(entries)]
+
+    assert groups[0] == ['a', 'b']
+    assert ['d'] in groups
+    assert all(len(group) <= digest.MEDIA_GROUP_SIZE for group in groups)
+    assert sorted(sum(groups, [])) == sorted(['a', 'b', 'c', 'd'] + [f'p{i}' for i in range(4, 15)])
+
+
+def test_message_link_and_snippet():
+    dialog = DialogDB(chat_id='-1001', title='Канал', is_channel=True, username='channel')
+
+    assert message_link('-1001', '5', dialog) == 'https://t.me/channel/5'
+    assert message_link('-1001', '5', None) == 'https://t.me/c/1/5'
+    assert snippet('раз   два\nтри', length=100) == 'раз два три'
+    assert snippet('раз два три', length=6) == 'раз…'
@@ -0,0 +1,133 @@
+import asyncio
+
+from commands.dispatcher import CommandDispatcher, CommandOptions
+
+
+class FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+    def to_dict(self):
+        return {'message': self.text}
+
+    async def edit(self, text: str):
+        pass
+
+
+class FakeEvent:
+    def __init__(self, text: str):
+        self.message = FakeMessage(text)
+        self.replies = []
+
+    async def reply(self, text: str):
+        self.replies.append(text)
+        return FakeMessage(text)
+
+
+def _dispatcher(release: asyncio.Event, done: list) -> CommandDispatcher:
+    async def slow(event):
+        await release.wait()
+        done.append(event.message.text)
+
+    async def fast(event):
+        done.append(event.message.text)
+
+    handlers = {'/import': slow, '/addKeyword': fast, '/addChat': fast, '/search': fast}
+    options = {
+        '/import': CommandOptions(concurrency=1, background=True, resources=('keywords',)),
+        '/addKeyword': CommandOptions(concurrency=1, resources=('keywords',)),
+        '/addChat': CommandOptions(concurrency=1, resources=('chats',)),
+        '/search': CommandOptions(concurrency=1),
+    }
+    return CommandDispatcher(handlers, options)
+
+
+async def _wait_for(condition, timeout: float = 1):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(wait(), timeout)
+
+
+def test_other_resources_are_not_blocked_by_long_mutation():
+    async def run():
+        release, done = asyncio.Event(), []
+        dispatcher = _dispatcher(release, done)
+        dispatcher.start()
+
+        for text in ('/import', '/addKeyword', '/addChat', '/search'):
+            await dispatcher.submit(FakeEvent(text))
+
+        await _wait_for(lambda: {'/addChat', '/search'} <= set(done))
+        assert '/addKeyword' not in done
+
+        release.set()
+        await _wait_for(lambda: len(done) == 4)
+        await dispatcher.stop()
+
+        return done
+
+    done = asyncio.run(run())
+
+    assert done.index('/import') < done.index('/addKeyword')
+
+
+def test_waiting_for_lock_does_not_hold_workers(monkeypatch):
+    monkeypatch.setattr('commands.dispatcher.COMMAND_WORKERS', 1)
+
+    async def run():
+        release, done = asyncio.Event(), []
+        dispatcher = _dispatcher(release, done)
+        dispatcher.start()
+
+        for text in ('/import', '/addKeyword', '/search'):
+            await dispatcher.submit(FakeEvent(text))
+
+        await _wait_for(lambda: '/search' in done)
+        release.set()
+        await _wait_for(lambda: len(done) == 3)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+
+def test_detached_commands_count_against_queue_size(monkeypatch):
+    monkeypatch.setattr('commands.dispatcher.COMMAND_QUEUE_SIZE', 2)
+
+    async def run():
+        release, done = asyncio.Event(), []
+        dispatcher = _dispatcher(release, done)
+        dispatcher.start()
+
+        events = [FakeEvent(text) for text in ('/import', '/addKeyword', '/addKeyword')]
+        for event in events:
+            await dispatcher.submit(event)
+            await asyncio.sleep(0.01)
+
+        rejected = events[-1].replies
+        release.set()
+        await _wait_for(lambda: len(done) == 2)
+        await dispatcher.stop()
+
+        return rejected
+
+    assert asyncio.run(run()) == ["Сейчас выполняется слишком много команд, **повторите позже**"]
+
+
+def test_background_command_runs_when_progress_reply_fails():
+    class FailingEvent(FakeEvent):
+        async def reply(self, text: str):
+            raise ConnectionError('reply failed')
+
+    async def run():
+        release, done = asyncio.Event(), []
+        release.set()
+        dispatcher = _dispatcher(release, done)
+        dispatcher.start()
+
+        await dispatcher.submit(FailingEvent('/import'))
+        await _wait_for(lambda: done == ['/import'])
+        await dispatcher.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+
+from chats.chats_handlers import ChatsHandler
+from chats.downloader import PART_SIZE, DownloadJournal, MediaDownloader
+from data.dataclasses import FileDB
+
+DATA = bytes(range(256)) * (PART_SIZE // 256) + b'tail'
+
+
+class FakeClient:
+    def __init__(self, flood_waits: int = 0):
+        self.flood_waits = flood_waits
+        self.offsets = []
+
+    async def iter_download(self, document, offset: int, request_size: int, limit: int, file_size: int):
+        if self.flood_waits:
+            self.flood_waits -= 1
+            raise FloodWaitError(request=None, capture=0)
+
+        self.offsets.append(offset)
+        yield DATA[offset:offset + request_size]
+
+
+def _document():
+    return SimpleNamespace(id=1, size=len(DATA))
+
+
+def test_flood_wait_does_not_use_retries(monkeypatch):
+    monkeypatch.setattr('chats.downloader.DOWNLOAD_PART_RETRIES', 1)
+    downloader = MediaDownloader(FakeClient(flood_waits=2), storage=None)
+
+    assert asyncio.run(downloader._fetch_part(_document(), 1)) == b'tail'
+
+
+def test_download_resumes_from_journal(tmp_path):
+    file_path = str(tmp_path / 'doc.bin')
+    with open(f"{file_path}.part", 'wb') as f:
+        f.write(DATA[:PART_SIZE])
+    journal = DownloadJournal(f"{file_path}.part.journal", 1, len(DATA))
+    journal.create()
+    journal.append(0)
+
+    client = FakeClient()
+    asyncio.run(MediaDownloader(client, storage=None).download_document(_document(), file_path))
+
+    assert client.offsets == [PART_SIZE]
+    assert (tmp_path / 'doc.bin').read_bytes() == DATA
+    assert not (tmp_path / 'doc.bin.part.journal').exists()
+
+
+def _file(message_id: str) -> FileDB:
+    return FileDB(document_id=f'd{message_id}', file_name='a', file_path='a', file_type='document',
+                  message_id=message_id, chat_id='1', is_downloaded=False)
+
+
+def test_retry_pending_downloads():
+    downloaded, removed = [], []
+
+    async def pending_files(limit):
+        return [_file('10'), _file('11'), _file('12')]
+
+    async def set_downloaded(document_id):
+        downloaded.append(document_id)
+
+    async def remove_file(document_id):
+        removed.append(document_id)
+
+    async def get_dialog(chat_id):
+        return None
+
+    async def get_messages(peer, ids):
+        return [SimpleNamespace(id=10, media=object()), None, SimpleNamespace(id=12, media=object())]
+
+    async def download(message, key):
+        if message.id == 12:
+            raise ConnectionError('connection lost')
+
+    handler = ChatsHandler.__new__(ChatsHandler)
+    handler.db_manager = SimpleNamespace(
+        files=SimpleNamespace(pending_files=pending_files, set_downloaded=set_downloaded, remove_file=remove_file),
+        dialogs=SimpleNamespace(get_dialog=get_dialog)
+    )
+    handler.client = SimpleNamespace(get_messages=get_messages)
+    handler.downloader = SimpleNamespace(download=download)
+
+    asyncio.run(handler.retry_pending_downloads())
+
+    assert downloaded == ['d10']
+    assert removed == ['d11']
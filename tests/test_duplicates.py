@@ -0,0 +1,70 @@
+import datetime
+
+from messages.duplicates import DuplicateDetector, fingerprint_from_str, fingerprint_to_str, hamming_distance
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+TEXT = "Срочно: в центре города открылся новый большой парк для жителей и гостей"
+
+
+def _detector() -> DuplicateDetector:
+    return DuplicateDetector(window_seconds=3600, max_distance=3, min_words=5)
+
+
+def test_short_text_has_no_fingerprint():
+    detector = _detector()
+
+    assert detector.fingerprint("две строки") is None
+    assert detector.fingerprint("") is None
+
+
+def test_repost_is_found():
+    detector = _detector()
+    detector.remember(detector.fingerprint(TEXT), 1, NOW)
+
+    assert detector.find_original(detector.fingerprint(TEXT + "!"), NOW + datetime.timedelta(minutes=5)) == 1
+
+
+def test_different_text_is_not_a_duplicate():
+    detector = _detector()
+    detector.remember(detector.fingerprint(TEXT), 1, NOW)
+
+    other = detector.fingerprint("Погода на выходные: дожди, ветер и похолодание во всех районах области")
+    assert detector.find_original(other, NOW) is None
+
+
+def test_message_outside_window_is_not_a_duplicate():
+    detector = _detector()
+    detector.remember(detector.fingerprint(TEXT), 1, NOW)
+
+    assert detector.find_original(detector.fingerprint(TEXT), NOW - datetime.timedelta(hours=2)) is None
+
+
+def test_old_messages_are_evicted_by_date():
+    detector = _detector()
+    fingerprint = detector.fingerprint(TEXT)
+
+    # новое сообщение запомнено раньше старого - порядок добавления не совпадает с порядком дат
+    detector.remember(fingerprint, 2, NOW)
+    detector.remember(fingerprint ^ 1, 1, NOW - datetime.timedelta(minutes=30))
+    detector.remember(fingerprint ^ 2, 3, NOW + datetime.timedelta(minutes=45))
+
+    assert set(detector.by_pk) == {2, 3}
+    assert all(pk in detector.by_pk for _, pk in detector.dates)
+
+
+def test_history_older_than_window_is_not_indexed():
+    detector = _detector()
+    fingerprint = detector.fingerprint(TEXT)
+
+    detector.remember(fingerprint, 1, NOW)
+    detector.remember(fingerprint, 2, NOW - datetime.timedelta(days=1))
+
+    assert set(detector.by_pk) == {1}
+    assert detector.dates == [(NOW, 1)]
+
+
+def test_fingerprint_str_round_trip():
+    fingerprint = _detector().fingerprint(TEXT)
+
+    assert fingerprint_from_str(fingerprint_to_str(fingerprint)) == fingerprint
+    assert hamming_distance(fingerprint, fingerprint) == 0
@@ -0,0 +1,29 @@
+import asyncio
+
+from commands import exports
+from commands.exports import export_file
+
+
+async def _export(items, separator: str = '\n') -> str:
+    async with export_file('out.txt', items, separator) as path:
+        with open(path, encoding='utf8') as f:
+            return f.read()
+
+
+def test_list_and_async_iterator_give_same_file(monkeypatch):
+    monkeypatch.setattr(exports, 'EXPORT_CHUNK_SIZE', 3)
+    lines = [f'чат {i}' for i in range(10)]
+
+    async def stream():
+        for line in lines:
+            yield line
+
+    assert asyncio.run(_export(stream(), '-')) == asyncio.run(_export(lines, '-')) == '-'.join(lines)
+
+
+def test_empty_async_iterator_gives_empty_file():
+    async def stream():
+        return
+        yield
+
+    assert asyncio.run(_export(stream())) == ''
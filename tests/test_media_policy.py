@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telethon import types
+
+from chats.media_policy import MediaDecision, MediaPolicy
+from config import MEDIA_MODE_ALL, MEDIA_MODE_MATCH, MEDIA_MODE_NONE, MEDIA_MODE_THUMB
+from data.dataclasses import MediaRuleDB
+from keywords import KeywordsHandler
+
+MB = 1024 * 1024
+
+
+class FakeRules:
+    def __init__(self, rules):
+        self.rules = rules
+
+    async def all_rules(self):
+        return self.rules
+
+
+class FakeKeywords:
+    contains_keywords = KeywordsHandler.contains_keywords
+    matched_keywords = KeywordsHandler.matched_keywords
+
+    async def get_theme_keywords(self):
+        return {'парк'}
+
+
+def _policy(*rules: MediaRuleDB) -> MediaPolicy:
+    return MediaPolicy(SimpleNamespace(media_rules=FakeRules(list(rules))), FakeKeywords())
+
+
+def _message(text: str = '', media=None, mime_type: str = 'image/jpeg', size: int = MB, grouped_id=None):
+    media = media if media is not None else types.MessageMediaPhoto()
+    return SimpleNamespace(id=1, text=text, media=media, grouped_id=grouped_id,
+                           file=SimpleNamespace(mime_type=mime_type, size=size))
+
+
+def _decide(policy: MediaPolicy, message, chat_id: str = '1') -> MediaDecision:
+    return asyncio.run(policy.decide(message, chat_id))
+
+
+@pytest.mark.parametrize('mode, text, size, expected', [
+    (MEDIA_MODE_NONE, 'парк', MB, MediaDecision.SKIP),
+    (MEDIA_MODE_ALL, '', MB, MediaDecision.FULL),
+    (MEDIA_MODE_ALL, '', 100 * MB, MediaDecision.THUMB),
+    (MEDIA_MODE_MATCH, 'новый парк', MB, MediaDecision.FULL),
+    (MEDIA_MODE_MATCH, 'новый парк', 100 * MB, MediaDecision.THUMB),
+    (MEDIA_MODE_MATCH, 'погода', MB, MediaDecision.SKIP),
+    (MEDIA_MODE_THUMB, 'новый парк', MB, MediaDecision.THUMB),
+])
+def test_decision_by_mode(mode, text, size, expected):
+    policy = _policy(MediaRuleDB(chat_id='1', mode=mode, max_size=50 * MB))
+
+    assert _decide(policy, _message(text, size=size)) == expected
+
+
+def test_message_without_file_is_skipped():
+    policy = _policy(MediaRuleDB(chat_id='1', mode=MEDIA_MODE_ALL))
+
+    assert _decide(policy, _message(media=types.MessageMediaWebPage(webpage=types.WebPageEmpty(id=1)))) \
+        == MediaDecision.SKIP
+
+
+def test_types_and_mime_types_filter():
+    policy = _policy(MediaRuleDB(chat_id='1', mode=MEDIA_MODE_ALL, types=('document',), mime_types=('application/pdf',)))
+
+    assert _decide(policy, _message()) == MediaDecision.SKIP
+    assert _decide(policy, _message(media=types.MessageMediaDocument(), mime_type='video/mp4')) == MediaDecision.SKIP
+    assert _decide(policy, _message(media=types.MessageMediaDocument(), mime_type='application/pdf')) \
+        == MediaDecision.FULL
+
+
+def test_album_parts_follow_caption():
+    policy = _policy(MediaRuleDB(chat_id='1', mode=MEDIA_MODE_MATCH))
+
+    assert _decide(policy, _message('парк', grouped_id=7)) == MediaDecision.FULL
+    assert _decide(policy, _message('', grouped_id=7)) == MediaDecision.FULL
+    assert _decide(policy, _message('', grouped_id=8)) == MediaDecision.SKIP
+
+
+def test_chat_without_rule_uses_default(monkeypatch):
+    monkeypatch.setattr('chats.media_policy.MEDIA_DOWNLOAD_MODE', MEDIA_MODE_NONE)
+    policy = _policy(MediaRuleDB(chat_id='2', mode=MEDIA_MODE_ALL))
+
+    assert _decide(policy, _message('парк'), chat_id='1') == MediaDecision.SKIP
+    assert _decide(policy, _message('парк'), chat_id='2') == MediaDecision.FULL
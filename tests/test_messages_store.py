@@ -0,0 +1,68 @@
+import asyncio
+import datetime
+
+from config import engine
+from data import Base
+from data.dataclasses import FileDB, MessageDB
+from data.db_manager import FilesDataManager, MessagesDataManager
+
+DATE = datetime.datetime(2024, 1, 1)
+
+
+def _message(message_id: str, text: str = 'text') -> MessageDB:
+    return MessageDB(chat_id='1', message_id=message_id, message=text, date=DATE)
+
+
+async def _store(coro_factory):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.exec_driver_sql("DROP TABLE IF EXISTS messages_fts")
+
+    messages = MessagesDataManager()
+    await messages.create_search_index()
+
+    try:
+        return await coro_factory(messages)
+    finally:
+        await engine.dispose()
+
+
+def test_add_message_skips_stored():
+    async def run(messages: MessagesDataManager):
+        first = await messages.add_message(_message('10'))
+        second = await messages.add_message(_message('10'))
+        found = await messages.search_messages('text', limit=10)
+        return first, second, [el.id for el in found]
+
+    first, second, found = asyncio.run(_store(run))
+
+    assert first is not None
+    assert second is None
+    assert found == [first]
+
+
+def test_add_messages_skips_stored_and_repeated():
+    async def run(messages: MessagesDataManager):
+        stored = await messages.add_message(_message('10'))
+        pks = await messages.add_messages(
+            [_message('10'), _message('11'), _message('11'), _message('12')],
+            [FileDB(document_id='d1', file_name='a', file_path='a', file_type='photo', message_id='11', chat_id='1')]
+        )
+        return stored, pks
+
+    stored, pks = asyncio.run(_store(run))
+
+    assert pks[0] is None and pks[2] is None
+    assert len({stored, pks[1], pks[3]}) == 3
+
+
+def test_add_file_skips_stored():
+    async def run(messages: MessagesDataManager):
+        files = FilesDataManager()
+        file = FileDB(document_id='d1', file_name='a', file_path='a', file_type='photo', message_id='10', chat_id='1')
+        await files.add_file(file)
+        await files.add_file(file)
+        return await files.all_files()
+
+    assert len(asyncio.run(_store(run))) == 1
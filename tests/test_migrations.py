@@ -0,0 +1,174 @@
+import asyncio
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from data import Base
+from data.migrations import COLUMN_MIGRATIONS, INDEX_MIGRATIONS, migrate_schema
+
+# таблицы в том виде, в котором их создавала первая версия
+BASELINE_SCHEMA = (
+    "CREATE TABLE messages (id INTEGER NOT NULL PRIMARY KEY, chat_id VARCHAR NOT NULL, "
+    "message_id VARCHAR NOT NULL, message VARCHAR NOT NULL, grouped_id INTEGER, date DATETIME NOT NULL, "
+    "links VARCHAR)",
+    "CREATE TABLE themes (id INTEGER NOT NULL PRIMARY KEY, theme_name VARCHAR NOT NULL UNIQUE, "
+    "is_following BOOLEAN NOT NULL, interval INTEGER NOT NULL)",
+    "CREATE TABLE files (id INTEGER NOT NULL PRIMARY KEY, document_id VARCHAR NOT NULL UNIQUE, "
+    "file_name VARCHAR NOT NULL, file_path VARCHAR NOT NULL, file_type VARCHAR NOT NULL, "
+    "message_id VARCHAR NOT NULL, chat_id VARCHAR NOT NULL, original_filename VARCHAR)",
+    "INSERT INTO messages (chat_id, message_id, message, date) VALUES ('1', '10', 'text', '2024-01-01 00:00:00')",
+    "INSERT INTO files (document_id, file_name, file_path, file_type, message_id, chat_id) "
+    "VALUES ('d1', 'a.jpg', 'photo/a.jpg', 'photo', '10', '1')",
+    "INSERT INTO themes (theme_name, is_following, interval) VALUES ('news', 1, 60)",
+)
+
+
+def _columns(sync_conn, table: str) -> set:
+    return {el['name'] for el in inspect(sync_conn).get_columns(table)}
+
+
+async def _migrate_baseline(path: str, times: int = 1) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    try:
+        async with engine.begin() as conn:
+            for statement in BASELINE_SCHEMA:
+                await conn.execute(text(statement))
+
+        for _ in range(times):
+            await migrate_schema(engine)
+
+        async with engine.connect() as conn:
+            return {table: await conn.run_sync(_columns, table) for table in ('messages', 'themes', 'files')}
+    finally:
+        await engine.dispose()
+
+
+def test_adds_missing_columns(tmp_path):
+    columns = asyncio.run(_migrate_baseline(str(tmp_path / 'old.db')))
+
+    for migration in COLUMN_MIGRATIONS:
+        assert migration.column in columns[migration.table]
+
+
+def test_is_idempotent(tmp_path):
+    columns = asyncio.run(_migrate_baseline(str(tmp_path / 'old.db'), times=2))
+
+    assert 'fingerprint' in columns['messages']
+
+
+async def _fetch(path: str, query: str) -> list:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(text(query))).scalars().all()
+    finally:
+        await engine.dispose()
+
+
+def test_backfills_received_at(tmp_path):
+    path = str(tmp_path / 'old.db')
+    asyncio.run(_migrate_baseline(path))
+
+    assert asyncio.run(_fetch(path, "SELECT received_at FROM messages")) == ['2024-01-01 00:00:00']
+
+
+def test_stored_files_are_downloaded(tmp_path):
+    path = str(tmp_path / 'old.db')
+    asyncio.run(_migrate_baseline(path))
+
+    assert asyncio.run(_fetch(path, "SELECT is_downloaded FROM files")) == [1]
+
+
+def test_existing_themes_keep_message_delivery(tmp_path):
+    path = str(tmp_path / 'old.db')
+    asyncio.run(_migrate_baseline(path))
+
+    assert asyncio.run(_fetch(path, "SELECT delivery_mode FROM themes")) == ['messages']
+
+
+def test_old_tables_match_models(tmp_path):
+    columns = asyncio.run(_migrate_baseline(str(tmp_path / 'old.db')))
+
+    for table, existing in columns.items():
+        assert {el.name for el in Base.metadata.tables[table].columns} <= existing
+
+
+def test_existing_themes_get_normal_priority(tmp_path):
+    path = str(tmp_path / 'old.db')
+    asyncio.run(_migrate_baseline(path))
+
+    assert asyncio.run(_fetch(path, "SELECT priority FROM themes")) == ['normal']
+
+
+async def _migrate_duplicates(path: str) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    try:
+        async with engine.begin() as conn:
+            for statement in BASELINE_SCHEMA:
+                await conn.execute(text(statement))
+
+        await migrate_schema(engine, indexes=[])
+
+        # копии сообщения 10 и сообщение, отмеченное дубликатом второй копии
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO messages (chat_id, message_id, message, date) VALUES "
+                "('1', '10', 'text', '2024-01-01 00:00:00'), ('1', '10', 'text', '2024-01-01 00:00:00')"
+            ))
+            await conn.execute(text(
+                "INSERT INTO messages (chat_id, message_id, message, date, duplicate_of) "
+                "VALUES ('2', '5', 'text', '2024-01-01 00:01:00', 3)"
+            ))
+            await conn.execute(text(
+                "CREATE VIRTUAL TABLE messages_fts USING fts5(message, content='messages', content_rowid='id')"
+            ))
+            await conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+        await migrate_schema(engine)
+        await migrate_schema(engine)
+
+        async with engine.connect() as conn:
+            return {
+                'messages': (await conn.execute(
+                    text("SELECT id, message_id, duplicate_of FROM messages ORDER BY id")
+                )).all(),
+                'search': (await conn.execute(
+                    text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'text' ORDER BY rowid")
+                )).scalars().all(),
+            }
+    finally:
+        await engine.dispose()
+
+
+def test_unique_messages_remove_copies(tmp_path):
+    result = asyncio.run(_migrate_duplicates(str(tmp_path / 'old.db')))
+
+    assert [tuple(row) for row in result['messages']] == [(1, '10', None), (4, '5', 1)]
+    assert result['search'] == [1, 4]
+
+
+async def _model_indexes(path: str) -> set:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        await migrate_schema(engine)
+
+        async with engine.connect() as conn:
+            return await conn.run_sync(
+                lambda sync_conn: {el['name'] for el in inspect(sync_conn).get_unique_constraints('messages')}
+                | {el['name'] for el in inspect(sync_conn).get_indexes('messages')}
+            )
+    finally:
+        await engine.dispose()
+
+
+def test_new_database_has_model_indexes(tmp_path):
+    names = asyncio.run(_model_indexes(str(tmp_path / 'new.db')))
+
+    assert {el.name for el in INDEX_MIGRATIONS} <= names
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from outbound import scheduler as outbound_scheduler
+from outbound.scheduler import OutboundScheduler
+
+LANES = ('urgent', 'normal', 'bulk')
+
+
+def _flood_wait(seconds: int) -> FloodWaitError:
+    return FloodWaitError(request=None, capture=seconds)
+
+
+def test_back_off_pauses_lane_and_lower_lanes(monkeypatch):
+    monkeypatch.setattr(outbound_scheduler.time, 'monotonic', lambda: 100.0)
+    monkeypatch.setattr(outbound_scheduler, 'OUTBOUND_BACKOFF_FACTOR', 2)
+
+    async def run():
+        scheduler = OutboundScheduler(LANES, send_delay=0)
+        scheduler._back_off('normal', 10)
+        return scheduler.paused_until
+
+    assert asyncio.run(run()) == {'urgent': 0.0, 'normal': 110.0, 'bulk': 120.0}
+
+
+def test_higher_lane_is_sent_first():
+    async def run():
+        scheduler = OutboundScheduler(LANES, send_delay=0)
+        sent = []
+
+        def job(name):
+            async def send():
+                sent.append(name)
+            return send
+
+        await asyncio.gather(
+            scheduler.send('bulk', job('bulk')),
+            scheduler.send('normal', job('normal')),
+            scheduler.send('urgent', job('urgent')),
+        )
+        scheduler.worker.cancel()
+        return sent
+
+    assert asyncio.run(run()) == ['urgent', 'normal', 'bulk']
+
+
+def test_flood_wait_pauses_only_its_lane():
+    async def run():
+        scheduler = OutboundScheduler(LANES, send_delay=0)
+        sent = []
+        attempts = 0
+
+        async def normal():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise _flood_wait(1)
+            sent.append('normal')
+            return 'done'
+
+        async def urgent():
+            sent.append('urgent')
+
+        normal_task = asyncio.create_task(scheduler.send('normal', normal))
+        await asyncio.sleep(0.05)
+
+        assert scheduler.paused_until['normal'] > scheduler.paused_until['urgent']
+        await scheduler.send('urgent', urgent)
+
+        result = await normal_task
+        scheduler.worker.cancel()
+        return sent, attempts, result
+
+    assert asyncio.run(run()) == (['urgent', 'normal'], 2, 'done')
+
+
+def test_flood_wait_after_retries_is_raised(monkeypatch):
+    monkeypatch.setattr(outbound_scheduler, 'OUTBOUND_MAX_RETRIES', 0)
+
+    async def run():
+        scheduler = OutboundScheduler(LANES, send_delay=0)
+
+        async def send():
+            raise _flood_wait(30)
+
+        try:
+            await scheduler.send('bulk', send)
+        finally:
+            scheduler.worker.cancel()
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(run())
+
+
+def test_unknown_lane_goes_to_lowest():
+    async def run():
+        return OutboundScheduler(LANES, send_delay=0).lane('fast')
+
+    assert asyncio.run(run()) == 'bulk'
@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+
+from config import MEDIA_ROOT
+from data.dataclasses import FileLocationDB
+from storage.backends import LocalStorage
+from storage.migration import _move
+from storage.paths import is_media_key, media_key, resolve_media_path, shard_parts
+
+
+def test_shards_are_hash_prefixes():
+    digest = hashlib.sha1('photo.jpg'.encode('utf8')).hexdigest()
+
+    assert shard_parts('photo.jpg', depth=2) == [digest[:2], digest[2:4]]
+    assert shard_parts('photo.jpg', depth=0) == []
+
+
+def test_media_key_is_relative_posix_path():
+    key = media_key('photo', 'photo.jpg')
+
+    assert key == '/'.join(['photo', *shard_parts('photo.jpg'), 'photo.jpg'])
+    assert is_media_key(key, 'photo', 'photo.jpg')
+    assert not is_media_key('/old/media/photo/photo.jpg', 'photo', 'photo.jpg')
+
+
+def test_resolve_relative_and_legacy_absolute_paths(tmp_path):
+    key = media_key('document', 'report.pdf')
+
+    assert resolve_media_path(key) == MEDIA_ROOT.joinpath(*key.split('/'))
+    assert resolve_media_path(str(tmp_path / 'report.pdf')) == tmp_path / 'report.pdf'
+
+
+def test_flat_file_is_moved_to_shards():
+    source = MEDIA_ROOT / 'photo' / 'flat-move.jpg'
+    source.parent.mkdir(parents=True, exist_ok=True)
+    source.write_bytes(b'data')
+
+    key = _move(FileLocationDB(id=1, file_type='photo', file_name='flat-move.jpg', file_path=str(source)))
+
+    assert key == media_key('photo', 'flat-move.jpg')
+    assert not source.exists()
+    assert resolve_media_path(key).read_bytes() == b'data'
+
+
+def test_missing_file_keeps_path():
+    location = FileLocationDB(id=1, file_type='photo', file_name='missing.jpg', file_path='/nowhere/missing.jpg')
+
+    assert _move(location) is None
+
+
+def test_local_storage_round_trip():
+    storage = LocalStorage()
+    key = media_key('document', 'round-trip.txt')
+
+    async def chunks():
+        yield b'first '
+        yield b'second'
+
+    async def run():
+        await storage.save(key, chunks())
+        saved = await storage.exists(key)
+        content = resolve_media_path(key).read_bytes()
+        await storage.delete(key)
+        return saved, content, await storage.exists(key)
+
+    assert asyncio.run(run()) == (True, b'first second', False)
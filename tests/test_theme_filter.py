@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+from data.dataclasses import DeliveryMessageDB, KeywordsDB, ThemeDB
+from scheduler_manager import manager
+from scheduler_manager.manager import ThemeSchedulerManager
+
+DATE = datetime.datetime(2024, 1, 1)
+
+
+def _theme(name: str, interval: int, *words: str, delivery_mode: str = 'messages') -> ThemeDB:
+    return ThemeDB(id=1, theme_name=name, is_following=True, interval=interval,
+                   keywords=[KeywordsDB(id=i, word=word) for i, word in enumerate(words)],
+                   delivery_mode=delivery_mode)
+
+
+def _message(pk: int, text: str, grouped_id=None, chat_id='-1001') -> DeliveryMessageDB:
+    return DeliveryMessageDB(chat_id=chat_id, id=pk, message_id=str(pk), message=text, date=DATE,
+                             grouped_id=grouped_id)
+
+
+def test_matches_whole_words_after_normalization():
+    messages = [
+        _message(1, 'Открыли новый ПАРК, ёлки!'),
+        _message(2, 'парковка закрыта'),
+        _message(3, ''),
+    ]
+
+    matched = ThemeSchedulerManager._filter_theme_messages(messages, _theme('город', 60, 'парк', 'елки'))
+
+    assert [el.id for el in matched] == [1]
+
+
+def test_matched_caption_brings_its_album():
+    messages = [
+        _message(1, '', grouped_id=7),
+        _message(2, 'фото из парка', grouped_id=7),
+        _message(3, '', grouped_id=7, chat_id='-1002'),
+        _message(4, 'без альбома'),
+        _message(5, '', grouped_id=8),
+    ]
+
+    matched = ThemeSchedulerManager._filter_theme_messages(messages, _theme('город', 60, 'парка'))
+
+    assert [el.id for el in matched] == [1, 2]
+
+
+def test_theme_jobs_are_coalesced_by_interval(monkeypatch):
+    themes = [_theme('город', 60), _theme('погода', 60), _theme('спорт', 300)]
+
+    monkeypatch.setattr(manager, 'COALESCE_THEME_JOBS', True)
+    assert ThemeSchedulerManager._theme_jobs(themes) == {
+        'theme_interval_60': (60, None),
+        'theme_interval_300': (300, None),
+    }
+
+    monkeypatch.setattr(manager, 'COALESCE_THEME_JOBS', False)
+    assert ThemeSchedulerManager._theme_jobs(themes) == {
+        'город': (60, 'город'),
+        'погода': (60, 'погода'),
+        'спорт': (300, 'спорт'),
+    }
+
+
+THEMES = [
+    _theme('город', 60, 'парк'),
+    _theme('сводка', 60, 'парк', delivery_mode='digest'),
+    _theme('отдых', 60, 'парк', 'пляж'),
+]
+MESSAGES = [_message(1, 'новый парк'), _message(2, 'городской пляж')]
+
+
+def test_message_of_several_themes_is_sent_once_and_always_in_digest():
+    deliveries = ThemeSchedulerManager._theme_deliveries(MESSAGES, THEMES)
+
+    assert [(theme.theme_name, [el.id for el in msgs], count) for theme, msgs, count in deliveries] == [
+        ('город', [1], 1),
+        ('сводка', [1], 1),
+        ('отдых', [2], 2),
+    ]
+
+
+class FakeMatchStats:
+    def track(self, kind, names):
+        pass
+
+    def add(self, kind, names, amount=1):
+        pass
+
+
+def _run_jobs(theme_names) -> list:
+    sent = []
+
+    async def all_themes():
+        return THEMES
+
+    async def messages_by_interval(interval):
+        return MESSAGES
+
+    async def send_messages(messages, lane):
+        sent.append(('messages', [el.id for el in messages]))
+
+    async def send_digest(theme, messages):
+        sent.append((theme.theme_name, [el.id for el in messages]))
+
+    scheduler = ThemeSchedulerManager.__new__(ThemeSchedulerManager)
+    scheduler.db_manager = SimpleNamespace(themes=SimpleNamespace(all_themes=all_themes))
+    scheduler.match_stats = FakeMatchStats()
+    scheduler._get_messages_by_interval = messages_by_interval
+    scheduler._send_messages = send_messages
+    scheduler._send_digest = send_digest
+
+    async def run():
+        for theme_name in theme_names:
+            await scheduler._send_messages_job(60, theme_name)
+
+    asyncio.run(run())
+    return sent
+
+
+def test_coalesced_and_per_theme_jobs_deliver_the_same():
+    coalesced = _run_jobs([None])
+    per_theme = _run_jobs([theme.theme_name for theme in THEMES])
+
+    assert coalesced == per_theme == [('messages', [1]), ('сводка', [1]), ('messages', [2])]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from data.dataclasses import ImportThemeDB, KeywordsDB, ThemeDB
+from keywords.transfer import KeywordsTransfer, parse_csv, parse_import_file, parse_json
+
+THEMES = [
+    ThemeDB(
+        id=1, theme_name='Новости, города', is_following=True, interval=60,
+        keywords=[KeywordsDB(id=1, word='парк'), KeywordsDB(id=2, word='парка')],
+        delivery_mode='digest', priority='urgent'
+    ),
+    ThemeDB(id=2, theme_name='погода', is_following=False, interval=15, keywords=[]),
+]
+
+
+class FakeKeywords:
+    async def get_keywords(self):
+        return {'парка', 'парк', 'дождь'}
+
+
+class FakeThemes:
+    async def all_themes(self):
+        return THEMES
+
+
+def _export(fmt: str) -> bytes:
+    transfer = KeywordsTransfer(FakeKeywords(), FakeThemes())
+    return '\n'.join(asyncio.run(transfer.export_items(fmt))).encode('utf8')
+
+
+EXPECTED_THEMES = [
+    ImportThemeDB(theme_name='Новости, города', interval=60, keywords=['парк', 'парка'], is_following=True,
+                  delivery_mode='digest', priority='urgent'),
+    ImportThemeDB(theme_name='погода', interval=15, keywords=[], is_following=False,
+                  delivery_mode='messages', priority='normal'),
+]
+
+
+@pytest.mark.parametrize('fmt, parse', [('json', parse_json), ('csv', parse_csv)])
+def test_export_round_trip(fmt, parse):
+    data = parse(_export(fmt))
+
+    assert data.keywords == []
+    assert data.forms == ['дождь', 'парк', 'парка']
+    assert data.themes == EXPECTED_THEMES
+
+
+def test_csv_keywords_and_defaults():
+    data = parse_csv("type,value\nkeyword, Дом \ntheme,спорт,30,,мяч;гол\n".encode('utf8'))
+
+    assert data.keywords == ['дом']
+    assert data.themes == [ImportThemeDB(theme_name='спорт', interval=30, keywords=['мяч', 'гол'])]
+
+
+@pytest.mark.parametrize('filename, content', [
+    ('words.csv', b'unknown,value'),
+    ('words.csv', b'keyword,123'),
+    ('words.json', b'[1, 2]'),
+    ('words.json', b'{"themes": [{"name": "a", "interval": "x"}]}'),
+    ('words.json', b'{"themes": [{"name": "a", "interval": 1, "priority": "fast"}]}'),
+    ('words.txt', b''),
+])
+def test_invalid_files_are_rejected(filename, content):
+    with pytest.raises(ValueError):
+        parse_import_file(filename, content)
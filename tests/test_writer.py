@@ -0,0 +1,34 @@
+import json
+
+from tracing import FileSpanExporter, JsonLinesWriter, Tracer
+
+
+def test_close_writes_queued_records(tmp_path):
+    path = tmp_path / 'out' / 'records.jsonl'
+    writer = JsonLinesWriter(str(path), flush_seconds=60)
+
+    for i in range(100):
+        assert writer.write({'id': i, 'text': 'сообщение'})
+
+    writer.close()
+
+    lines = path.read_text(encoding='utf8').splitlines()
+    assert [json.loads(line)['id'] for line in lines] == list(range(100))
+    assert not writer.thread.is_alive()
+
+
+
+def test_file_span_exporter_writes_spans_on_close(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracer = Tracer(FileSpanExporter(str(path)))
+
+    with tracer.span('parent', chat_id='1'):
+        with tracer.span('child'):
+            pass
+
+    tracer.close()
+
+    spans = [json.loads(line) for line in path.read_text(encoding='utf8').splitlines()]
+    assert [el['name'] for el in spans] == ['child', 'parent']
+    assert spans[0]['attributes'] == {'chat_id': '1'}
+    assert spans[0]['parent_id'] == spans[1]['span_id']
@@ -0,0 +1,24 @@
+from loguru import logger
+
+from config import TRACING_EXPORTER, TRACING_FILENAME
+from .tracer import Tracer, OpenTelemetryTracer, Span, SpanExporter, ConsoleSpanExporter, FileSpanExporter
+from .writer import JsonLinesWriter
+
+
+def _create_tracer() -> Tracer:
+    if TRACING_EXPORTER == 'console':
+        return Tracer(ConsoleSpanExporter())
+
+    if TRACING_EXPORTER == 'file':
+        return Tracer(FileSpanExporter(TRACING_FILENAME))
+
+    if TRACING_EXPORTER == 'otel':
+        try:
+            return OpenTelemetryTracer()
+        except ImportError:
+            logger.error("Пакет opentelemetry не установлен, трассировка отключена")
+
+    return Tracer()
+
+
+tracer = _create_tracer()
@@ -0,0 +1,143 @@
+import json
+import random
+import time
+from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from loguru import logger
+
+from .writer import JsonLinesWriter
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration_ms': round((self.end - self.start) * 1000, 3) if self.end else None,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+class SpanExporter(metaclass=ABCMeta):
+    @abstractmethod
+    def export(self, span: Span):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSpanExporter(SpanExporter):
+    def export(self, span: Span):
+        logger.debug(f"[Trace] {json.dumps(span.to_dict(), ensure_ascii=False, default=str)}")
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Записывает завершенные спаны в файл, по одному JSON на строку.
+    Файл пишет фоновый поток пачками, в event loop спан только ставится в очередь
+    """
+
+    def __init__(self, path: str):
+        self.writer = JsonLinesWriter(path)
+
+    def export(self, span: Span):
+        self.writer.write(span.to_dict())
+
+    def close(self):
+        self.writer.close()
+
+
+class Tracer:
+    """
+    Трассировка этапов обработки. Без экспортера спаны не создаются (no-op).
+    Дочерние спаны получают trace_id родителя и его атрибуты (chat_id, message_id)
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter] = None):
+        self.exporter = exporter
+
+    def close(self):
+        """
+        Дописать спаны, которые экспортер еще не отправил
+        """
+        if self.exporter is not None:
+            self.exporter.close()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span | _NoopSpan]:
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+
+        parent = _current_span.get()
+        if parent is not None:
+            attributes = {**parent.attributes, **attributes}
+
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else f"{random.getrandbits(128):032x}",
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes
+        )
+        token = _current_span.set(span)
+
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time()
+            _current_span.reset(token)
+            self.exporter.export(span)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Передает спаны в OpenTelemetry SDK (нужен пакет opentelemetry-api и настроенный провайдер)
+    """
+
+    def __init__(self):
+        super().__init__()
+        from opentelemetry import trace
+
+        self.otel_tracer = trace.get_tracer('telethon_parser')
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Any]:
+        with self.otel_tracer.start_as_current_span(
+                name,
+                attributes={key: str(value) for key, value in attributes.items()}
+        ) as span:
+            yield span
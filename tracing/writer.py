@@ -0,0 +1,85 @@
+import json
+import os
+import queue
+import threading
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+_STOP = object()
+
+
+class JsonLinesWriter:
+    """
+    Запись JSON строк в файл из фонового потока.
+    write только кладет запись в очередь, поток держит файл открытым и записывает
+    накопившиеся записи одной пачкой, поэтому обработчики не ждут диск.
+    Если очередь переполнена, новые записи отбрасываются. close дописывает очередь и закрывает файл
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000, flush_seconds: float = 1.0):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.thread = threading.Thread(target=self._run, name=f"jsonl-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def write(self, data: Dict[str, Any]) -> bool:
+        """
+        :return: False, если запись отброшена из-за переполненной очереди
+        """
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def close(self, timeout: float = 5):
+        if not self.thread.is_alive():
+            return
+
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} records of {self.path}: write queue was full")
+
+    def _batch(self) -> Tuple[List[str], bool]:
+        try:
+            item = self.queue.get(timeout=self.flush_seconds)
+        except queue.Empty:
+            return [], False
+
+        lines = []
+
+        while item is not _STOP:
+            lines.append(json.dumps(item, ensure_ascii=False, default=str))
+
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return lines, False
+
+        return lines, True
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf8') as f:
+            stop = False
+
+            while not stop:
+                lines, stop = self._batch()
+
+                if not lines:
+                    continue
+
+                try:
+                    f.write('\n'.join(lines) + '\n')
+                    f.flush()
+                except OSError as e:
+                    logger.error(f"Failed to write {len(lines)} records to {self.path}: {e}")